@@ -0,0 +1,286 @@
+"""
+Benchmarks of the package itself
+
+Each benchmark is a subcommand of `flatlands-bench`, and a function returning its results as a dict.
+
+startup: time to import the package and to construct a headless env, each measured in a fresh interpreter, along
+         with the heavy optional modules which were loaded on the way (a headless env should not need pygame or pyproj)
+memory:  bytes allocated per track point by a loaded track, per headless env sharing it and per car of a
+         FlatlandsVecEnv, measured with tracemalloc. The memory-mapped track arrays (see flatlands_sim/store.py) are
+         shared between processes and don't count.
+spatial: build and query times of the nearest track point backends (see flatlands_sim/spatial.py) on the track
+         resampled to several sizes, and the fastest of them for each size
+controllers: time per call of the batched baseline controllers (see flatlands/controllers.py) and of the vec env
+         steps they drive, by number of cars, along with the share of cars that stayed on the track
+
+Usage as follows:
+    flatlands-bench startup --repeat 5
+    flatlands-bench memory --num-envs 1000
+    flatlands-bench spatial --sizes 100,1000,10000 --batch-size 1
+    flatlands-bench controllers --num-envs 1000,10000 --steps 200
+
+    results = measure_startup(repeat=5)
+"""
+
+import gc
+import sys
+import json
+import time
+import logging
+import argparse
+import tracemalloc
+import subprocess
+
+import numpy as np
+
+LOGGER = logging.getLogger("bench")
+
+# Startup stages, each timed in its own interpreter
+STARTUP_STAGES = {
+    "import flatlands": "import flatlands",
+    "import flatlands.envs": "import flatlands.envs",
+    "headless env": "from flatlands.envs import FlatlandsEnv; FlatlandsEnv(seed=0)",
+}
+
+# Modules worth knowing about when they get loaded
+HEAVY_MODULES = ("gym", "scipy", "pygame", "pyproj")
+
+_STARTUP_SCRIPT = """
+import sys, json, time
+start = time.perf_counter()
+exec({statement!r})
+elapsed = time.perf_counter() - start
+print(json.dumps({{"elapsed": elapsed, "modules": [name for name in {modules!r} if name in sys.modules]}}))
+"""
+
+
+def measure_startup(repeat=5, stages=None):
+    """
+    Times the startup stages in fresh interpreters
+
+    Accepts:
+        repeat: number of interpreters to run per stage
+        stages: a dict of stage name -> Python statement, STARTUP_STAGES by default
+    Returns:
+        A dict of stage name -> {"best", "median"} times in seconds and the list of heavy "modules" it loaded
+    """
+
+    results = {}
+    for name, statement in (stages or STARTUP_STAGES).items():
+        script = _STARTUP_SCRIPT.format(statement=statement, modules=HEAVY_MODULES)
+
+        times = []
+        modules = []
+        for _ in range(repeat):
+            output = subprocess.run([sys.executable, "-c", script], check=True, stdout=subprocess.PIPE).stdout
+            # The measurement is the last line, anything before it was printed by the imported modules
+            result = json.loads(output.decode().strip().splitlines()[-1])
+            times.append(result["elapsed"])
+            modules = result["modules"]
+
+        results[name] = {"best": min(times), "median": float(np.median(times)), "modules": modules}
+        LOGGER.debug("%s: %s", name, results[name])
+
+    return results
+
+
+def measure_memory(num_envs=1000, track_file=None):
+    """
+    Measures the memory taken by a track and by the envs driving on it
+
+    Accepts:
+        num_envs: number of envs (and of vec env cars) to create
+        track_file: the track to load, the one installed with the package by default
+    Returns:
+        A dict holding the number of track points, the bytes per track point, per env and per vec env car
+    """
+
+    from .envs import FlatlandsEnv, FlatlandsVecEnv
+    from .envs.flatlands_env import DEFAULT_MAP_FILE
+    from .envs.flatlands_sim.world import WorldMap
+
+    track_file = track_file or DEFAULT_MAP_FILE
+
+    # Get the one-off allocations (module level caches, numpy internals) out of the way
+    FlatlandsEnv(seed=0, world=WorldMap(track_file)).reset()
+    FlatlandsVecEnv(1, seed=0, world=WorldMap(track_file)).reset()
+
+    tracemalloc.start()
+    try:
+        world, track_bytes = _traced(lambda: WorldMap(track_file))
+
+        def make_envs():
+            envs = [FlatlandsEnv(seed=env_id, noise=1, world=world) for env_id in range(num_envs)]
+            for env in envs:
+                env.step(env.action_space.high / 2)
+                env.reset()
+            return envs
+
+        _, env_bytes = _traced(make_envs)
+        _, vec_env_bytes = _traced(lambda: FlatlandsVecEnv(num_envs, seed=0, world=world).reset())
+    finally:
+        tracemalloc.stop()
+
+    num_points = len(world.path_array)
+    return {
+        "track_points": num_points,
+        "bytes_per_track_point": track_bytes / num_points,
+        "bytes_per_env": env_bytes / num_envs,
+        "bytes_per_vec_env_car": vec_env_bytes / num_envs,
+    }
+
+
+def measure_spatial(sizes=(100, 1000, 10000, 100000), num_queries=4096, batch_size=None, track_file=None):
+    """
+    Times the spatial index backends on the track, resampled to each number of points
+
+    Accepts:
+        sizes: numbers of track points to resample the track to
+        num_queries: number of query points around the track
+        batch_size: number of points per query call, all at once by default (1 for the queries of a FlatlandsEnv)
+        track_file: the track to resample, the one installed with the package by default
+    Returns:
+        A dict of size -> {"fastest": backend name, "timings": see spatial.time_backends}
+    """
+
+    from .envs.flatlands_env import DEFAULT_MAP_FILE
+    from .envs.flatlands_sim.world import load_world
+    from .envs.flatlands_sim.spatial import select_backend, benchmark_queries
+
+    world = load_world(track_file or DEFAULT_MAP_FILE)
+
+    results = {}
+    for size in sizes:
+        # Evenly spaced along the track, like a track file recorded at that density
+        arc_lengths = np.linspace(0, world.path_arc_length[-1], size)
+        points = np.stack([np.interp(arc_lengths, world.path_arc_length, world.path_array[:, axis]) for axis in (0, 1)],
+                          axis=-1)
+
+        queries = benchmark_queries(points, num_queries=num_queries)
+        fastest, timings = select_backend(points, queries=queries, batch_size=batch_size)
+        results[size] = {"fastest": fastest, "timings": timings}
+        LOGGER.debug("%d points: %s", size, results[size])
+
+    return results
+
+
+def measure_controllers(num_envs=(1000, 10000), steps=200, steerings=("pure_pursuit", "stanley"), track_file=None):
+    """
+    Drives FlatlandsVecEnv cars with the baseline controllers, timing the controllers and the env steps apart
+
+    Accepts:
+        num_envs: numbers of cars to drive
+        steps: number of steps to drive them for
+        steerings: steering controllers to drive with, see BaselineController.for_vec_env
+        track_file: the track to drive on, the one installed with the package by default
+    Returns:
+        A dict of steering -> number of cars -> {"control", "step"} seconds per call and "on_track", the share of
+        cars which never touched the track edge
+    """
+
+    from .envs.flatlands_env import DEFAULT_MAP_FILE
+    from .envs.flatlands_sim.world import load_world
+    from .envs.flatlands_vec_env import FlatlandsVecEnv
+    from .controllers import BaselineController
+
+    world = load_world(track_file or DEFAULT_MAP_FILE)
+
+    results = {}
+    for steering in steerings:
+        results[steering] = {}
+        for count in num_envs:
+            vec_env = FlatlandsVecEnv(count, seed=0, off_track="any", world=world)
+            controller = BaselineController.for_vec_env(vec_env, steering=steering)
+            observations = vec_env.reset()
+
+            control = step = 0.0
+            for _ in range(steps):
+                start = time.perf_counter()
+                actions = controller(observations, vec_env.states)
+                middle = time.perf_counter()
+                observations, _, dones = vec_env.step(actions)
+                control += middle - start
+                step += time.perf_counter() - middle
+
+            results[steering][count] = {
+                "control": control / steps,
+                "step": step / steps,
+                "on_track": float(np.mean(~dones)),
+            }
+            LOGGER.debug("%s with %d cars: %s", steering, count, results[steering][count])
+
+    return results
+
+
+def _traced(function):
+    """
+    Calls function, and measures the memory still allocated by its result once it returns
+
+    Accepts: function: a function without arguments
+    Returns: a 2-tuple of its result and the number of bytes
+    """
+
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    result = function()
+    gc.collect()
+    return result, tracemalloc.get_traced_memory()[0] - before
+
+
+def main(argv=None):
+    """
+    Command line entry point, see `flatlands-bench --help`
+    """
+
+    parser = argparse.ArgumentParser(description="Benchmarks of the flatlands package")
+    subparsers = parser.add_subparsers(dest="benchmark")
+    subparsers.required = True
+
+    startup_parser = subparsers.add_parser("startup", help="import and env construction time")
+    startup_parser.add_argument("--repeat", type=int, default=5, help="number of interpreters to run per stage")
+
+    memory_parser = subparsers.add_parser("memory", help="bytes per track point, per env and per vec env car")
+    memory_parser.add_argument("--num-envs", type=int, default=1000, help="number of envs to create")
+    memory_parser.add_argument("--track", default=None, help="track file (default: the one installed with the package)")
+
+    spatial_parser = subparsers.add_parser("spatial", help="nearest track point backends by track size")
+    spatial_parser.add_argument("--sizes", default="100,1000,10000,100000", help="comma separated track point counts")
+    spatial_parser.add_argument("--num-queries", type=int, default=4096, help="number of query points")
+    spatial_parser.add_argument("--batch-size", type=int, default=None, help="points per query (default: all at once)")
+    spatial_parser.add_argument("--track", default=None, help="track file to resample (default: the installed one)")
+
+    controllers_parser = subparsers.add_parser("controllers", help="baseline controller and vec env step times")
+    controllers_parser.add_argument("--num-envs", default="1000,10000", help="comma separated numbers of cars")
+    controllers_parser.add_argument("--steps", type=int, default=200, help="number of steps to drive for")
+    controllers_parser.add_argument("--track", default=None, help="track file (default: the one installed)")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+
+    if args.benchmark == "startup":
+        for name, result in measure_startup(repeat=args.repeat).items():
+            print("{:>22}: best {:7.1f} ms, median {:7.1f} ms, loaded {}".format(
+                name, result["best"] * 1000, result["median"] * 1000, ", ".join(result["modules"]) or "-"))
+    elif args.benchmark == "memory":
+        logging.getLogger("vehicle").setLevel(logging.WARNING)
+        for name, value in measure_memory(num_envs=args.num_envs, track_file=args.track).items():
+            print("{:>22}: {:,.0f}".format(name, value))
+    elif args.benchmark == "spatial":
+        sizes = [int(size) for size in args.sizes.split(",")]
+        results = measure_spatial(
+            sizes, num_queries=args.num_queries, batch_size=args.batch_size, track_file=args.track)
+        for size, result in results.items():
+            print("{:>8} points: fastest {}".format(size, result["fastest"]))
+            for name, timing in result["timings"].items():
+                print("{:>22}: build {:9.2f} ms, query {:8.3f} us per point".format(
+                    name, timing["build"] * 1000, timing["query"] * 1e6))
+    elif args.benchmark == "controllers":
+        num_envs = [int(count) for count in args.num_envs.split(",")]
+        for steering, results in measure_controllers(num_envs, steps=args.steps, track_file=args.track).items():
+            for count, result in results.items():
+                print("{:>12} {:>8} cars: control {:8.2f} ms, step {:8.2f} ms per call, {:6.1%} on track".format(
+                    steering, count, result["control"] * 1000, result["step"] * 1000, result["on_track"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+"""
+Batched baseline controllers
+
+Classic path following controllers, computed for any number of cars with a few array operations and no Python loop
+over the cars, so they drive thousands of `FlatlandsVecEnv` cars per call. They serve as expert policies (e.g. to
+generate demonstrations), as sanity baselines for learned policies and as a throughput reference.
+
+Steering:
+    PurePursuit:    steers the rear axle onto the arc through the observed track point `lookahead` meters ahead,
+                    needs the observations only
+    Stanley:        steers the front wheels against the heading error and the cross track error of the front axle,
+                    measured on the world's centerline
+Speed:
+    PIDSpeed:       tracks a target speed, lowered in turns so that the lateral acceleration stays bounded
+
+`BaselineController` combines a steering and a speed controller into [accel, wheel_angle] actions. Everything uses the
+conventions of the vec env: observations of shape (N, M, 2) holding the upcoming track points to the right (x) and to
+the front (y) of every car, and states of shape (N, >= 4) holding [x, y, theta, velocity] rows, velocities in meters
+per step.
+
+Usage as follows:
+    vec_env = FlatlandsVecEnv(4096)
+    controller = BaselineController.for_vec_env(vec_env, steering="pure_pursuit")
+    observations = vec_env.reset()
+    for _ in range(1000):
+        observations, rewards, dones = vec_env.step(controller(observations, vec_env.states))
+"""
+
+import logging
+from math import pi
+
+import numpy as np
+
+LOGGER = logging.getLogger("controllers")
+
+# Column indexes of the vec env state rows, see flatlands_sim/kinematics.py
+_X, _Y, _THETA, _VELOCITY = range(4)
+
+
+class PurePursuit(object):
+    """
+    Pure pursuit steering on the observed track points
+    """
+
+    def __init__(self, wheelbase=2.6, max_wheel_angle=pi / 3, min_lookahead=4.0, lookahead_steps=6.0):
+        """
+        :param wheelbase:       distance between the rear and front axle in meters
+        :param max_wheel_angle: wheel angles are clipped to [-max_wheel_angle, max_wheel_angle]
+        :param min_lookahead:   lookahead distance in meters when standing still
+        :param lookahead_steps: the lookahead grows by the distance covered in this many steps at the current speed
+        """
+
+        self.wheelbase = wheelbase
+        self.max_wheel_angle = max_wheel_angle
+        self.min_lookahead = min_lookahead
+        self.lookahead_steps = lookahead_steps
+
+    def steer(self, observations, states):
+        """
+        Computes the wheel angles of a batch of cars
+
+        The target of every car is the point of the observed polyline (starting at the car) at the lookahead distance
+        from it, or the last observed point if all of them are closer. The rear axle reaches it on an arc of curvature
+        2 * x / d^2, d being the distance and x the lateral offset of the target.
+
+        Accepts:
+            observations: array of shape (N, M, 2) holding the upcoming track points of every car, in its frame
+            states: array of shape (N, >= 4) holding [x, y, theta, velocity] rows
+        Returns: an array of shape (N,) holding the wheel angles
+        """
+
+        observations = np.asarray(observations, dtype=np.float64)
+        lookahead = self.min_lookahead + self.lookahead_steps * np.asarray(states)[:, _VELOCITY]
+
+        # Distances of the observed points from the car, the segment crossing the lookahead circle holds the target
+        distances = np.hypot(observations[..., 0], observations[..., 1])
+        beyond = distances >= lookahead[:, None]
+        index = np.where(beyond.any(axis=1), np.argmax(beyond, axis=1), observations.shape[1] - 1)
+
+        rows = np.arange(len(observations))
+        end = observations[rows, index]
+        end_distance = distances[rows, index]
+        # The polyline starts at the car, so the first segment starts at the origin
+        start = np.where((index > 0)[:, None], observations[rows, index - 1], 0.0)
+        start_distance = np.where(index > 0, distances[rows, index - 1], 0.0)
+
+        # Interpolating on the distances approximates the circle intersection well for the short segments of a track
+        span = end_distance - start_distance
+        fraction = np.clip((lookahead - start_distance) / np.where(span > 0, span, 1.0), 0.0, 1.0)
+        target = start + fraction[:, None] * (end - start)
+
+        squared = np.maximum(np.square(target[:, 0]) + np.square(target[:, 1]), 1e-9)
+        wheel_angles = np.arctan(2 * self.wheelbase * target[:, 0] / squared)
+        return np.clip(wheel_angles, -self.max_wheel_angle, self.max_wheel_angle)
+
+
+class Stanley(object):
+    """
+    Stanley steering on the world's centerline
+    """
+
+    def __init__(self, world, wheelbase=2.6, max_wheel_angle=pi / 3, gain=0.5, softening=0.1, level=None):
+        """
+        :param world:           the WorldMap the cars drive on
+        :param wheelbase:       distance between the rear and front axle in meters
+        :param max_wheel_angle: wheel angles are clipped to [-max_wheel_angle, max_wheel_angle]
+        :param gain:            weight of the cross track error, per step
+        :param softening:       speed in meters per step added to the car's, keeps the cross track term bounded at
+                                low speeds
+        :param level:           level of detail of the centerline to measure the errors on, see WorldMap.get_lod
+        """
+
+        self.world = world
+        self.wheelbase = wheelbase
+        self.max_wheel_angle = max_wheel_angle
+        self.gain = gain
+        self.softening = softening
+        self.level = level
+
+    def steer(self, observations, states):
+        """
+        Computes the wheel angles of a batch of cars
+
+        Accepts:
+            observations: unused, for the interface shared with PurePursuit
+            states: array of shape (N, >= 4) holding [x, y, theta, velocity] rows
+        Returns: an array of shape (N,) holding the wheel angles
+        """
+
+        states = np.asarray(states, dtype=np.float64)
+        theta = states[:, _THETA]
+        front = states[:, _X:_Y + 1] + self.wheelbase * np.stack([np.sin(theta), np.cos(theta)], axis=-1)
+
+        # Lateral offsets are positive to the right of the track, headings grow clockwise
+        _, offsets, headings = self.world.to_frenet(front, level=self.level)
+        heading_errors = (headings - theta + pi) % (2 * pi) - pi
+        cross_track = np.arctan2(-self.gain * offsets, self.softening + np.abs(states[:, _VELOCITY]))
+
+        return np.clip(heading_errors + cross_track, -self.max_wheel_angle, self.max_wheel_angle)
+
+
+class PIDSpeed(object):
+    """
+    PID control of the speed of a batch of cars, each with its own integral and previous error
+    """
+
+    def __init__(self,
+                 num_envs,
+                 target_speed=0.5,
+                 kp=0.5,
+                 ki=0.01,
+                 kd=0.0,
+                 max_accel=0.1,
+                 max_lateral_accel=0.05,
+                 wheelbase=2.6):
+        """
+        :param num_envs:            number of cars
+        :param target_speed:        speed to keep on straights in meters per step, a scalar or an (num_envs,) array
+        :param kp, ki, kd:          proportional, integral and derivative gains
+        :param max_accel:           accelerations are clipped to [-max_accel, max_accel]
+        :param max_lateral_accel:   turns lower the target speed to sqrt(max_lateral_accel / curvature), the
+                                    curvature being the one of the wheel angle (meters per step^2, None to disable)
+        :param wheelbase:           distance between the rear and front axle in meters, for the curvature
+        """
+
+        self.num_envs = num_envs
+        self.target_speed = target_speed
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.max_accel = max_accel
+        self.max_lateral_accel = max_lateral_accel
+        self.wheelbase = wheelbase
+
+        self.integral = np.zeros(num_envs)
+        self.previous_error = np.zeros(num_envs)
+
+    def reset(self, env_ids=None):
+        """
+        Clears the integral and the previous error of cars, e.g. after resetting them
+
+        Accepts: env_ids: indexes of the cars, all of them by default
+        Returns: Nothing
+        """
+
+        env_ids = slice(None) if env_ids is None else env_ids
+        self.integral[env_ids] = 0
+        self.previous_error[env_ids] = 0
+
+    def accel(self, states, wheel_angles=None, env_ids=None):
+        """
+        Computes the accelerations of a batch of cars, and updates their integral and previous error
+
+        Accepts:
+            states: array of shape (N, >= 4) holding [x, y, theta, velocity] rows
+            wheel_angles: array of shape (N,) holding the wheel angles about to be applied, for the turn speeds
+            env_ids: indexes of the N cars, all of them by default
+        Returns: an array of shape (N,) holding the accelerations
+        """
+
+        env_ids = slice(None) if env_ids is None else np.asarray(env_ids, dtype=np.intp)
+        velocities = np.asarray(states, dtype=np.float64)[:, _VELOCITY]
+
+        target = np.broadcast_to(self.target_speed, (self.num_envs, ))[env_ids]
+        if self.max_lateral_accel is not None and wheel_angles is not None:
+            curvature = np.abs(np.tan(wheel_angles)) / self.wheelbase
+            target = np.minimum(target, np.sqrt(self.max_lateral_accel / np.maximum(curvature, 1e-9)))
+
+        errors = target - velocities
+        self.integral[env_ids] += errors
+        derivative = errors - self.previous_error[env_ids]
+        self.previous_error[env_ids] = errors
+
+        accel = self.kp * errors + self.ki * self.integral[env_ids] + self.kd * derivative
+        return np.clip(accel, -self.max_accel, self.max_accel)
+
+
+class BaselineController(object):
+    """
+    Combines a steering controller and a PIDSpeed into [accel, wheel_angle] actions
+    """
+
+    def __init__(self, steering, speed):
+        """
+        :param steering:    a PurePursuit or a Stanley (any object with a steer(observations, states) method)
+        :param speed:       a PIDSpeed
+        """
+
+        self.steering = steering
+        self.speed = speed
+
+    @classmethod
+    def for_vec_env(cls, vec_env, steering="pure_pursuit", target_speed=None, **kwargs):
+        """
+        Builds a controller with the vehicle parameters of a vec env
+
+        Accepts:
+            vec_env: a FlatlandsVecEnv
+            steering: "pure_pursuit" or "stanley"
+            target_speed: speed to keep on straights, 60% of the env's max velocity by default
+            kwargs: extra keyword arguments of the steering controller
+        Returns: a BaselineController for all the cars of the env
+        """
+
+        params = vec_env.vehicle_params
+        common = {"wheelbase": params["wheelbase"], "max_wheel_angle": params["max_wheel_angle"]}
+        if steering == "pure_pursuit":
+            steering = PurePursuit(**dict(common, **kwargs))
+        elif steering == "stanley":
+            steering = Stanley(vec_env.world, **dict(common, **kwargs))
+        else:
+            raise ValueError("Unknown steering controller {}, expected 'pure_pursuit' or 'stanley'".format(steering))
+
+        if target_speed is None:
+            target_speed = 0.6 * params["max_velocity"]
+        speed = PIDSpeed(vec_env.num_envs,
+                         target_speed=target_speed,
+                         max_accel=params["max_accel"],
+                         wheelbase=params["wheelbase"])
+
+        return cls(steering, speed)
+
+    def reset(self, env_ids=None):
+        """
+        Resets the speed controller state of cars, see PIDSpeed.reset
+        """
+
+        self.speed.reset(env_ids)
+
+    def __call__(self, observations, states, env_ids=None):
+        """
+        Computes the actions of a batch of cars
+
+        Accepts:
+            observations: array of shape (N, M, 2) holding the upcoming track points of every car
+            states: array of shape (N, >= 4) holding [x, y, theta, velocity] rows
+            env_ids: indexes of the N cars in the speed controller, all of them by default
+        Returns: an array of shape (N, 2) holding [accel, wheel_angle] rows, as taken by FlatlandsVecEnv.step
+        """
+
+        actions = np.empty((len(states), 2))
+        actions[:, 1] = self.steering.steer(observations, states)
+        actions[:, 0] = self.speed.accel(states, wheel_angles=actions[:, 1], env_ids=env_ids)
+        return actions
@@ -0,0 +1,327 @@
+"""
+Generates expert demonstration datasets
+
+Shards of transitions are driven by the baseline controllers of `flatlands.controllers` on `FlatlandsVecEnv` cars,
+over a pool of worker processes. Every shard is one vec env of `envs_per_shard` cars driven for `shard_steps` steps:
+cars start at random track points with random target speeds, the env adds its action noise and the driven wheel
+angles get extra Gaussian noise, so the demonstrations cover recoveries from off-center states. The recorded action is
+always the controller's, before any noise. Cars leaving the track end their episode and restart elsewhere.
+
+Shard i is seeded with seed + i, so a dataset is the same whatever the number of workers, and whichever shards an
+interrupted run had finished. Each shard is one compressed `.npz` file holding the columns below, rows ordered by car
+then step, and `manifest.json` lists the generation settings and the finished shards. Running the same command again
+resumes: only the shards missing from the manifest are generated, and a larger number of shards extends the dataset.
+
+Columns:
+    observation     (num_points, 2) float32, the observation before the step
+    state           (4,) float32, the [x, y, theta, velocity] of the car before the step
+    action          (2,) float32, the controller's [accel, wheel_angle]
+    done            bool, whether the car left the track with this step, ending its episode
+    episode         int32, the car's episode, numbered within the shard
+    step            int32, the step within the episode
+
+Usage as follows:
+    flatlands-dataset runs/demos --shards 256 --envs-per-shard 1024 --shard-steps 1000 --workers 8
+
+    manifest = generate("runs/demos", num_shards=256)
+    columns = load_shard("runs/demos", manifest["shards"][0])
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+LOGGER = logging.getLogger("dataset")
+
+MANIFEST_NAME = "manifest.json"
+
+# dtypes of the stored columns. The track spans hundreds of meters, so float32 states keep sub-millimeter precision.
+COLUMN_DTYPES = {
+    "observation": np.float32,
+    "state": np.float32,
+    "action": np.float32,
+    "done": np.bool_,
+    "episode": np.int32,
+    "step": np.int32,
+}
+
+
+def generate(directory,
+             num_shards,
+             envs_per_shard=1024,
+             shard_steps=1000,
+             num_workers=None,
+             seed=0,
+             steering="pure_pursuit",
+             speed_range=(0.3, 0.9),
+             noise=5,
+             steering_noise=0.05,
+             env_kwargs=None):
+    """
+    Generates the shards of a dataset which are still missing, see the module docstring
+
+    Accepts:
+        directory: where to write the shards and the manifest (created if needed)
+        num_shards: number of shards of the complete dataset
+        envs_per_shard: number of cars driven in every shard
+        shard_steps: number of steps every shard drives its cars for
+        num_workers: number of worker processes, one per CPU by default. With 1, shards are generated in this process.
+        seed: shard i is seeded with seed + i
+        steering: steering controller of the expert, "pure_pursuit" or "stanley"
+        speed_range: bounds of the random target speed of every episode, as fractions of the max velocity
+        noise: action noise percentage of the env
+        steering_noise: standard deviation of the Gaussian noise added to the driven wheel angles, in radians
+        env_kwargs: extra keyword arguments for FlatlandsVecEnv (num_points, lookahead_distances, vehicle, ...)
+    Returns:
+        The manifest dict
+    """
+
+    # Everything a shard depends on, the number of shards may grow between runs
+    settings = {
+        "envs_per_shard": envs_per_shard,
+        "shard_steps": shard_steps,
+        "seed": seed,
+        "steering": steering,
+        "speed_range": list(speed_range),
+        "noise": noise,
+        "steering_noise": steering_noise,
+        "env_kwargs": dict(env_kwargs or {}),
+    }
+
+    os.makedirs(directory, exist_ok=True)
+    manifest = read_manifest(directory) if os.path.exists(os.path.join(directory, MANIFEST_NAME)) else None
+    if manifest is None:
+        manifest = {"settings": settings, "num_shards": num_shards, "columns": None, "shards": []}
+    elif manifest["settings"] != json.loads(json.dumps(settings)):
+        raise ValueError("{} holds a dataset generated with other settings: {}".format(directory, manifest["settings"]))
+
+    manifest["num_shards"] = max(num_shards, manifest["num_shards"])
+    done_shards = {shard["index"] for shard in manifest["shards"]}
+    pending = [index for index in range(num_shards) if index not in done_shards]
+    if done_shards:
+        LOGGER.info("Resuming with %d of %d shards done", len(done_shards), num_shards)
+    if not pending:
+        return manifest
+
+    if num_workers is None:
+        # Only the CPUs this process may run on, which can be fewer than the machine has
+        num_workers = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    num_workers = max(1, min(num_workers, len(pending)))
+    LOGGER.info("Generating %d shards of %d transitions on %d workers", len(pending), envs_per_shard * shard_steps,
+                num_workers)
+
+    start_time = time.perf_counter()
+    if num_workers == 1:
+        results = (_generate_shard(directory, index, settings) for index in pending)
+        _collect(directory, manifest, results, start_time)
+    else:
+        with ProcessPoolExecutor(num_workers) as executor:
+            futures = [executor.submit(_generate_shard, directory, index, settings) for index in pending]
+            _collect(directory, manifest, (future.result() for future in as_completed(futures)), start_time)
+
+    return manifest
+
+
+def read_manifest(directory):
+    """
+    Reads the manifest of a dataset
+
+    Accepts: directory: the directory of the dataset
+    Returns:
+        The manifest dict: "settings", "num_shards", "columns" (name -> {"dtype", "shape"}) and the finished "shards"
+    """
+
+    with open(os.path.join(directory, MANIFEST_NAME)) as manifest_file:
+        return json.load(manifest_file)
+
+
+def load_shard(directory, shard):
+    """
+    Loads the columns of a shard
+
+    Accepts:
+        directory: the directory of the dataset
+        shard: a manifest entry of the shard
+    Returns: a dict of column name -> array with a leading dimension of shard["transitions"]
+    """
+
+    with np.load(os.path.join(directory, shard["file"])) as columns:
+        return {name: columns[name] for name in columns.files}
+
+
+def _collect(directory, manifest, results, start_time):
+    """
+    Adds the shards to the manifest as they finish, rewriting it after each one so that an interruption loses at most
+    the shards being generated
+    """
+
+    transitions = 0
+    for shard, columns in results:
+        manifest["columns"] = columns
+        manifest["shards"] = sorted(manifest["shards"] + [shard], key=lambda entry: entry["index"])
+        _write_manifest(directory, manifest)
+
+        transitions += shard["transitions"]
+        LOGGER.info("Shard %d done: %d episodes, %.1f%% off track, %.0f transitions per second overall",
+                    shard["index"], shard["episodes"], 100 * shard["off_track"], transitions /
+                    (time.perf_counter() - start_time))
+
+
+def _write_manifest(directory, manifest):
+    """
+    Atomically replaces the manifest
+    """
+
+    manifest_path = os.path.join(directory, MANIFEST_NAME)
+    with open(manifest_path + ".tmp", "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def _generate_shard(directory, index, settings):
+    """
+    Drives the cars of one shard and writes its file
+
+    Accepts:
+        directory: the directory of the dataset
+        index: the shard index
+        settings: the settings dict of generate()
+    Returns: a 2-tuple of the manifest entry of the shard and the column descriptions
+    """
+
+    # Deferred so that the parent process of a pool doesn't need to load the track
+    from .envs.flatlands_vec_env import FlatlandsVecEnv
+    from .controllers import BaselineController
+
+    shard_seed = settings["seed"] + index
+    num_envs, num_steps = settings["envs_per_shard"], settings["shard_steps"]
+    rng = np.random.default_rng(shard_seed)
+
+    vec_env = FlatlandsVecEnv(num_envs, seed=shard_seed, noise=settings["noise"], off_track="any",
+                              **settings["env_kwargs"])
+    max_velocity = vec_env.vehicle_params["max_velocity"]
+    limit = vec_env.vehicle_params["max_wheel_angle"]
+    low, high = settings["speed_range"]
+
+    controller = BaselineController.for_vec_env(vec_env, steering=settings["steering"])
+    target_speeds = rng.uniform(low, high, num_envs) * max_velocity
+    controller.speed.target_speed = target_speeds
+
+    # Filled step by step, (num_steps, num_envs, ...) so that every step writes contiguous rows
+    columns = {
+        "observation": np.empty((num_steps, ) + vec_env.observations.shape, dtype=COLUMN_DTYPES["observation"]),
+        "state": np.empty((num_steps, num_envs, 4), dtype=COLUMN_DTYPES["state"]),
+        "action": np.empty((num_steps, num_envs, 2), dtype=COLUMN_DTYPES["action"]),
+        "done": np.empty((num_steps, num_envs), dtype=COLUMN_DTYPES["done"]),
+        "episode": np.empty((num_steps, num_envs), dtype=COLUMN_DTYPES["episode"]),
+        "step": np.empty((num_steps, num_envs), dtype=COLUMN_DTYPES["step"]),
+    }
+
+    observations = vec_env.reset()
+    episodes = np.arange(num_envs)
+    episode_steps = np.zeros(num_envs, dtype=np.int64)
+    num_episodes = num_envs
+    for step in range(num_steps):
+        actions = controller(observations, vec_env.states)
+        columns["observation"][step] = observations
+        columns["state"][step] = vec_env.states[:, :4]
+        columns["action"][step] = actions
+        columns["episode"][step] = episodes
+        columns["step"][step] = episode_steps
+
+        driven = actions.copy()
+        if settings["steering_noise"]:
+            driven[:, 1] = np.clip(driven[:, 1] + rng.normal(0, settings["steering_noise"], num_envs), -limit, limit)
+        observations, _, dones = vec_env.step(driven)
+        columns["done"][step] = dones
+        episode_steps += 1
+
+        ended = np.flatnonzero(dones)
+        if len(ended):
+            # Restarted cars keep their column of the shard but start a new episode
+            episodes[ended] = num_episodes + np.arange(len(ended))
+            num_episodes += len(ended)
+            episode_steps[ended] = 0
+            target_speeds[ended] = rng.uniform(low, high, len(ended)) * max_velocity
+            controller.reset(ended)
+            observations = vec_env.reset(ended)
+
+    # Rows ordered by car then step, so that the steps of an episode are contiguous
+    columns = {name: np.ascontiguousarray(column.swapaxes(0, 1)).reshape((-1, ) + column.shape[2:])
+               for name, column in columns.items()}
+
+    file_name = "shard_{:05d}.npz".format(index)
+    path = os.path.join(directory, file_name)
+    with open(path + ".tmp", "wb") as shard_file:
+        np.savez_compressed(shard_file, **columns)
+    os.replace(path + ".tmp", path)
+
+    shard = {
+        "index": index,
+        "file": file_name,
+        "seed": shard_seed,
+        "transitions": num_envs * num_steps,
+        "episodes": num_episodes,
+        "off_track": float(np.mean(columns["done"])),
+    }
+    descriptions = {
+        name: {"dtype": np.dtype(column.dtype).str, "shape": list(column.shape[1:])}
+        for name, column in columns.items()
+    }
+    return shard, descriptions
+
+
+def main(argv=None):
+    """
+    Command line entry point, see `flatlands-dataset --help`
+    """
+
+    parser = argparse.ArgumentParser(description="Generate expert demonstrations, see flatlands/dataset.py")
+    parser.add_argument("directory", help="directory of the dataset, generation resumes if it holds a manifest")
+    parser.add_argument("--shards", type=int, required=True, help="number of shards of the complete dataset")
+    parser.add_argument("--envs-per-shard", type=int, default=1024, help="number of cars driven in every shard")
+    parser.add_argument("--shard-steps", type=int, default=1000, help="number of steps driven in every shard")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: one per CPU)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first shard, the others follow")
+    parser.add_argument("--steering", choices=("pure_pursuit", "stanley"), default="pure_pursuit", help="expert")
+    parser.add_argument(
+        "--speed-range", type=float, nargs=2, default=(0.3, 0.9), help="target speeds, as fractions of the maximum")
+    parser.add_argument("--noise", type=float, default=5, help="action noise percentage of the env")
+    parser.add_argument("--steering-noise", type=float, default=0.05, help="wheel angle noise, in radians")
+    parser.add_argument("--num-points", type=int, default=5, help="number of upcoming points in each observation")
+    parser.add_argument("--lookahead", type=float, nargs="+", default=None, help="lookahead distances, in meters")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+
+    env_kwargs = {"num_points": args.num_points}
+    if args.lookahead is not None:
+        env_kwargs["lookahead_distances"] = args.lookahead
+
+    try:
+        manifest = generate(args.directory,
+                            args.shards,
+                            envs_per_shard=args.envs_per_shard,
+                            shard_steps=args.shard_steps,
+                            num_workers=args.workers,
+                            seed=args.seed,
+                            steering=args.steering,
+                            speed_range=args.speed_range,
+                            noise=args.noise,
+                            steering_noise=args.steering_noise,
+                            env_kwargs=env_kwargs)
+    except KeyboardInterrupt:
+        LOGGER.info("Generation interrupted, run the same command again to resume")
+        return
+    LOGGER.info("%s holds %d transitions in %d shards", args.directory,
+                sum(shard["transitions"] for shard in manifest["shards"]), len(manifest["shards"]))
+
+
+if __name__ == "__main__":
+    main()
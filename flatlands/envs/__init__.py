@@ -1 +1,25 @@
-from .flatlands_env import FlatlandsEnv
+"""
+The Flatlands environments, imported on first access like the simulator modules (see flatlands_sim)
+"""
+
+import importlib
+
+_EXPORTS = {
+    "FlatlandsEnv": "flatlands_env",
+    "FlatlandsVecEnv": "flatlands_vec_env",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+    value = getattr(importlib.import_module("." + _EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -4,15 +4,34 @@ Gym environment for a on-track driving simulator
 
 import sys
 import logging
-import random
+import functools
 from os import path
 
 import gym
+from gym import spaces
+import numpy as np
 
-from .flatlands_sim import DrawMap, BicycleModel, WorldMap
+from .flatlands_sim.world import load_world
+from .flatlands_sim.vehicle_model import BicycleModel, DynamicBicycleModel
+from .flatlands_sim.laps import LapTimer
+from .flatlands_sim.bounds import OFF_TRACK_MODES
+from .flatlands_sim.noise import NoiseBuffer, STATE_WORDS
+from ..viewer import StatePublisher
 
 LOGGER = logging.getLogger("flatlands_env")
 
+# Track installed with the package (see data_files in setup.py)
+DEFAULT_MAP_FILE = path.join(sys.prefix, "flatlands/original_circuit_green.csv")
+
+# A single env draws a couple of numbers per step, smaller noise blocks keep its footprint down
+NOISE_BLOCK_SIZE = 256
+
+# Vehicle models selectable with the `vehicle` argument
+VEHICLE_MODELS = {
+    "kinematic": BicycleModel,
+    "dynamic": DynamicBicycleModel,
+}
+
 
 class FlatlandsEnv(gym.Env):
     """
@@ -20,60 +39,401 @@ class FlatlandsEnv(gym.Env):
     """
     metadata = {'render.modes': ['human']}
 
-    def __init__(self):
+    def __init__(self,
+                 seed=None,
+                 noise=0,
+                 num_points=5,
+                 flat_observations=False,
+                 lookahead_distances=None,
+                 local_map_shape=None,
+                 local_map_resolution=0.5,
+                 sectors=(),
+                 lap_writer=None,
+                 off_track=None,
+                 off_track_resolution=None,
+                 vehicle="kinematic",
+                 vehicle_params=None,
+                 viewer_address=None,
+                 viewer_env_id=0,
+                 world=None):
         """
         Load the track, draw module, etc.
+
+        :param seed: seed for the environment's random number generator [optional]
+        :param noise: percentage of random noise added to the actions by the vehicle model [optional]
+        :param num_points: number of upcoming track points in each observation [optional]
+        :param flat_observations: return observations as a float32 array of shape (num_points, 2) instead of a
+            dict. `observation_space` declares either. [optional]
+        :param lookahead_distances: distances along the track (in meters) to observe the centerline at, instead
+            of the next `num_points` track points. In dict mode they are added as "lookahead_points". [optional]
+        :param local_map_shape: (H, W) of an ego-centric crop of the track raster to add to dict observations as
+            "local_map", see local_map() [optional]
+        :param local_map_resolution: side of a local map pixel, in meters [optional]
+        :param sectors: arc lengths (in meters after the start/finish line) at which timed sectors start [optional]
+        :param lap_writer: a LapWriter to stream a record of every completed lap to [optional]
+        :param off_track: end the episode (set `done`) when the vehicle leaves the track surface: "center" when its
+            center does, "any" as soon as any corner of its footprint does, "all" once every corner did. None never
+            ends it. [optional]
+        :param off_track_resolution: test the footprint against the track raster of this resolution (in meters, see
+            WorldMap.get_raster) instead of the exact track quads, a lookup per corner [optional]
+        :param vehicle: "kinematic" for the BicycleModel, "dynamic" for the DynamicBicycleModel with tire slip
+            [optional]
+        :param vehicle_params: keyword arguments for the vehicle model, e.g. dt or mass for the dynamic one [optional]
+        :param viewer_address: (host, port) to publish the car state to after every step, for a `flatlands-viewer`
+            to draw it from another process (see flatlands/viewer.py) [optional]
+        :param viewer_env_id: env id to publish the car state under, so that several envs can share a viewer
+            [optional]
+        :param world: the WorldMap to drive on, by default the track installed with the package, shared by all envs
+            of the process (see load_world) [optional]
         """
 
-        map_file = path.join(sys.prefix, "flatlands/original_circuit_green.csv")
+        # Arguments to rebuild the env with when unpickling, see __getstate__
+        self._init_args = {
+            "seed": seed,
+            "noise": noise,
+            "num_points": num_points,
+            "flat_observations": flat_observations,
+            "lookahead_distances": lookahead_distances,
+            "local_map_shape": local_map_shape,
+            "local_map_resolution": local_map_resolution,
+            "sectors": sectors,
+            "off_track": off_track,
+            "off_track_resolution": off_track_resolution,
+            "vehicle": vehicle,
+            "vehicle_params": vehicle_params,
+            "viewer_address": viewer_address,
+            "viewer_env_id": viewer_env_id,
+        }
+
+        # All the randomness of this env (placement and vehicle noise) is drawn from this buffer
+        self.noise_buffer = NoiseBuffer(seed, block_size=NOISE_BLOCK_SIZE)
+        self.np_random = self.noise_buffer.rng
 
-        self.world = WorldMap(map_file)
-        self.draw_class = DrawMap(world=self.world)
-        self.vehicle_model = BicycleModel(*self.world.path[0], self.world.direction[0], max_velocity=1)
+        self.world = world if world is not None else load_world(DEFAULT_MAP_FILE)
+        # The renderer (and pygame) is only loaded by the first render()
+        self.draw_class = None
+        # Renders out of process instead, by sending the car state to a viewer
+        self.publisher = None if viewer_address is None else StatePublisher(viewer_address, env_id=viewer_env_id)
+        if vehicle not in VEHICLE_MODELS:
+            raise ValueError("Unknown vehicle model {}, expected one of {}".format(vehicle, list(VEHICLE_MODELS)))
+        self.vehicle_model = VEHICLE_MODELS[vehicle](
+            *self.world.start,
+            float(self.world.track_data["direction"][0]),
+            **dict({"max_velocity": 1}, **(vehicle_params or {})),
+            noise=noise,
+            noise_buffer=self.noise_buffer)
 
         self.car_info = None
 
-    def step(self, action):
+        self.num_points = num_points
+        self.flat_observations = flat_observations
+        self.lookahead_distances = None if lookahead_distances is None else np.asarray(lookahead_distances, float)
+        self.local_map_shape = None if local_map_shape is None else tuple(local_map_shape)
+        self.local_map_resolution = local_map_resolution
+
+        # Actions are [accel, wheel_angle], observations the x-y distances to the upcoming (or lookahead) points
+        action_limits = np.array([self.vehicle_model.max_accel, self.vehicle_model.max_wheel_angle], dtype=np.float32)
+        observed_points = num_points if self.lookahead_distances is None else len(self.lookahead_distances)
+        self.action_space = spaces.Box(low=-action_limits, high=action_limits, dtype=np.float32)
+        flat_space = spaces.Box(low=-np.inf, high=np.inf, shape=(observed_points, 2), dtype=np.float32)
+
+        # Reused by every step in flat observation mode, so stepping doesn't allocate
+        self._observation = np.zeros(flat_space.shape, dtype=np.float32)
+
+        # Index of the track point nearest to the car, updated at every step
+        self.progress_index = 0
+
+        if off_track is not None and off_track not in OFF_TRACK_MODES:
+            raise ValueError("Unknown off track mode {}, expected one of {}".format(off_track, OFF_TRACK_MODES))
+        self.off_track = off_track
+        self.off_track_resolution = off_track_resolution
+        # Whether the episode ended, it stays set until the next reset
+        self.done = False
+
+        # Lap and sector times, from the arc length of the car along the centerline
+        self.lap_timer = LapTimer(self.world.centerline.length, sectors=sectors, writer=lap_writer)
+
+        # Layout of the buffers returned by get_state()
+        self.state_dtype = _state_dtype(self.vehicle_model.STATE_SIZE, self.lap_timer.state_size)
+
+        self.observation_space = flat_space if flat_observations else self._dict_observation_space()
+
+    def __getstate__(self):
+        """
+        Pickles the env as its constructor arguments and get_state(). The world is pickled as a reference to its
+        track file, the renderer and the lap writer are left out.
+        """
+
+        return {"init_args": self._init_args, "world": self.world, "state": self.get_state()}
+
+    def __setstate__(self, state):
+        """
+        Rebuilds a pickled env, see __getstate__
+        """
+
+        self.__init__(world=state["world"], **state["init_args"])
+        self.set_state(state["state"])
+
+    @property
+    def info(self):
+        """
+        Information about the last step which isn't part of the observation: whether the episode is "done", and the
+        lap and sector times (in steps) of the lap timer, see LapTimer.info(). Built on access, so it costs nothing
+        when unused.
+        """
+
+        info = self.lap_timer.info()
+        info["done"] = self.done
+        return info
+
+    @property
+    def track_surface(self):
+        """
+        The track surface the off track test runs against: the world's TrackBounds, or its TrackRaster with
+        `off_track_resolution`
+        """
+
+        if self.off_track_resolution is not None:
+            return self.world.get_raster(self.off_track_resolution)
+        return self.world.track_bounds
+
+    def seed(self, seed=None):
+        """
+        Seeds the environment's random number generator
+
+        Accepts: seed: an integer, or None to pick fresh entropy from the OS
+        Returns: a list holding the seed
+        """
+
+        self.noise_buffer.seed(seed)
+        self.np_random = self.noise_buffer.rng
+        return [seed]
+
+    def step(self, action, out=None):
         """
         Accepts an `action` object, consisting of desired accelleration (accel)
-        and the steering angle
+        and the steering angle. It can be a dict with "accel" and "wheel_angle",
+        or an array-like of the two (see `action_space`).
+
+        In flat observation mode, the observation is written into `out` if given,
+        otherwise into a buffer owned by the env which is overwritten by the next step.
 
         Returns on observation object
         """
 
-        accel = action["accel"]
-        wheel_angle = action["wheel_angle"]
+        # Plain floats, float32 values (e.g. from action_space.sample()) would leak into the car state
+        if isinstance(action, dict):
+            accel = float(action["accel"])
+            wheel_angle = float(action["wheel_angle"])
+        else:
+            accel, wheel_angle = float(action[0]), float(action[1])
 
         self.vehicle_model.move_accel(accel, wheel_angle)
 
+        self.progress_index = self.world.get_nearest_points(
+            self.vehicle_model.position, one_point_only=True, return_index=True)
+        self.lap_timer.update(self._arc_length())
+
+        if self.off_track is not None and not self.done:
+            self.done = not self.track_surface.footprint_inside(
+                self.vehicle_model.footprint_center,
+                self.vehicle_model.orientation,
+                self.vehicle_model.wheelbase,
+                self.vehicle_model.track,
+                mode=self.off_track)[0]
+
+        if self.publisher is not None:
+            self.publisher.publish(self.vehicle_model.get_info_object())
+
+        return self._observe(out)
+
+    def _observe(self, out=None):
+        """
+        Builds the observation for the current vehicle position (see step)
+        """
+
+        if self.flat_observations and self.lookahead_distances is not None:
+            return self._observe_lookahead(out=self._observation if out is None else out)
+
+        if self.flat_observations:
+            return self.world.get_upcoming_points_array(
+                self.vehicle_model.position,
+                self.vehicle_model.orientation,
+                num_points=self.num_points,
+                nearest_point_idx=self.progress_index,
+                out=self._observation if out is None else out)
+
         obs = {
             "reward":
             0,
             "dist_upcoming_points":
-            self.world.get_dist_upcoming_points(self.vehicle_model.position, self.vehicle_model.orientation),
+            self.world.get_dist_upcoming_points(
+                self.vehicle_model.position,
+                self.vehicle_model.orientation,
+                num_points=self.num_points,
+                nearest_point_idx=self.progress_index),
         }
 
+        if self.lookahead_distances is not None:
+            obs["lookahead_points"] = self._observe_lookahead()
+
+        if self.local_map_shape is not None:
+            obs["local_map"] = self.local_map()
+
+        obs["info"] = self.info
+
         return obs
 
-    def reset(self):
+    def _dict_observation_space(self):
+        """
+        Declares the observations returned in dict mode (see _observe). Times the lap timer hasn't measured yet are
+        NaN, so they aren't within the bounds of their spaces.
+        """
+
+        points = functools.partial(spaces.Box, low=-np.inf, high=np.inf, dtype=np.float32)
+        times = functools.partial(spaces.Box, low=0, high=np.inf, dtype=np.float32)
+        num_sectors = self.lap_timer.num_sectors
+
+        observation = {
+            "reward": spaces.Box(low=-np.inf, high=np.inf, shape=(), dtype=np.float32),
+            "dist_upcoming_points": points(shape=(self.num_points, 2)),
+        }
+
+        if self.lookahead_distances is not None:
+            observation["lookahead_points"] = points(shape=(len(self.lookahead_distances), 2), dtype=np.float64)
+
+        if self.local_map_shape is not None:
+            observation["local_map"] = spaces.Box(low=0, high=1, shape=self.local_map_shape, dtype=np.uint8)
+
+        observation["info"] = spaces.Dict({
+            "lap": spaces.Box(low=0, high=np.iinfo(np.int64).max, shape=(), dtype=np.int64),
+            "sector": spaces.Discrete(num_sectors),
+            "lap_time": times(shape=()),
+            "last_lap_time": times(shape=()),
+            "best_lap_time": times(shape=()),
+            "sector_times": times(shape=(num_sectors, )),
+            "last_sector_times": times(shape=(num_sectors, )),
+            "done": spaces.Discrete(2),
+        })
+
+        return spaces.Dict(observation)
+
+    def _observe_lookahead(self, out=None):
+        """
+        Gets the centerline points at `lookahead_distances` ahead of the car, as a (len(lookahead_distances), 2) array
+        """
+
+        if out is not None:
+            out = out[None]
+        return self.world.get_lookahead_points(
+            self.vehicle_model.position, self.vehicle_model.orientation, self.lookahead_distances, out=out)[0]
+
+    def local_map(self, shape=None, resolution=None):
+        """
+        Crops a bird's-eye view of the track around the car, rotated so that the car faces up
+
+        Accepts:
+            shape: (H, W) of the crop in pixels, local_map_shape by default
+            resolution: side of a pixel in meters, local_map_resolution by default
+        Returns:
+            An (H, W) uint8 array, 1 on the track and 0 off it, see TrackRaster.ego_crops
+        """
+
+        shape = shape or self.local_map_shape or (64, 64)
+        resolution = resolution or self.local_map_resolution
+        return self.world.get_raster(resolution).ego_crops(
+            self.vehicle_model.position, self.vehicle_model.orientation, shape=shape)[0]
+
+    def reset(self, start_index=None):
         """
         Reset the car to a static place somewhere on the track.
+
+        Accepts: start_index: index of the track point to place the car at, a random one by default
         """
 
         LOGGER.debug("system resetting")
 
-        idx = random.randint(0, len(self.world.path) - 1)
-        LOGGER.debug("Randomly placing the vehicle near map point #{}".format(idx))
-        x, y = self.world.path[idx]
-        theta = self.world.direction[idx]
+        if start_index is None:
+            idx = self.noise_buffer.randint(0, len(self.world.path_array))
+            LOGGER.debug("Randomly placing the vehicle near map point #{}".format(idx))
+        else:
+            idx = int(start_index) % len(self.world.path_array)
+        x, y = self.world.path_array[idx].tolist()
+        theta = float(self.world.track_data["direction"][idx])
         self.vehicle_model.set(x, y, theta)
 
+        self.progress_index = idx
         self.distance_traveled = 0
+        self.done = False
+        self.lap_timer.reset(self._arc_length())
+
+        return self._observe()
+
+    def _arc_length(self):
+        """
+        Arc length of the car's projection onto the track centerline. Unlike the arc length of the nearest track
+        point, it grows smoothly between the points, so that the lap timer can interpolate crossing times.
+        """
+
+        return float(self.world.centerline.to_frenet(self.vehicle_model.position)[0])
+
+    def get_state(self, out=None):
+        """
+        Captures the simulation state (vehicle pose, velocity, acceleration, wheel angles, progress index, done flag,
+        lap timer and random number generator) into a fixed-size buffer, without touching the track or the renderer.
+
+        Accepts: out: an optional zero-dimensional array of `self.state_dtype` to write into
+        Returns: the buffer, pass it to set_state() to return to this exact point of the simulation
+        """
+
+        if out is None:
+            out = np.zeros((), dtype=self.state_dtype)
+
+        self.vehicle_model.get_state(out=out["vehicle"])
+        out["progress_index"] = self.progress_index
+        out["done"] = self.done
+        self.noise_buffer.get_state(out=out["rng"])
+        self.lap_timer.get_state(out=out["lap_timer"])
+
+        return out
+
+    def set_state(self, state):
+        """
+        Restores a buffer captured with get_state()
+
+        Accepts: state: a zero-dimensional array of `self.state_dtype`
+        Returns: Nothing
+        """
+
+        self.vehicle_model.set_state(state["vehicle"])
+        self.progress_index = int(state["progress_index"])
+        self.done = bool(state["done"])
+        self.noise_buffer.set_state(state["rng"])
+        self.lap_timer.set_state(state["lap_timer"])
 
     def render(self, mode='human', close=False):
         """
         Use pygame to draw the map
         """
 
+        if self.draw_class is None:
+            from .flatlands_sim.draw import DrawMap
+            self.draw_class = DrawMap(world=self.world)
+
         car_info_object = self.vehicle_model.get_info_object()
         self.draw_class.draw_car(car_info_object)
+
+
+@functools.lru_cache(maxsize=None)
+def _state_dtype(vehicle_state_size, lap_timer_state_size):
+    """
+    Layout of the buffers of FlatlandsEnv.get_state(), shared by all envs with the same sizes
+    """
+
+    return np.dtype([
+        ("vehicle", np.float64, (vehicle_state_size, )),
+        ("progress_index", np.int64),
+        ("done", np.bool_),
+        ("rng", np.uint64, (STATE_WORDS, )),
+        ("lap_timer", np.float64, (lap_timer_state_size, )),
+    ])
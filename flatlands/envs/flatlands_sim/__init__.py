@@ -1,3 +1,43 @@
-from .draw import DrawMap
-from .world import WorldMap
-from .vehicle_model import BicycleModel
+"""
+The simulator behind the Flatlands env
+
+The submodules are imported on first access of their names (PEP 562), so that a headless simulation never loads
+pygame (draw) or pyproj (only needed to project GPS tracks).
+"""
+
+import importlib
+
+# Public name -> submodule defining it
+_EXPORTS = {
+    "DrawMap": "draw",
+    "WorldMap": "world",
+    "load_world": "world",
+    "BicycleModel": "vehicle_model",
+    "bicycle_step": "kinematics",
+    "rollout": "kinematics",
+    "bicycle_jacobians": "kinematics",
+    "linearize": "kinematics",
+    "DynamicBicycleModel": "vehicle_model",
+    "dynamic_step": "dynamics",
+    "dynamic_rollout": "dynamics",
+    "NoiseBuffer": "noise",
+    "TrackBounds": "bounds",
+    "TrackRaster": "raster",
+    "make_index": "spatial",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+    value = getattr(importlib.import_module("." + _EXPORTS[name], __name__), name)
+    # Cache it, so that the next lookups don't go through here
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,278 @@
+"""
+Vectorized on-track tests against the track surface
+
+The track surface is the union of one quad per track point, built like `DrawMap._get_corners` draws it: from the
+point's left and right edge (half the width away, across its direction) to the edges of the next point, plus fillers
+for the wedges left at joints where the quads don't connect (see joint_quads). `TrackBounds`
+buckets the quads in a uniform grid by their bounding boxes, so testing a batch of points only gathers the few quads
+of each point's cell and runs a vectorized point-in-polygon test on them.
+
+Usage as follows:
+    bounds = TrackBounds.from_world(world)
+    inside = bounds.contains(points)
+    off_track = ~bounds.footprint_inside(positions, headings, length=2.6, width=1.2, mode="any")
+"""
+
+import logging
+
+import numpy as np
+
+LOGGER = logging.getLogger("bounds")
+
+# Which part of the vehicle footprint has to leave the track to count as off track
+OFF_TRACK_MODES = ("center", "any", "all")
+
+
+def track_quads(path, track_data):
+    """
+    Builds the quad of every track point, as DrawMap._get_corners does
+
+    :param path:        (N, 2) array of the x-y of the track points
+    :param track_data:  structured array of the track points, see WorldMap.track_data
+
+    :return: an (N, 4, 2) array holding the corners of every quad, in order around it
+    """
+
+    directions = track_data["direction"]
+    half_widths = track_data["width"][:, None] / 2
+    segment_lengths = track_data["segment_length"]
+
+    # Offsets towards the left and the right edge, headings being measured from the positive y-axis
+    left = half_widths * np.stack([np.sin(directions - np.pi / 2), np.cos(directions - np.pi / 2)], axis=-1)
+    right = half_widths * np.stack([np.sin(directions + np.pi / 2), np.cos(directions + np.pi / 2)], axis=-1)
+
+    quads = np.empty((len(path), 4, 2))
+    quads[:, 0] = path + left
+    quads[:, 1] = path + right
+
+    # Connect to the edges of the next point, or extrapolate along the segment when there's none
+    connected = np.zeros(len(path), dtype=bool)
+    connected[:-1] = segment_lengths[1:] != 0
+    ends = path + segment_lengths[:, None] * np.stack([np.sin(directions), np.cos(directions)], axis=-1)
+
+    quads[:, 2] = np.where(connected[:, None], np.roll(quads[:, 1], -1, axis=0), ends + right)
+    quads[:, 3] = np.where(connected[:, None], np.roll(quads[:, 0], -1, axis=0), ends + left)
+
+    return quads
+
+
+def joint_quads(path, track_data, quads):
+    """
+    Builds the quads filling the gaps at the joints track_quads doesn't connect
+
+    A quad which isn't followed by a point (like the last one before the duplicated start point of a closed track) is
+    extrapolated along its own direction, and its end edge doesn't meet the start edge of the next drawn quad when
+    the directions differ. The filler goes from the one edge to the other, its two edges crossing in the middle, so
+    that it covers exactly the two wedges between them.
+
+    :param path:        (N, 2) array of the x-y of the track points
+    :param track_data:  structured array of the track points, see WorldMap.track_data
+    :param quads:       the (N, 4, 2) quads of track_quads()
+
+    :return: an (M, 4, 2) array of filler quads
+    """
+
+    segment_lengths = track_data["segment_length"]
+    drawn = np.flatnonzero(segment_lengths != 0)
+    if len(drawn) == 0:
+        return np.empty((0, 4, 2))
+
+    fillers = []
+    for idx in drawn:
+        if idx + 1 < len(path) and segment_lengths[idx + 1] != 0:
+            continue
+
+        # The next quad which gets drawn, wrapping around for closed tracks
+        next_idx = drawn[np.searchsorted(drawn, idx, side="right") % len(drawn)]
+        end = path[idx] + segment_lengths[idx] * np.array(
+            [np.sin(track_data["direction"][idx]), np.cos(track_data["direction"][idx])])
+        if np.hypot(*(path[next_idx] - end)) > track_data["width"][idx] / 2:
+            continue
+
+        fillers.append([quads[idx, 3], quads[idx, 2], quads[next_idx, 1], quads[next_idx, 0]])
+
+    return np.array(fillers).reshape(-1, 4, 2)
+
+
+def footprint_corners(positions, headings, length, width):
+    """
+    Corners of rectangular vehicle footprints
+
+    :param positions:   array-like of shape (N, 2), the footprint centers: the middle of the wheelbase, which is
+                        neither the rear axle position of BicycleModel nor the center of gravity of the dynamic model
+                        (see BicycleModel.footprint_center)
+    :param headings:    array-like of shape (N,), from the positive y-axis
+    :param length:      footprint length in meters
+    :param width:       footprint width in meters
+
+    :return: an (N, 4, 2) array of the front right, rear right, rear left and front left corners
+    """
+
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+    headings = np.asarray(headings, dtype=np.float64).reshape(-1, 1)
+    sin, cos = np.sin(headings), np.cos(headings)
+
+    # Corners in the vehicle frame (right, forward), then rotated into the world
+    right = np.array([1, 1, -1, -1]) * width / 2
+    forward = np.array([1, -1, -1, 1]) * length / 2
+    corners = np.empty((len(positions), 4, 2))
+    corners[..., 0] = positions[:, None, 0] + right * cos + forward * sin
+    corners[..., 1] = positions[:, None, 1] - right * sin + forward * cos
+
+    return corners
+
+
+def footprint_inside(contains, positions, headings, length, width, mode="any"):
+    """
+    Tests vehicle footprints against a track surface
+
+    :param contains:    function testing whether an array of points of shape (..., 2) lies on the track
+    :param positions:   array-like of shape (N, 2), the footprint centers, see footprint_corners()
+    :param headings:    array-like of shape (N,), from the positive y-axis
+    :param length:      footprint length in meters
+    :param width:       footprint width in meters
+    :param mode:        "center": only the center has to be on the track,
+                        "any": every corner has to be on the track (off track as soon as any corner leaves it),
+                        "all": at least one corner has to be on the track (off track once all of them left it)
+
+    :return: a boolean array of shape (N,), True for the vehicles still on the track
+    """
+
+    if mode == "center":
+        return contains(np.asarray(positions, dtype=np.float64).reshape(-1, 2))
+    if mode not in OFF_TRACK_MODES:
+        raise ValueError("Unknown off track mode {}, expected one of {}".format(mode, OFF_TRACK_MODES))
+
+    on_track = contains(footprint_corners(positions, headings, length, width))
+    return np.all(on_track, axis=1) if mode == "any" else np.any(on_track, axis=1)
+
+
+class TrackBounds(object):
+    """
+    Point-in-track tests over a grid of track quads
+    """
+
+    def __init__(self, quads, cell_size=None):
+        """
+        :param quads:       (Q, 4, 2) array of quad corners
+        :param cell_size:   side of the grid cells in meters, by default a quarter of the median quad extent
+        """
+
+        self.quads = np.asarray(quads, dtype=np.float64)
+
+        lower = self.quads.min(axis=1)
+        upper = self.quads.max(axis=1)
+        if cell_size is None:
+            cell_size = max(float(np.median(np.max(upper - lower, axis=1))) / 4, 1e-3)
+        self.cell_size = cell_size
+
+        self.origin = lower.min(axis=0)
+        self.shape = (np.floor((upper.max(axis=0) - self.origin) / cell_size).astype(int) + 1)
+
+        # Every quad goes into all the cells its bounding box touches
+        first_cells = np.floor((lower - self.origin) / cell_size).astype(int)
+        last_cells = np.floor((upper - self.origin) / cell_size).astype(int)
+        buckets = [[] for _ in range(int(np.prod(self.shape)))]
+        for quad_idx, (first, last) in enumerate(zip(first_cells, last_cells)):
+            for cell_x in range(first[0], last[0] + 1):
+                for cell_y in range(first[1], last[1] + 1):
+                    buckets[cell_x * self.shape[1] + cell_y].append(quad_idx)
+
+        # (Q, 4, 4) start y, end y, x0 and dx_dy of the 4 edges of every quad, an edge crossing height y at
+        # x0 + y * dx_dy. Horizontal edges never span a y, their slope doesn't matter.
+        edge_y0 = self.quads[:, :, 1]
+        edge_y1 = np.roll(edge_y0, -1, axis=1)
+        edge_dx = np.roll(self.quads[:, :, 0], -1, axis=1) - self.quads[:, :, 0]
+        edge_dx_dy = np.divide(edge_dx, edge_y1 - edge_y0, out=np.zeros_like(edge_dx), where=edge_y1 != edge_y0)
+        self._edges = np.stack([edge_y0, edge_y1, self.quads[:, :, 0] - edge_y0 * edge_dx_dy, edge_dx_dy], axis=1)
+
+        # Quads of cell i are cell_quads[cell_starts[i]:cell_starts[i + 1]]
+        counts = np.array([len(bucket) for bucket in buckets], dtype=np.int64)
+        self.cell_starts = np.concatenate([[0], np.cumsum(counts)])
+        self.cell_quads = np.array([quad_idx for bucket in buckets for quad_idx in bucket], dtype=np.int64)
+
+        LOGGER.debug("Indexed %d track quads in a %s grid of %.2f m cells, up to %d per cell", len(self.quads),
+                     self.shape, cell_size, counts.max())
+
+    @classmethod
+    def from_world(cls, world, cell_size=None):
+        """
+        Builds the bounds of a WorldMap's track
+
+        :param world:       the WorldMap
+        :param cell_size:   side of the grid cells in meters [optional]
+
+        :return: a TrackBounds
+        """
+
+        quads = track_quads(world.path_array, world.track_data)
+        fillers = joint_quads(world.path_array, world.track_data, quads)
+        return cls(np.concatenate([quads, fillers]), cell_size=cell_size)
+
+    def contains(self, points):
+        """
+        Tests whether points lie on the track
+
+        :param points: array-like of shape (..., 2)
+
+        :return: a boolean array of shape (...)
+        """
+
+        points = np.asarray(points, dtype=np.float64)
+        flat = points.reshape(-1, 2)
+
+        cells = np.floor((flat - self.origin) / self.cell_size).astype(np.int64)
+        in_grid = np.all((cells >= 0) & (cells < self.shape), axis=1)
+        cell_idx = cells[in_grid, 0] * self.shape[1] + cells[in_grid, 1]
+
+        # One (point, candidate quad) pair per quad in the cell of every point within the grid
+        starts = self.cell_starts[cell_idx]
+        counts = self.cell_starts[cell_idx + 1] - starts
+        pair_points = np.repeat(np.flatnonzero(in_grid), counts)
+        offsets = np.arange(len(pair_points)) - np.repeat(np.cumsum(counts) - counts, counts)
+        pair_quads = self.cell_quads[np.repeat(starts, counts) + offsets]
+
+        # Crossing number test: a point is inside when a ray towards +x crosses an odd number of the quad's edges
+        px = flat[pair_points, 0, None]
+        py = flat[pair_points, 1, None]
+        y0, y1, x0, dx_dy = np.moveaxis(np.take(self._edges, pair_quads, axis=0), 1, 0)
+        crossings = ((y0 > py) != (y1 > py)) & (px < x0 + py * dx_dy)
+        inside = (crossings[:, 0] ^ crossings[:, 1]) ^ (crossings[:, 2] ^ crossings[:, 3])
+
+        contained = np.zeros(len(flat), dtype=bool)
+        contained[pair_points[inside]] = True
+        return contained.reshape(points.shape[:-1])
+
+    def edge_points(self, spacing):
+        """
+        Samples the edge of the track surface: the parts of the quad sides with the track on one side only
+
+        :param spacing: largest distance between consecutive samples along a quad side, in meters
+
+        :return: an (M, 2) array of points, every point of the edge being within about `spacing / 2` of one
+        """
+
+        starts = self.quads.reshape(-1, 2)
+        sides = np.roll(self.quads, -1, axis=1).reshape(-1, 2) - starts
+        lengths = np.hypot(sides[:, 0], sides[:, 1])
+        starts, sides, lengths = starts[lengths > 0], sides[lengths > 0], lengths[lengths > 0]
+
+        # The middle of `pieces` equal pieces of every side
+        pieces = np.ceil(lengths / spacing).astype(np.intp)
+        side_idx = np.repeat(np.arange(len(lengths)), pieces)
+        fractions = (np.arange(len(side_idx)) - np.repeat(np.cumsum(pieces) - pieces, pieces) + 0.5) / pieces[side_idx]
+        points = starts[side_idx] + fractions[:, None] * sides[side_idx]
+
+        # On the edge, the track is on one side of the quad side and not on the other
+        step = 1e-6 * np.stack([sides[:, 1], -sides[:, 0]], axis=-1) / lengths[:, None]
+        on_edge = self.contains(points + step[side_idx]) != self.contains(points - step[side_idx])
+        return points[on_edge]
+
+    def footprint_inside(self, positions, headings, length, width, mode="any"):
+        """
+        Tests vehicle footprints against the track, see footprint_inside()
+
+        :return: a boolean array of shape (N,), True for the vehicles still on the track
+        """
+
+        return footprint_inside(self.contains, positions, headings, length, width, mode=mode)
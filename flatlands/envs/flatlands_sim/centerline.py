@@ -0,0 +1,352 @@
+"""
+Array representation of a track centerline, for vectorized geometric queries
+
+A `Centerline` holds the track points as a polyline together with precomputed per-segment tangents, normals,
+headings and the cumulative arc length, so that projecting any number of points onto the track (Frenet coordinates)
+or walking along it is a handful of numpy operations.
+
+Conventions follow the rest of the simulator: x-y in meters, headings measured from the positive y-axis, and lateral
+offsets positive to the right of the driving direction.
+
+Usage as follows:
+    centerline = Centerline(world.path_array, widths=world.width)
+    s, d, heading = centerline.to_frenet(positions)
+    positions = centerline.from_frenet(s, d)
+    coarse = centerline.resample(0.5).simplify(0.25)
+"""
+
+import logging
+
+import numpy as np
+from scipy.spatial import cKDTree as KDTree
+
+LOGGER = logging.getLogger("centerline")
+
+# Attributes holding everything a centerline is made of, see Centerline.arrays()
+CENTERLINE_ARRAYS = ("points", "widths", "segment_lengths", "tangents", "normals", "headings", "cumulative_length")
+
+# Segments shorter than this (in meters) are treated as duplicate points and dropped
+MIN_SEGMENT_LENGTH = 1e-9
+
+# Nearest segment samples first considered by a projection, doubled for the points they don't settle
+_NEIGHBOURS = 8
+
+# Largest gap between the samples along a segment, relative to the median segment length
+_SAMPLE_SPACING = 1.5
+
+
+class Centerline(object):
+    """
+    A polyline with its arc length parametrization
+    """
+
+    def __init__(self, points, widths=None, closed=True):
+        """
+        :param points: array-like of shape (N, 2) holding the x-y of the track points, in driving order
+        :param widths: track width at every point [optional]
+        :param closed: whether the track loops back to its first point. The closing segment is added if the last
+                       point isn't already a copy of the first one. [optional]
+        """
+
+        points = np.asarray(points, dtype=np.float64)
+        widths = np.zeros(len(points)) if widths is None else np.asarray(widths, dtype=np.float64)
+
+        if closed and np.hypot(*(points[-1] - points[0])) > MIN_SEGMENT_LENGTH:
+            points = np.vstack([points, points[:1]])
+            widths = np.append(widths, widths[0])
+
+        # Drop repeated points, so that every segment has a direction
+        keep = np.ones(len(points), dtype=bool)
+        keep[1:] = np.hypot(*np.diff(points, axis=0).T) > MIN_SEGMENT_LENGTH
+        if np.count_nonzero(~keep):
+            LOGGER.debug("Dropping %d zero-length segments from the centerline", np.count_nonzero(~keep))
+
+        self.closed = closed
+        # (N, 2) points; for closed tracks the last one repeats the first
+        self.points = points[keep]
+        self.widths = widths[keep]
+
+        segments = np.diff(self.points, axis=0)
+        self.segment_lengths = np.hypot(segments[:, 0], segments[:, 1])
+        # Unit direction of every segment, and the unit vector pointing to its right
+        self.tangents = segments / self.segment_lengths[:, None]
+        self.normals = np.stack([self.tangents[:, 1], -self.tangents[:, 0]], axis=-1)
+        # Heading of every segment, from the positive y-axis (same as bearing())
+        self.headings = (np.pi / 2 - np.arctan2(self.tangents[:, 1], self.tangents[:, 0])) % (2 * np.pi)
+
+        # Arc length at every point
+        self.cumulative_length = np.concatenate([[0], np.cumsum(self.segment_lengths)])
+        self._index()
+
+    @classmethod
+    def from_arrays(cls, arrays, closed=True):
+        """
+        Rebuilds a centerline from the arrays of another one, without copying them
+
+        Accepts:
+            arrays: a dict as returned by arrays(), e.g. memory-mapped from a store
+            closed: whether the track loops back to its first point
+        Returns:
+            A Centerline
+        """
+
+        centerline = cls.__new__(cls)
+        centerline.closed = closed
+        for name in CENTERLINE_ARRAYS:
+            # Plain views of memory-mapped arrays, np.memmap makes every gather of a projection slower
+            setattr(centerline, name, np.asarray(arrays[name]))
+        centerline._index()
+        return centerline
+
+    def arrays(self):
+        """
+        The arrays describing the centerline, see from_arrays()
+
+        Returns: a dict of name -> array
+        """
+
+        return {name: getattr(self, name) for name in CENTERLINE_ARRAYS}
+
+    def _index(self):
+        """
+        Sets up the total length and the KD-tree over points along the segments
+        """
+
+        self.length = float(self.cumulative_length[-1])
+
+        # Both ends of every segment and points between them no further apart than the typical segment, so that long
+        # segments (of simplified centerlines) have samples near anything near them. Each is tagged with its segment.
+        spacing = float(np.median(self.segment_lengths)) * _SAMPLE_SPACING
+        pieces = np.ceil(self.segment_lengths / spacing).astype(np.intp)
+        segments = np.repeat(np.arange(self.num_segments), pieces + 1)
+        steps = np.arange(len(segments)) - np.repeat(np.cumsum(pieces + 1) - pieces - 1, pieces + 1)
+        along = steps * self.segment_lengths[segments] / pieces[segments]
+        samples = self.points[segments] + along[:, None] * self.tangents[segments]
+
+        # Any point of a segment is within half a gap of one of its samples, see _project()
+        self._sample_segments = segments
+        self._max_half_gap = float(np.max(self.segment_lengths / pieces)) / 2
+        self.kd_tree = KDTree(samples)
+
+    @property
+    def num_segments(self):
+        """
+        Number of segments in the polyline
+        """
+
+        return len(self.segment_lengths)
+
+    def to_frenet(self, xy):
+        """
+        Projects points onto the centerline
+
+        Accepts:
+            xy: array-like of shape (..., 2) holding the points to project
+        Returns:
+            A 3-tuple of arrays of shape (...): the arc length s of the projection, the signed lateral offset d
+            (positive to the right) and the heading of the track at the projection
+        """
+
+        xy = np.asarray(xy, dtype=np.float64)
+        flat = xy.reshape(-1, 2)
+
+        segment, along, offset = self._project(flat)
+
+        s = self.cumulative_length[segment] + along
+        heading = self.headings[segment]
+
+        shape = xy.shape[:-1]
+        return s.reshape(shape), offset.reshape(shape), heading.reshape(shape)
+
+    def from_frenet(self, s, d=0.0):
+        """
+        Converts Frenet coordinates back to x-y
+
+        Accepts:
+            s: array-like of arc lengths (wrapped around for closed tracks, clipped otherwise)
+            d: lateral offsets (positive to the right), broadcastable against `s`
+        Returns:
+            An array of shape s.shape + (2,) holding the x-y coordinates
+        """
+
+        s, d = np.broadcast_arrays(np.asarray(s, dtype=np.float64), np.asarray(d, dtype=np.float64))
+        segment, along = self.locate(s)
+
+        return (self.points[segment] + along[..., None] * self.tangents[segment] + d[..., None] * self.normals[segment])
+
+    def locate(self, s):
+        """
+        Finds the segment holding each arc length
+
+        Accepts: s: array-like of arc lengths
+        Returns: a 2-tuple of arrays: the segment index, and the distance along that segment
+        """
+
+        s = np.asarray(s, dtype=np.float64)
+        if self.closed:
+            s = s % self.length
+        else:
+            s = np.clip(s, 0, self.length)
+
+        segment = np.clip(np.searchsorted(self.cumulative_length, s, side="right") - 1, 0, self.num_segments - 1)
+        return segment, s - self.cumulative_length[segment]
+
+    def lookahead(self, xy, headings, offsets, out=None):
+        """
+        Finds the centerline points at given arc length offsets ahead of each vehicle, in the vehicle's frame
+
+        Accepts:
+            xy: array of shape (N, 2) holding the vehicle positions
+            headings: array of shape (N,) holding the vehicle headings (from the positive y-axis)
+            offsets: array-like of shape (M,) holding distances along the track, in meters
+            out: optional (N, M, 2) array to write the result into
+        Returns:
+            An array of shape (N, M, 2) holding, for every vehicle and offset, the distance in meters
+            to the right (x) and to the front (y) of the vehicle
+        """
+
+        xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        headings = np.asarray(headings, dtype=np.float64).reshape(-1)
+        offsets = np.asarray(offsets, dtype=np.float64)
+
+        s, _, _ = self.to_frenet(xy)
+        delta = self.from_frenet(s[:, None] + offsets[None, :]) - xy[:, None, :]
+
+        sin, cos = np.sin(headings)[:, None], np.cos(headings)[:, None]
+        if out is None:
+            out = np.empty(delta.shape)
+        out[..., 0] = delta[..., 0] * cos - delta[..., 1] * sin
+        out[..., 1] = delta[..., 0] * sin + delta[..., 1] * cos
+
+        return out
+
+    def resample(self, resolution):
+        """
+        Resamples the centerline at uniform arc length intervals
+
+        Accepts: resolution: the distance between consecutive points, in meters
+        Returns: a new Centerline (widths are interpolated linearly)
+        """
+
+        num_points = max(int(np.ceil(self.length / resolution)), 2)
+        s = np.linspace(0, self.length, num_points + 1)
+        if self.closed:
+            # the closing point is added back by the constructor
+            s = s[:-1]
+
+        widths = np.interp(s, self.cumulative_length, self.widths)
+        return Centerline(self.from_frenet(s), widths=widths, closed=self.closed)
+
+    def simplify(self, tolerance):
+        """
+        Drops the points that are not needed to stay within `tolerance` of the centerline
+        (Ramer-Douglas-Peucker), so that straights keep few points while curves keep many
+
+        Accepts: tolerance: the maximum allowed deviation, in meters
+        Returns: a new Centerline
+        """
+
+        keep = np.zeros(len(self.points), dtype=bool)
+        keep[[0, -1]] = True
+
+        # On a closed track the end points coincide, split the loop at the point furthest from the start first
+        stack = [(0, len(self.points) - 1)]
+        if self.closed and len(self.points) > 3:
+            furthest = int(np.argmax(np.hypot(*(self.points - self.points[0]).T)))
+            keep[furthest] = True
+            stack = [(0, furthest), (furthest, len(self.points) - 1)]
+
+        while stack:
+            first, last = stack.pop()
+            if last - first < 2:
+                continue
+
+            deviation = _distance_to_chord(self.points[first + 1:last], self.points[first], self.points[last])
+            worst = int(np.argmax(deviation))
+            if deviation[worst] > tolerance:
+                worst += first + 1
+                keep[worst] = True
+                stack.append((first, worst))
+                stack.append((worst, last))
+
+        LOGGER.debug("Simplified centerline from %d to %d points", len(keep), np.count_nonzero(keep))
+        return Centerline(self.points[keep], widths=self.widths[keep], closed=self.closed)
+
+    def _project(self, flat):
+        """
+        Finds the closest segment to every point
+
+        The segments of the nearest samples (see _index()) hold a closest segment candidate at some distance r. Any
+        nearer segment has its closest point within r, and one of its own samples within half a gap of that point,
+        so every segment which could be nearer has a sample within r plus half a gap. Points whose nearest samples
+        don't reach that far are looked up again with more neighbours.
+
+        Accepts: flat: an (M, 2) array of points
+        Returns: a 3-tuple of (M,) arrays: segment index, distance along the segment and signed lateral offset
+        """
+
+        segment = np.empty(len(flat), dtype=np.intp)
+        along = np.empty(len(flat))
+        offset = np.empty(len(flat))
+
+        num_samples = len(self._sample_segments)
+        num_neighbours = min(_NEIGHBOURS, num_samples)
+        pending = np.arange(len(flat))
+        while len(pending):
+            distances, nearest = self.kd_tree.query(flat[pending], k=num_neighbours)
+            nearest = nearest.reshape(len(pending), num_neighbours)
+            furthest = np.reshape(distances, (len(pending), num_neighbours))[:, -1]
+
+            found = self._nearest_segments(flat[pending], self._sample_segments[nearest])
+            # Settled once the neighbours include every sample within reach of the closest segment found
+            covered = furthest > found[3] + self._max_half_gap
+            if num_neighbours == num_samples:
+                covered[:] = True
+
+            rows = pending[covered]
+            segment[rows], along[rows], offset[rows] = (values[covered] for values in found[:3])
+
+            pending = pending[~covered]
+            num_neighbours = min(2 * num_neighbours, num_samples)
+
+        return segment, along, offset
+
+    def _nearest_segments(self, flat, candidates):
+        """
+        Finds the closest segment to every point among candidates
+
+        Accepts:
+            flat: an (M, 2) array of points
+            candidates: an (M, K) array of segment indexes
+        Returns: a 4-tuple of (M,) arrays: segment index, distance along the segment, signed lateral offset and
+            distance to the segment
+        """
+
+        start = self.points[candidates]
+        tangent = self.tangents[candidates]
+        relative_x = flat[:, 0, None] - start[..., 0]
+        relative_y = flat[:, 1, None] - start[..., 1]
+        along = np.clip(relative_x * tangent[..., 0] + relative_y * tangent[..., 1], 0,
+                        self.segment_lengths[candidates])
+        squared = np.square(relative_x - along * tangent[..., 0]) + np.square(relative_y - along * tangent[..., 1])
+
+        best = np.argmin(squared, axis=1)
+        rows = np.arange(len(flat))
+        segment = candidates[rows, best]
+        offset = relative_x[rows, best] * self.normals[segment, 0] + relative_y[rows, best] * self.normals[segment, 1]
+
+        return segment, along[rows, best], offset, np.sqrt(squared[rows, best])
+
+
+def _distance_to_chord(points, start, end):
+    """
+    Distances of points to the line through start and end (or to start, if they coincide)
+    """
+
+    chord = end - start
+    chord_length = np.hypot(*chord)
+    relative = points - start
+    if chord_length < MIN_SEGMENT_LENGTH:
+        return np.hypot(relative[:, 0], relative[:, 1])
+
+    return np.abs(relative[:, 0] * chord[1] - relative[:, 1] * chord[0]) / chord_length
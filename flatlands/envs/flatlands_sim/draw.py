@@ -14,6 +14,10 @@ from .geoutils import distance, offset
 
 LOGGER = logging.getLogger("draw")
 
+# Resolution of the car sprite. It's scaled down to a few pixels per meter for display, so more is wasted memory
+# (a 1500x1500 RGBA surface at 200 px/m took 9 MB per renderer).
+SPRITE_PX_PER_M = 50
+
 
 class DrawMap():
     """
@@ -25,8 +29,8 @@ class DrawMap():
         self.map_data = world.map_data
         self.projected_path = world.projected_path
 
-        self.path = [(x[0], x[1]) for x in self.projected_path]
-        self.segment_length = [(x.segment_length) for x in self.map_data]
+        self.path = world.path
+        self.segment_length = world.segment_length
 
         self.y_min = world.y_min
         self.y_max = world.y_max
@@ -72,6 +76,12 @@ class DrawMap():
         self._car_sprite = None
         self._wheelbase = None
 
+        # The track and window trimmings as drawn by draw(), to restore the areas the car and the panels covered
+        self._background = None
+        # Screen areas drawn over by the last draw_car(), and whether the whole window has to be updated instead
+        self._dirty_rects = []
+        self._full_update = True
+
     def _pre_draw(self):
         """
         Determining how to draw and scale everything on the track is an intensive operation,
@@ -118,8 +128,11 @@ class DrawMap():
         Returns: Nothing
         """
 
-        # This block taken from the vehicle model and moved to it's own function
-        self._car_sprite = (200, pygame.Surface((1500, 1500), pygame.SRCALPHA, 32))
+        # This block taken from the vehicle model and moved to it's own function. The shapes below are laid out
+        # at 200 px/m, and scaled down to SPRITE_PX_PER_M.
+        resolution = SPRITE_PX_PER_M / 200
+        sprite_size = int(1500 * resolution)
+        self._car_sprite = (SPRITE_PX_PER_M, pygame.Surface((sprite_size, sprite_size), pygame.SRCALPHA, 32))
 
         # We're only using the wheelbase (length) currently, so let's keep
         # the x/y scale of the car constant, rather then scale seperately
@@ -142,6 +155,7 @@ class DrawMap():
         y_upper = mid_pt + scaled_y_dist / 2
 
         car_corners = [(x_lower, y_lower), (x_upper, y_lower), (x_upper, y_upper), (x_lower, y_upper)]
+        car_corners = [(x * resolution, y * resolution) for x, y in car_corners]
 
         black = (0, 0, 0)
         pygame.gfxdraw.aapolygon(self._car_sprite[1], car_corners, black)
@@ -149,6 +163,7 @@ class DrawMap():
 
         # Bottom left, top, bottom right
         tri_corners = [(mid_pt - 125, y_lower - 50), (mid_pt, y_lower - 250), (mid_pt + 125, y_lower - 50)]
+        tri_corners = [(x * resolution, y * resolution) for x, y in tri_corners]
 
         red = (255, 0, 0)
         pygame.gfxdraw.aapolygon(self._car_sprite[1], tri_corners, red)
@@ -173,8 +188,13 @@ class DrawMap():
 
         self.draw_window_trimmings()
 
+        self._background = self.screen.copy()
+        self._dirty_rects = []
+        self._full_update = True
+
         if update_screen:
             pygame.display.flip()
+            self._full_update = False
 
     def draw_window_trimmings(self):
         """
@@ -345,8 +365,10 @@ class DrawMap():
             self._wheelbase = kwargs["wheelbase"]
             self._scale_sprite(self._wheelbase)
 
-        # refresh the screen to overwrite the previous frame
-        self.draw(update_screen=False)
+        # restore the background where the previous frame drew, only those areas changed since
+        previous_rects = self._dirty_rects
+        for rect in previous_rects:
+            self.screen.blit(self._background, rect, rect)
 
         # requisite proportions for proper scaling of the sprite
         mPerPx = (self.y_max - self.y_min) / (self.window_y - self.border_size * 2)
@@ -369,7 +391,7 @@ class DrawMap():
         sprite_rect.center = self._scale_for_display([self.car_position])[0]
 
         # copy the sprite to the screen
-        self.screen.blit(rs_car_sprite, sprite_rect)
+        dirty_rects = [self.screen.blit(rs_car_sprite, sprite_rect)]
 
         # Draw the zoomed in view of the car in the corner
         miniMPerPx = (self.minimap_distance * 2) / self.zoomed_window_size
@@ -380,7 +402,7 @@ class DrawMap():
         zoom_view = self._draw_zoom_view(mini_rs_car_sprite)
 
         if zoom_view is not None:
-            self.screen.blit(zoom_view, (0, self.window_y - self.zoomed_window_size))
+            dirty_rects.append(self.screen.blit(zoom_view, (0, self.window_y - self.zoomed_window_size)))
 
         # Info view
         if self.steering_angle == None:
@@ -397,9 +419,15 @@ class DrawMap():
             ]
 
         info_view = self._draw_car_info(car_info_to_visualize)
-        self.screen.blit(info_view, (self.window_x - self.zoomed_window_size, 0))
+        dirty_rects.append(self.screen.blit(info_view, (self.window_x - self.zoomed_window_size, 0)))
 
-        pygame.display.flip()
+        # Push only the areas drawn in this frame or the previous one to the display, unless the track was redrawn
+        if self._full_update:
+            pygame.display.flip()
+            self._full_update = False
+        else:
+            pygame.display.update(previous_rects + dirty_rects)
+        self._dirty_rects = dirty_rects
 
     def _rotate_car(self, sprite, angle):
         """
@@ -0,0 +1,234 @@
+"""
+Stateless, vectorized dynamics of the single-track (bicycle) model with tire slip.
+
+Unlike the kinematic update of `kinematics.py`, where the car goes exactly where its wheels point, this model has a
+mass, a yaw inertia and a linear tire model: the lateral force of an axle is its cornering stiffness times its slip
+angle. The car can drift, understeer and oversteer, and its yaw rate lags behind the steering.
+
+A state is a row of `STATE_SIZE` values laid out as [x, y, theta, vx, vy, yaw_rate]. x-y is the center of gravity in
+meters, theta the heading from the positive y-axis, vx the forward and vy the rightward velocity (in meters per step)
+and yaw_rate the heading change per step. The first 4 columns line up with the kinematic states, vx taking the place
+of the velocity. Actions are the same [acceleration, wheel_angle] rows as for the kinematic model.
+
+The equations are stiff at low speed and large steps, so every step is split into substeps, each car getting as many
+as its own speed requires (see `_num_substeps`). Slip angles lose their meaning at low speed, so between the two
+`blend_speeds` the tire forces are faded out and the lateral velocity and yaw rate pulled towards the kinematic (no
+slip) motion, which is all that is left below the lower one.
+
+Usage as follows:
+    from flatlands.envs.flatlands_sim.dynamics import dynamic_step
+    states = dynamic_step(states, actions, dt=0.1)  # states: (N, 6), actions: (N, 2)
+    trajectories = dynamic_rollout(state, actions, dt=0.1)  # actions: (K, T, 2) -> trajectories: (K, T, 6)
+"""
+
+from math import pi
+
+import numpy as np
+
+# Column indexes of a state row
+X, Y, THETA, VX, VY, YAW_RATE = range(6)
+STATE_SIZE = 6
+
+# Column indexes of an action row, as in kinematics.py
+ACCEL, WHEEL_ANGLE = range(2)
+
+# Default distance between the center of gravity and the front axle, in meters
+CG_TO_FRONT = 1.2
+
+# Largest substep, relative to the fastest time constant of the tire dynamics (the midpoint method is stable to 2)
+STABILITY_FACTOR = 1.0
+
+
+def dynamic_step(states,
+                 actions,
+                 dt=0.1,
+                 wheelbase=2.6,
+                 cg_to_front=CG_TO_FRONT,
+                 mass=1300.0,
+                 yaw_inertia=2000.0,
+                 front_stiffness=80000.0,
+                 rear_stiffness=100000.0,
+                 max_wheel_angle=pi / 3,
+                 max_velocity=0.5,
+                 max_accel=0.1,
+                 max_substeps=64,
+                 blend_speeds=(1.0, 3.0),
+                 action_noise=None):
+    """
+    Advances a batch of dynamic single-track model states by one step.
+
+    :param  states:           array of shape (N, 6) holding [x, y, theta, vx, vy, yaw_rate] rows
+    :param  actions:          array of shape (N, 2) holding [acceleration, wheel_angle] rows
+    :param  dt:               duration of a step in seconds, which sets the time scale of the per-step units
+    :param  wheelbase:        distance between the rear and front axle in meters
+    :param  cg_to_front:      distance between the center of gravity and the front axle in meters
+    :param  mass:             mass of the car in kilograms
+    :param  yaw_inertia:      moment of inertia around the vertical axis in kg * m^2
+    :param  front_stiffness:  cornering stiffness of the front axle in newtons per radian of slip
+    :param  rear_stiffness:   cornering stiffness of the rear axle in newtons per radian of slip
+    :param  max_wheel_angle:  wheel angles are clipped to [-max_wheel_angle, max_wheel_angle] (None to disable)
+    :param  max_velocity:     forward velocities are clipped to [0, max_velocity] (None to disable)
+    :param  max_accel:        accelerations are clipped to [-max_accel, max_accel] (None to disable)
+    :param  max_substeps:     upper bound of the number of substeps of a car
+    :param  blend_speeds:     forward speeds (in meters per second) between which the motion goes from kinematic to
+                              fully dynamic
+    :param  action_noise:     optional array of shape (N, 2) of relative perturbations applied to the clipped actions,
+                              see kinematics.bicycle_step
+
+    :return: a new array of shape (N, 6) holding the next states
+    """
+    states = np.array(states, dtype=np.float64, ndmin=2)
+    actions = np.broadcast_to(np.asarray(actions, dtype=np.float64), (len(states), 2))
+
+    accel = _clip_symmetric(actions[:, ACCEL], max_accel)
+    wheel_angle = _clip_symmetric(actions[:, WHEEL_ANGLE], None if max_wheel_angle is None else max_wheel_angle % pi)
+    if action_noise is not None:
+        accel = accel * (1 + action_noise[:, ACCEL])
+        wheel_angle = wheel_angle * (1 + action_noise[:, WHEEL_ANGLE])
+
+    params = {
+        "wheelbase": wheelbase,
+        "cg_to_front": cg_to_front,
+        "mass": mass,
+        "yaw_inertia": yaw_inertia,
+        "front_stiffness": front_stiffness,
+        "rear_stiffness": rear_stiffness,
+    }
+    max_speed = np.inf if max_velocity is None else max_velocity / dt
+
+    # Integrate in SI units: velocities in m/s and accelerations in m/s^2
+    state = states.copy()
+    state[:, VX:] /= dt
+    accel = accel / dt**2
+
+    num_substeps = _num_substeps(state[:, VX], dt, blend_speeds[0], max_substeps, **params)
+    for substep in range(int(num_substeps.max(initial=0))):
+        # Cars which need fewer substeps are done already
+        active = np.flatnonzero(num_substeps > substep)
+        if len(active) == len(state):
+            active = slice(None)
+        h = dt / num_substeps[active]
+
+        current = state[active]
+        inputs = (accel[active], wheel_angle[active], blend_speeds)
+        midpoint = current + (h / 2)[:, None] * _derivatives(current, *inputs, **params)
+        current += h[:, None] * _derivatives(midpoint, *inputs, **params)
+
+        np.clip(current[:, VX], 0, max_speed, out=current[:, VX])
+        _blend_kinematic(current, wheel_angle[active], blend_speeds, wheelbase, cg_to_front)
+        state[active] = current
+
+    state[:, THETA] %= 2 * pi
+    state[:, VX:] *= dt
+
+    return state
+
+
+def dynamic_rollout(state, actions, **params):
+    """
+    Simulates K candidate action sequences of length T from a common (or per-candidate) initial state.
+
+    The counterpart of `kinematics.rollout`: nothing is mutated, and all candidates advance together with one
+    dynamic_step per timestep.
+
+    :param  state:    initial [x, y, theta, vx, vy, yaw_rate], of shape (6,) or (K, 6)
+    :param  actions:  array of shape (K, T, 2) holding [acceleration, wheel_angle] for every step
+    :param  params:   keyword arguments of dynamic_step (dt, wheelbase, mass, max_velocity, ...), without action_noise
+
+    :return: an array of shape (K, T, 6) where entry [k, t] is the state reached after applying actions[k, t]
+    """
+    actions = np.asarray(actions, dtype=np.float64)
+    if actions.ndim != 3 or actions.shape[-1] != 2:
+        raise ValueError("Expected actions of shape (K, T, 2), got {}".format(actions.shape))
+    num_candidates, horizon = actions.shape[:2]
+
+    current = np.array(np.broadcast_to(np.asarray(state, dtype=np.float64), (num_candidates, STATE_SIZE)))
+    trajectories = np.empty((num_candidates, horizon, STATE_SIZE))
+    for step in range(horizon):
+        current = dynamic_step(current, actions[:, step], **params)
+        trajectories[:, step] = current
+
+    return trajectories
+
+
+def _derivatives(state, accel, wheel_angle, blend_speeds, wheelbase, cg_to_front, mass, yaw_inertia, front_stiffness,
+                 rear_stiffness):
+    """
+    Time derivatives of SI states, see dynamic_step for the parameters.
+
+    Headings are measured from the positive y-axis and grow when turning right, and vy is positive to the right. The
+    equations read as the usual (counterclockwise) single-track model, since flipping every lateral quantity and the
+    wheel angle at once leaves them unchanged. The terms of the tire forces are weighted by `_dynamic_weight`.
+
+    :return: an array of the shape of state
+    """
+    cg_to_rear = wheelbase - cg_to_front
+    theta = state[:, THETA]
+    vx = state[:, VX]
+    vy = state[:, VY]
+    yaw_rate = state[:, YAW_RATE]
+
+    # Slip angles of the axles, the speed floor keeps them finite at standstill (faded out there anyway)
+    safe_vx = np.maximum(vx, blend_speeds[0])
+    weight = _dynamic_weight(vx, blend_speeds)
+    front_force = weight * front_stiffness * (wheel_angle - np.arctan2(vy + cg_to_front * yaw_rate, safe_vx))
+    rear_force = weight * rear_stiffness * -np.arctan2(vy - cg_to_rear * yaw_rate, safe_vx)
+
+    derivatives = np.empty_like(state)
+    derivatives[:, X] = vx * np.sin(theta) + vy * np.cos(theta)
+    derivatives[:, Y] = vx * np.cos(theta) - vy * np.sin(theta)
+    derivatives[:, THETA] = yaw_rate
+    derivatives[:, VX] = accel - front_force * np.sin(wheel_angle) / mass + weight * yaw_rate * vy
+    derivatives[:, VY] = (front_force * np.cos(wheel_angle) + rear_force) / mass - weight * yaw_rate * vx
+    derivatives[:, YAW_RATE] = (cg_to_front * front_force * np.cos(wheel_angle) - cg_to_rear * rear_force) / yaw_inertia
+
+    return derivatives
+
+
+def _num_substeps(vx, dt, min_speed, max_substeps, wheelbase, cg_to_front, mass, yaw_inertia, front_stiffness,
+                  rear_stiffness):
+    """
+    Number of substeps each car needs for a stable integration of its step.
+
+    The lateral and yaw dynamics relax with rates of about (C_f + C_r) / (m * vx) and (a^2 * C_f + b^2 * C_r) /
+    (I_z * vx), which grow without bound as the car slows down. Substeps are kept below STABILITY_FACTOR times the
+    inverse of the fastest one.
+
+    :return: an integer array of the shape of vx
+    """
+    cg_to_rear = wheelbase - cg_to_front
+    safe_vx = np.maximum(vx, min_speed)
+    lateral_rate = (front_stiffness + rear_stiffness) / (mass * safe_vx)
+    yaw_rate = (cg_to_front**2 * front_stiffness + cg_to_rear**2 * rear_stiffness) / (yaw_inertia * safe_vx)
+
+    needed = np.ceil(dt * np.maximum(lateral_rate, yaw_rate) / STABILITY_FACTOR)
+    return np.clip(needed, 1, max_substeps).astype(np.int64)
+
+
+def _blend_kinematic(state, wheel_angle, blend_speeds, wheelbase, cg_to_front):
+    """
+    Pulls the lateral velocity and yaw rate of slow cars towards the no slip motion of the kinematic model, in place.
+    """
+    weight = _dynamic_weight(state[:, VX], blend_speeds)
+    if np.all(weight == 1):
+        return
+
+    kinematic_yaw_rate = state[:, VX] * np.tan(wheel_angle) / wheelbase
+    # The rear axle doesn't slide sideways, so the center of gravity moves sideways with the rotation around it
+    kinematic_vy = (wheelbase - cg_to_front) * kinematic_yaw_rate
+
+    state[:, VY] = weight * state[:, VY] + (1 - weight) * kinematic_vy
+    state[:, YAW_RATE] = weight * state[:, YAW_RATE] + (1 - weight) * kinematic_yaw_rate
+
+
+def _dynamic_weight(vx, blend_speeds):
+    """Goes from 0 (kinematic) to 1 (dynamic) as the forward speed goes from the first to the second blend speed."""
+    low, high = blend_speeds
+    return np.clip((vx - low) / max(high - low, 1e-9), 0, 1)
+
+
+def _clip_symmetric(values, limit):
+    """Clips values into [-limit, limit], or returns them untouched when there is no limit."""
+    if limit is None:
+        return values
+    return np.clip(values, -limit, limit)
@@ -5,9 +5,12 @@ Geometric calculation utility functions
 from math import sin, cos, atan2, pi, hypot
 from collections import namedtuple
 
+import numpy as np
 from numpy import cross
 from numpy.linalg import norm
-from pyproj import Proj, transform
+
+# Return type of relative_distance(). Created once, since building a namedtuple class is far slower than using it.
+DistanceTuple = namedtuple("distance_tuple", ["distances", "heading"])
 
 
 def distance(prev, curr):
@@ -91,9 +94,38 @@ def relative_distance(point1, point2, angle):
     y_dist = absolute_dist * cos(abs(heading_angle))
 
     # Create our return value as a namedtuple (accessible by index or dot-notation)
-    distance_tuple = namedtuple("distance_tuple", ["distances", "heading"])
-    relative = distance_tuple((x_dist, y_dist), heading_angle)
-    return relative
+    return DistanceTuple((x_dist, y_dist), heading_angle)
+
+
+def relative_distances(origin, points, angle, out=None):
+    """
+    Vectorized version of relative_distance, for many destination points (and origins) at once.
+
+    Accepts:
+        origin: x-y of the input, an array-like of shape (..., 2) broadcastable against `points`
+        points: array of shape (..., N, 2) holding the destinations
+        angle: the angle(s) the origin is facing (y-extrusion direction), broadcastable against points[..., 0]
+        out: optional (..., N, 2) array to write the result into
+    Returns:
+        An (..., N, 2) array with the same x,y distances relative_distance returns for each point
+    """
+
+    origin = np.asarray(origin)
+    points = np.asarray(points)
+    delta_x = points[..., 0] - origin[..., 0]
+    delta_y = points[..., 1] - origin[..., 1]
+
+    # same angle conventions as bearing() and relative_distance()
+    direct_angle = (pi / 2 - np.arctan2(delta_y, delta_x)) - angle
+    heading_angle = np.minimum(direct_angle, 2 * pi - direct_angle)
+    absolute_dist = np.hypot(delta_x, delta_y)
+
+    if out is None:
+        out = np.empty(points.shape)
+    out[..., 0] = absolute_dist * np.sin(heading_angle)
+    out[..., 1] = absolute_dist * np.cos(np.abs(heading_angle))
+
+    return out
 
 
 def proj_to_local(points, new_proj="epsg:30176"):
@@ -112,6 +144,9 @@ def proj_to_local(points, new_proj="epsg:30176"):
             relative (x,y) projection coordinates
     """
 
+    # pyproj is slow to import and only needed for GPS tracks
+    from pyproj import Proj, transform
+
     global_projection = Proj(init="epsg:4326")
     jp_projection = Proj(init=new_proj)
     local_coord = namedtuple('local_coord', 'x_local, y_local')
@@ -0,0 +1,291 @@
+"""
+Stateless, vectorized kinematics of the bicycle (single-track) model.
+
+These functions implement the same update as `BicycleModel.move_accel`, but on numpy arrays of states instead of a
+single model object, so that planners can evaluate many candidate action sequences at once without copying or
+mutating any vehicle.
+
+A state is a row of `STATE_SIZE` values laid out as [x, y, theta, velocity], using the same units and conventions as
+the vehicle models: x-y in meters, theta the heading angle from the positive y-axis and velocity in meters per step.
+An action is a row of `ACTION_SIZE` values laid out as [acceleration, wheel_angle].
+
+Usage as follows:
+    from flatlands.envs.flatlands_sim.kinematics import rollout
+    trajectories = rollout(pose, velocity, actions)  # actions: (K, T, 2) -> trajectories: (K, T, 4)
+    state_jacobians, action_jacobians = bicycle_jacobians(states, actions)  # (..., 4, 4) and (..., 4, 2)
+"""
+
+from math import pi
+
+import numpy as np
+
+# Column indexes of a state row
+X, Y, THETA, VELOCITY = range(4)
+STATE_SIZE = 4
+
+# Column indexes of an action row
+ACCEL, WHEEL_ANGLE = range(2)
+ACTION_SIZE = 2
+
+
+def bicycle_step(states,
+                 actions,
+                 wheelbase=2.6,
+                 max_wheel_angle=pi / 3,
+                 max_velocity=0.5,
+                 max_accel=0.1,
+                 action_noise=None):
+    """
+    Advances a batch of bicycle model states by one step.
+
+    :param  states:           array of shape (..., 4) holding [x, y, theta, velocity] rows
+    :param  actions:          array of shape (..., 2) holding [acceleration, wheel_angle] rows, broadcastable
+                              against `states`
+    :param  wheelbase:        distance between the rear and front axle in meters
+    :param  max_wheel_angle:  wheel angles are clipped to [-max_wheel_angle, max_wheel_angle] (None to disable)
+    :param  max_velocity:     velocities are clipped to [0, max_velocity] (None to disable)
+    :param  max_accel:        accelerations are clipped to [-max_accel, max_accel] (None to disable)
+    :param  action_noise:     optional array of shape (..., 2) of relative perturbations applied to the clipped
+                              actions, as the vehicle models do with their `noise` percentage. Draw it with
+                              `NoiseBuffer.uniform_batch(-noise / 100, noise / 100, actions.shape)`.
+
+    :return: a new array of shape (..., 4) holding the next states
+    """
+    states = np.asarray(states, dtype=np.float64)
+    actions = np.asarray(actions, dtype=np.float64)
+
+    accel = _clip_symmetric(actions[..., ACCEL], max_accel)
+    wheel_angle = _clip_symmetric(actions[..., WHEEL_ANGLE], _wheel_limit(max_wheel_angle))
+
+    if action_noise is not None:
+        accel = accel * (1 + action_noise[..., ACCEL])
+        wheel_angle = wheel_angle * (1 + action_noise[..., WHEEL_ANGLE])
+
+    velocity = states[..., VELOCITY] + accel
+    if max_velocity is not None:
+        velocity = np.clip(velocity, 0, max_velocity)
+
+    x, y, theta = _advance_pose(states[..., X], states[..., Y], states[..., THETA], velocity,
+                                np.tan(wheel_angle) / wheelbase)
+
+    return np.stack(np.broadcast_arrays(x, y, theta, velocity), axis=-1)
+
+
+def rollout(pose, velocity, actions, wheelbase=2.6, max_wheel_angle=pi / 3, max_velocity=0.5, max_accel=0.1):
+    """
+    Simulates K candidate action sequences of length T from a common (or per-candidate) initial state.
+
+    Nothing is mutated, so this can be called freely from planners while the real vehicle keeps its own state.
+    The velocity clipping is resolved with one vectorized operation per timestep, all the geometry is then computed
+    for the whole (K, T) batch at once.
+
+    :param  pose:             initial [x, y, theta], of shape (3,) or (K, 3)
+    :param  velocity:         initial velocity, a scalar or an array of shape (K,)
+    :param  actions:          array of shape (K, T, 2) holding [acceleration, wheel_angle] for every step
+    :param  wheelbase:        distance between the rear and front axle in meters
+    :param  max_wheel_angle:  wheel angles are clipped to [-max_wheel_angle, max_wheel_angle] (None to disable)
+    :param  max_velocity:     velocities are clipped to [0, max_velocity] (None to disable)
+    :param  max_accel:        accelerations are clipped to [-max_accel, max_accel] (None to disable)
+
+    :return: an array of shape (K, T, 4) where entry [k, t] is the state reached after applying actions[k, t]
+    """
+    actions = np.asarray(actions, dtype=np.float64)
+    if actions.ndim != 3 or actions.shape[-1] != ACTION_SIZE:
+        raise ValueError("Expected actions of shape (K, T, {}), got {}".format(ACTION_SIZE, actions.shape))
+    num_candidates, horizon = actions.shape[:2]
+
+    pose = np.broadcast_to(np.asarray(pose, dtype=np.float64), (num_candidates, 3))
+    velocity = np.broadcast_to(np.asarray(velocity, dtype=np.float64), (num_candidates,))
+
+    accel = _clip_symmetric(actions[..., ACCEL], max_accel)
+    curvature = np.tan(_clip_symmetric(actions[..., WHEEL_ANGLE], _wheel_limit(max_wheel_angle))) / wheelbase
+
+    # Clipping makes the velocity profile path dependent, so it is the only part resolved step by step
+    velocities = np.empty((num_candidates, horizon))
+    current = velocity
+    for step in range(horizon):
+        current = current + accel[:, step]
+        if max_velocity is not None:
+            current = np.clip(current, 0, max_velocity)
+        velocities[:, step] = current
+
+    # Headings are the running sum of the turned angles, positions the running sum of the arc chords
+    beta = velocities * curvature
+    theta_after = pose[:, 2:3] + np.cumsum(beta, axis=1)
+    theta_before = theta_after - beta
+    chord = velocities * np.sinc(beta / (2 * pi))
+    mid_theta = theta_before + beta / 2
+
+    trajectories = np.empty((num_candidates, horizon, STATE_SIZE))
+    trajectories[..., X] = pose[:, 0:1] + np.cumsum(chord * np.sin(mid_theta), axis=1)
+    trajectories[..., Y] = pose[:, 1:2] + np.cumsum(chord * np.cos(mid_theta), axis=1)
+    trajectories[..., THETA] = theta_after % (2 * pi)
+    trajectories[..., VELOCITY] = velocities
+
+    return trajectories
+
+
+def bicycle_jacobians(states, actions, wheelbase=2.6, max_wheel_angle=pi / 3, max_velocity=0.5, max_accel=0.1):
+    """
+    Analytic linearization of bicycle_step around a batch of states and actions.
+
+    Both branches of `BicycleModel.move_accel` are covered by the chord form of `_advance_pose`: the arc around the
+    center of turn and, in the limit of a zero curvature, the straight line. The derivative of the chord length
+    v * sin(h) / h (h being half the turned angle) is taken from its Taylor series for nearly straight wheels, so
+    the result is exact and smooth across both. Clipped accelerations, wheel angles and velocities have a zero
+    derivative, and the heading is differentiated without its wrap into [0, 2 * pi). Action noise isn't modeled.
+
+    For a trajectory, pass the states before every step along with its actions, e.g. as returned by `linearize`.
+
+    :param  states:           array of shape (..., 4) holding [x, y, theta, velocity] rows
+    :param  actions:          array of shape (..., 2) holding [acceleration, wheel_angle] rows, broadcastable
+                              against `states`
+    :param  wheelbase:        distance between the rear and front axle in meters
+    :param  max_wheel_angle:  wheel angles are clipped to [-max_wheel_angle, max_wheel_angle] (None to disable)
+    :param  max_velocity:     velocities are clipped to [0, max_velocity] (None to disable)
+    :param  max_accel:        accelerations are clipped to [-max_accel, max_accel] (None to disable)
+
+    :return: a 2-tuple of the state Jacobians, of shape (..., 4, 4), and the action Jacobians, of shape (..., 4, 2),
+             entry [..., i, j] being the derivative of next state value i with respect to state (action) value j
+    """
+    states = np.asarray(states, dtype=np.float64)
+    actions = np.asarray(actions, dtype=np.float64)
+    shape = np.broadcast_shapes(states.shape[:-1], actions.shape[:-1])
+
+    # Derivatives of the clipped actions and velocity with respect to their unclipped values: 1 inside the limits
+    accel = _clip_symmetric(actions[..., ACCEL], max_accel)
+    accel_gain = _inside(actions[..., ACCEL], max_accel)
+    wheel_limit = _wheel_limit(max_wheel_angle)
+    wheel_angle = _clip_symmetric(actions[..., WHEEL_ANGLE], wheel_limit)
+    wheel_gain = _inside(actions[..., WHEEL_ANGLE], wheel_limit)
+
+    velocity = states[..., VELOCITY] + accel
+    velocity_gain = np.ones(velocity.shape)
+    if max_velocity is not None:
+        velocity_gain = ((velocity >= 0) & (velocity <= max_velocity)).astype(np.float64)
+        velocity = np.clip(velocity, 0, max_velocity)
+
+    tan = np.tan(wheel_angle)
+    curvature = tan / wheelbase
+    curvature_d_wheel = (1 + np.square(tan)) / wheelbase
+
+    # The chord is velocity * f(h) at the mean heading theta + h, with h = beta / 2 and f(h) = sin(h) / h
+    half_beta = velocity * curvature / 2
+    chord_factor = np.sinc(half_beta / pi)
+    chord = velocity * chord_factor
+    mid_theta = states[..., THETA] + half_beta
+    sin, cos = np.sin(mid_theta), np.cos(mid_theta)
+
+    # f'(h) = (h cos(h) - sin(h)) / h^2, which cancels catastrophically near 0 where -h / 3 + h^3 / 30 is exact
+    small = np.abs(half_beta) < 1e-3
+    safe = np.where(small, 1.0, half_beta)
+    factor_slope = np.where(small, -half_beta / 3 + half_beta**3 / 30,
+                            (safe * np.cos(safe) - np.sin(safe)) / np.square(safe))
+
+    # Derivatives of the chord, the mean heading and the heading with respect to the clipped velocity and wheel angle
+    chord_d_velocity = chord_factor + velocity * factor_slope * curvature / 2
+    chord_d_wheel = velocity * factor_slope * velocity * curvature_d_wheel / 2
+    mid_d_velocity = curvature / 2
+    mid_d_wheel = velocity * curvature_d_wheel / 2
+
+    d_velocity = np.stack(np.broadcast_arrays(chord_d_velocity * sin + chord * cos * mid_d_velocity,
+                                              chord_d_velocity * cos - chord * sin * mid_d_velocity, 2 * mid_d_velocity,
+                                              np.ones(velocity.shape)),
+                          axis=-1)
+    d_wheel = np.stack(np.broadcast_arrays(chord_d_wheel * sin + chord * cos * mid_d_wheel,
+                                           chord_d_wheel * cos - chord * sin * mid_d_wheel, 2 * mid_d_wheel,
+                                           np.zeros(velocity.shape)),
+                       axis=-1)
+
+    state_jacobians = np.zeros(shape + (STATE_SIZE, STATE_SIZE))
+    state_jacobians[..., X, X] = 1
+    state_jacobians[..., Y, Y] = 1
+    state_jacobians[..., X, THETA] = chord * cos
+    state_jacobians[..., Y, THETA] = -chord * sin
+    state_jacobians[..., THETA, THETA] = 1
+    state_jacobians[..., VELOCITY] = d_velocity * velocity_gain[..., None]
+
+    action_jacobians = np.empty(shape + (STATE_SIZE, ACTION_SIZE))
+    action_jacobians[..., ACCEL] = d_velocity * (velocity_gain * accel_gain)[..., None]
+    action_jacobians[..., WHEEL_ANGLE] = d_wheel * wheel_gain[..., None]
+
+    return state_jacobians, action_jacobians
+
+
+def linearize(pose, velocity, actions, wheelbase=2.6, max_wheel_angle=pi / 3, max_velocity=0.5, max_accel=0.1):
+    """
+    Rolls out action sequences and linearizes every step around the rollout, as iLQR and MPC solvers need.
+
+    :param  pose:             initial [x, y, theta], of shape (3,) or (K, 3)
+    :param  velocity:         initial velocity, a scalar or an array of shape (K,)
+    :param  actions:          array of shape (K, T, 2) holding [acceleration, wheel_angle] for every step
+    :param  wheelbase, max_wheel_angle, max_velocity, max_accel: see rollout
+
+    :return: a 3-tuple of the trajectories of shape (K, T, 4) (see rollout), the state Jacobians of shape
+             (K, T, 4, 4) and the action Jacobians of shape (K, T, 4, 2) of every step (see bicycle_jacobians)
+    """
+    params = {
+        "wheelbase": wheelbase,
+        "max_wheel_angle": max_wheel_angle,
+        "max_velocity": max_velocity,
+        "max_accel": max_accel,
+    }
+    trajectories = rollout(pose, velocity, actions, **params)
+
+    # The state before every step: the initial one, then the state reached by the previous step
+    num_candidates = trajectories.shape[0]
+    initial = np.empty((num_candidates, 1, STATE_SIZE))
+    initial[:, 0, :3] = np.broadcast_to(np.asarray(pose, dtype=np.float64), (num_candidates, 3))
+    initial[:, 0, VELOCITY] = np.broadcast_to(np.asarray(velocity, dtype=np.float64), (num_candidates, ))
+    before = np.concatenate([initial, trajectories[:, :-1]], axis=1)
+
+    state_jacobians, action_jacobians = bicycle_jacobians(before, actions, **params)
+    return trajectories, state_jacobians, action_jacobians
+
+
+def _advance_pose(x, y, theta, velocity, curvature):
+    """
+    Moves rear axle poses along their turning arcs.
+
+    The arc update of `BicycleModel.move_accel` (rotation around the center of turn) and its straight line special
+    case are the same motion: a chord of length v * sin(beta / 2) / (beta / 2) at the mean heading. Using that form
+    avoids dividing by a zero curvature and stays accurate for nearly straight wheels.
+
+    :param  x:          rear axle x coordinates
+    :param  y:          rear axle y coordinates
+    :param  theta:      headings, from the positive y-axis
+    :param  velocity:   the distances traveled during this step
+    :param  curvature:  1 / turn radius (tan(wheel_angle) / wheelbase), 0 when driving straight
+
+    :return: a 3-tuple of arrays with the new x, y and theta (constrained to [0, 2 * pi))
+    """
+    beta = velocity * curvature
+    chord = velocity * np.sinc(beta / (2 * pi))
+    mid_theta = theta + beta / 2
+
+    new_x = x + chord * np.sin(mid_theta)
+    new_y = y + chord * np.cos(mid_theta)
+    new_theta = (theta + beta) % (2 * pi)
+
+    return new_x, new_y, new_theta
+
+
+def _wheel_limit(max_wheel_angle):
+    """The vehicle models store their wheel limit modulo pi, mirror that here."""
+    if max_wheel_angle is None:
+        return None
+    return max_wheel_angle % pi
+
+
+def _inside(values, limit):
+    """The derivative of _clip_symmetric: 1 where values lie within [-limit, limit], 0 where they are clipped."""
+    if limit is None:
+        return np.ones(np.shape(values))
+    return (np.abs(values) <= limit).astype(np.float64)
+
+
+def _clip_symmetric(values, limit):
+    """Clips values into [-limit, limit], or returns them untouched when there is no limit."""
+    if limit is None:
+        return values
+    return np.clip(values, -limit, limit)
@@ -0,0 +1,295 @@
+"""
+Lap and sector timing from the progress along the track
+
+Sectors are arc length intervals of the track, starting at the start/finish line. Instead of intersecting the car's
+motion with lines across the track, `LapTimer` keeps the progress along the track unwrapped (so it keeps growing over
+laps) and compares it to the position of the next boundary to cross. An update is a few float operations, except on
+the rare steps which cross a boundary.
+
+Crossing times are interpolated between the two steps around the crossing, and counted in steps since the last reset.
+Only the furthest progress counts, so driving back and forth over a boundary doesn't time it twice. The lap from the
+start point to the first start/finish crossing (the out-lap) is not timed.
+
+Usage as follows:
+    timer = LapTimer(world.path_length, sectors=(400, 800), writer=LapWriter("laps.csv", num_sectors=3))
+    timer.reset(s)
+    timer.update(s)  # after every step
+    timer.last_lap_time, timer.last_sector_times
+"""
+
+import math
+import logging
+
+import numpy as np
+
+LOGGER = logging.getLogger("laps")
+
+
+class LapTimer(object):
+    """
+    Times laps and sectors from the arc length of the car's position
+    """
+
+    def __init__(self, track_length, sectors=(), finish_line=0.0, writer=None):
+        """
+        :param track_length:    length of the (closed) track, in meters
+        :param sectors:         arc lengths after the start/finish line (in meters) at which the sectors after the
+                                first one start. With no sectors, the whole lap is a single sector.
+        :param finish_line:     arc length of the start/finish line
+        :param writer:          a LapWriter receiving a record for every completed lap [optional]
+        """
+
+        boundaries = np.asarray(sectors, dtype=np.float64).reshape(-1)
+        if np.any(boundaries <= 0) or np.any(boundaries >= track_length) or np.any(np.diff(boundaries) <= 0):
+            raise ValueError("Sector boundaries must be increasing, within (0, {}), got {}".format(
+                track_length, boundaries))
+
+        self.track_length = float(track_length)
+        self.finish_line = float(finish_line)
+        self.writer = writer
+        # Start of every sector relative to the start/finish line, the first one being the line itself
+        self.boundaries = [0.0] + boundaries.tolist()
+        self.num_sectors = len(self.boundaries)
+
+        # Steps since the last reset, and the unwrapped progress past the start/finish line at the last update
+        self.time = 0.0
+        self.progress = 0.0
+        self.max_progress = 0.0
+        # Boundaries crossed since progress 0 count up from there, this is the count of the next one to cross
+        self._next_crossing = 0
+        self._next_position = 0.0
+
+        self.laps = 0
+        self.sector = 0
+        self.lap_start = math.nan
+        self.sector_start = math.nan
+        self.last_lap_time = math.nan
+        self.best_lap_time = math.nan
+        # Split times of the sectors of the current and the last completed lap, NaN where not timed
+        self.sector_times = [math.nan] * self.num_sectors
+        self.last_sector_times = [math.nan] * self.num_sectors
+
+        # Start on the start/finish line, until the first reset
+        self.reset(self.finish_line)
+
+    @property
+    def state_size(self):
+        """
+        Number of floats written by get_state()
+        """
+
+        return 10 + 2 * self.num_sectors
+
+    @property
+    def current_lap_time(self):
+        """
+        Time spent in the current lap so far, NaN during the out-lap
+        """
+
+        return self.time - self.lap_start
+
+    def reset(self, s):
+        """
+        Starts timing from a new position, with no laps completed
+
+        :param s: arc length of the car's position
+
+        :return: None
+        """
+
+        self.time = 0.0
+        self.progress = (float(s) - self.finish_line) % self.track_length
+        self.max_progress = self.progress
+
+        self._next_crossing = int(np.searchsorted(self.boundaries, self.progress, side="right"))
+        self._next_position = self._crossing_position(self._next_crossing)
+
+        self.laps = 0
+        self.sector = self._next_crossing - 1
+        self.lap_start = math.nan
+        self.sector_start = math.nan
+        self.last_lap_time = math.nan
+        self.best_lap_time = math.nan
+        self.sector_times = [math.nan] * self.num_sectors
+        self.last_sector_times = [math.nan] * self.num_sectors
+
+    def update(self, s):
+        """
+        Advances the timer by one step
+
+        :param s: arc length of the car's position after the step
+
+        :return: True if a lap was completed during this step
+        """
+
+        previous = self.progress
+        self.time += 1.0
+
+        # The shortest way around the track from the last position
+        half_length = self.track_length / 2
+        self.progress += (float(s) - self.finish_line - previous + half_length) % self.track_length - half_length
+
+        if self.progress < self._next_position:
+            self.max_progress = max(self.max_progress, self.progress)
+            return False
+
+        # The next boundary lies past the furthest progress so far, so the car moved forward during this step
+        completed_lap = False
+        while self.progress >= self._next_position:
+            # Interpolate the crossing time within the step
+            fraction = (self._next_position - previous) / (self.progress - previous)
+            completed_lap |= self._cross(self.time - 1.0 + fraction)
+
+        self.max_progress = self.progress
+        return completed_lap
+
+    def get_state(self, out=None):
+        """
+        Packs the timer into `state_size` floats
+
+        :param out: optional float64 array to write into
+
+        :return: the packed state
+        """
+
+        if out is None:
+            out = np.empty(self.state_size)
+
+        out[:10] = (self.time, self.progress, self.max_progress, self._next_crossing, self.laps, self.sector,
+                    self.lap_start, self.sector_start, self.last_lap_time, self.best_lap_time)
+        out[10:10 + self.num_sectors] = self.sector_times
+        out[10 + self.num_sectors:] = self.last_sector_times
+
+        return out
+
+    def set_state(self, state):
+        """
+        Restores a state captured with get_state()
+
+        :param state: the packed state
+
+        :return: None
+        """
+
+        (self.time, self.progress, self.max_progress, next_crossing, laps, sector, self.lap_start, self.sector_start,
+         self.last_lap_time, self.best_lap_time) = (float(value) for value in state[:10])
+
+        self._next_crossing = int(next_crossing)
+        self._next_position = self._crossing_position(self._next_crossing)
+        self.laps = int(laps)
+        self.sector = int(sector)
+        self.sector_times = [float(value) for value in state[10:10 + self.num_sectors]]
+        self.last_sector_times = [float(value) for value in state[10 + self.num_sectors:]]
+
+    def info(self):
+        """
+        Summarizes the timer for the step info
+
+        :return: a dict
+        """
+
+        return {
+            "lap": self.laps,
+            "sector": self.sector,
+            "lap_time": self.current_lap_time,
+            "last_lap_time": self.last_lap_time,
+            "best_lap_time": self.best_lap_time,
+            "sector_times": self.sector_times,
+            "last_sector_times": self.last_sector_times,
+        }
+
+    def _crossing_position(self, crossing):
+        """Unwrapped progress at which the given boundary crossing happens."""
+        lap, boundary = divmod(crossing, self.num_sectors)
+        return lap * self.track_length + self.boundaries[boundary]
+
+    def _cross(self, time):
+        """
+        Books the crossing of the next boundary at the given time, and moves on to the following one
+
+        :return: True if this completed a lap
+        """
+
+        boundary = self._next_crossing % self.num_sectors
+        self._next_crossing += 1
+        self._next_position = self._crossing_position(self._next_crossing)
+
+        # The sector which just ended, unless the car started within it
+        if not math.isnan(self.sector_start):
+            self.sector_times[self.sector] = time - self.sector_start
+        self.sector_start = time
+        self.sector = boundary
+
+        if boundary != 0:
+            return False
+
+        completed_lap = not math.isnan(self.lap_start)
+        if completed_lap:
+            self.laps += 1
+            self.last_lap_time = time - self.lap_start
+            if not self.best_lap_time <= self.last_lap_time:
+                self.best_lap_time = self.last_lap_time
+            self.last_sector_times = self.sector_times
+            LOGGER.debug("Lap %d completed in %.2f steps", self.laps, self.last_lap_time)
+            if self.writer is not None:
+                self.writer.write(self.laps, self.lap_start, self.last_lap_time, self.last_sector_times)
+
+        self.lap_start = time
+        self.sector_times = [math.nan] * self.num_sectors
+
+        return completed_lap
+
+
+class LapWriter(object):
+    """
+    Streams lap records to a CSV file through a write buffer
+    """
+
+    def __init__(self, path, num_sectors=1, label=None, buffer_size=1 << 16):
+        """
+        :param path:        file to append the records to, the header is written if it's new or empty
+        :param num_sectors: number of sector split columns
+        :param label:       value of the "label" column of every record, e.g. a run or env name [optional]
+        :param buffer_size: size of the write buffer, in bytes
+        """
+
+        self.label = "" if label is None else str(label)
+        self._file = open(path, "a", buffering=buffer_size)
+        if self._file.tell() == 0:
+            sector_columns = ",".join("sector_{}".format(sector) for sector in range(num_sectors))
+            self._file.write("label,lap,start_time,lap_time," + sector_columns + "\n")
+
+    def write(self, lap, start_time, lap_time, sector_times):
+        """
+        Appends one lap record
+
+        :param lap:          lap number
+        :param start_time:   time at which the lap started, in steps since the last reset
+        :param lap_time:     duration of the lap, in steps
+        :param sector_times: split time of every sector
+
+        :return: None
+        """
+
+        self._file.write("{},{},{:.4f},{:.4f},{}\n".format(self.label, lap, start_time, lap_time,
+                                                           ",".join("{:.4f}".format(split) for split in sector_times)))
+
+    def flush(self):
+        """
+        Writes the buffered records to the file
+        """
+
+        self._file.flush()
+
+    def close(self):
+        """
+        Flushes and closes the file
+        """
+
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,215 @@
+"""
+Block-buffered uniform noise on top of a numpy random Generator.
+
+Drawing single numbers from a Generator (or the global `random` module) costs far more than the number itself, so
+`NoiseBuffer` draws them in blocks and hands them out one by one, refilling lazily when a block runs out. Batched
+consumers take whole slices of the same stream, so scalar and vectorized stepping share one reproducible sequence.
+
+The buffer's position in its stream is a handful of integers (the generator state at the start of the current block,
+the block length and the cursor), which is what makes cheap snapshots of it possible.
+
+Usage as follows:
+    noise = NoiseBuffer(seed=42)
+    rnd = noise.uniform(-1, 1)
+    rnds = noise.uniform_batch(-1, 1, (num_envs, 2))
+"""
+
+import numpy as np
+
+# Number of unsigned 64 bit words written by NoiseBuffer.get_state()
+STATE_WORDS = 8
+
+_UINT64_MASK = (1 << 64) - 1
+
+
+class NoiseBuffer(object):
+    """
+    Hands out uniform random numbers from lazily refilled, pre-generated blocks
+    """
+
+    def __init__(self, seed=None, block_size=4096):
+        """
+        :param seed:        seed of the underlying numpy Generator, or None to pick fresh entropy from the OS
+        :param block_size:  how many numbers to generate at once
+        """
+        self._block_size = block_size
+        self.rng = None
+        self._block = None
+        self._block_state = None
+        self._block_length = 0
+        self._cursor = 0
+
+        self.seed(seed)
+
+    def seed(self, seed=None):
+        """
+        Replaces the underlying generator with a freshly seeded one and drops the current block
+
+        :param seed: an integer, or None to pick fresh entropy from the OS
+
+        :return: None
+        """
+        self.rng = np.random.default_rng(seed)
+        self._block = None
+        self._block_length = 0
+        self._cursor = 0
+
+    def uniform(self, low=0.0, high=1.0):
+        """
+        Draws a single number uniformly from [low, high)
+
+        :param low:   lower bound
+        :param high:  upper bound
+
+        :return: a float
+        """
+        if self._cursor >= self._block_length:
+            self._refill(self._block_size)
+        elif self._block is None:
+            self._regenerate()
+
+        value = self._block[self._cursor]
+        self._cursor += 1
+
+        return low + (high - low) * float(value)
+
+    def uniform_batch(self, low, high, size):
+        """
+        Draws an array of numbers uniformly from [low, high), taking them from the same stream as uniform()
+
+        :param low:   lower bound(s), broadcastable against `size`
+        :param high:  upper bound(s), broadcastable against `size`
+        :param size:  shape of the returned array
+
+        :return: a numpy array of the requested shape
+        """
+        shape = (size, ) if np.isscalar(size) else tuple(size)
+        count = int(np.prod(shape))
+        values = np.empty(count)
+
+        filled = 0
+        while filled < count:
+            if self._cursor >= self._block_length:
+                self._refill(max(self._block_size, count - filled))
+            elif self._block is None:
+                self._regenerate()
+
+            taken = min(count - filled, self._block_length - self._cursor)
+            values[filled:filled + taken] = self._block[self._cursor:self._cursor + taken]
+            filled += taken
+            self._cursor += taken
+
+        return low + (np.asarray(high) - low) * values.reshape(shape)
+
+    def randint(self, low, high):
+        """
+        Draws an integer uniformly from [low, high)
+
+        :param low:   lowest value (inclusive)
+        :param high:  highest value (exclusive)
+
+        :return: an int
+        """
+        # Offsets from low are never negative, so int() rounds them down even for a negative low
+        return min(low + int(self.uniform(0, high - low)), high - 1)
+
+    def get_state(self, out=None):
+        """
+        Packs the position in the random stream into STATE_WORDS unsigned 64 bit integers
+
+        :param out: optional uint64 array to write into
+
+        :return: the packed state
+        """
+        if out is None:
+            out = np.empty(STATE_WORDS, dtype=np.uint64)
+
+        if self._block_length == 0:
+            # Nothing drawn from this generator yet, the current state is the start of the next block
+            self._block_state = self.rng.bit_generator.state
+
+        pack_rng_state(self._block_state, out[0:6])
+        out[6] = self._block_length
+        out[7] = self._cursor
+
+        return out
+
+    def set_state(self, words):
+        """
+        Restores a state captured with get_state(). The block itself is only regenerated when it is next needed.
+
+        :param words: the packed state
+
+        :return: None
+        """
+        self._block_state = unpack_rng_state(words[0:6])
+        self.rng.bit_generator.state = self._block_state
+        self._block_length = int(words[6])
+        self._cursor = int(words[7])
+        self._block = None
+
+        if self._block_length == 0:
+            # The generator is already positioned at the start of the next block
+            return
+
+        # Leave the generator where it was after drawing the block (one 64 bit draw per float)
+        self.rng.bit_generator.advance(self._block_length)
+
+    def _refill(self, length):
+        """Draws a new block of `length` numbers."""
+        self._block_state = self.rng.bit_generator.state
+        self._block = self.rng.random(length)
+        self._block_length = length
+        self._cursor = 0
+
+    def _regenerate(self):
+        """Re-draws the current block after a set_state(), without moving the generator."""
+        current = self.rng.bit_generator.state
+        self.rng.bit_generator.state = self._block_state
+        self._block = self.rng.random(self._block_length)
+        self.rng.bit_generator.state = current
+
+
+def pack_rng_state(rng_state, out):
+    """
+    Writes the state dict of a PCG64 bit generator into 6 unsigned 64 bit words
+
+    :param rng_state: a bit generator state dict
+    :param out: an array of at least 6 unsigned 64 bit integers
+
+    :return: out
+    """
+
+    if rng_state["bit_generator"] != "PCG64":
+        raise ValueError("Only PCG64 generators can be packed, got {}".format(rng_state["bit_generator"]))
+
+    state, inc = rng_state["state"]["state"], rng_state["state"]["inc"]
+    out[0] = state >> 64
+    out[1] = state & _UINT64_MASK
+    out[2] = inc >> 64
+    out[3] = inc & _UINT64_MASK
+    out[4] = rng_state["has_uint32"]
+    out[5] = rng_state["uinteger"]
+
+    return out
+
+
+def unpack_rng_state(words):
+    """
+    Inverse of pack_rng_state
+
+    :param words: 6 unsigned 64 bit integers
+
+    :return: a state dict that can be assigned to a PCG64 bit generator
+    """
+
+    words = [int(word) for word in words]
+    return {
+        "bit_generator": "PCG64",
+        "state": {
+            "state": (words[0] << 64) | words[1],
+            "inc": (words[2] << 64) | words[3],
+        },
+        "has_uint32": words[4],
+        "uinteger": words[5],
+    }
@@ -0,0 +1,306 @@
+"""
+Rasterized track: occupancy grid, signed distance field and nearest centerline point
+
+`TrackRaster` samples the track surface (the quads of `TrackBounds`) on a regular grid once, along with the signed
+distance of every cell to the track edge and the index of its nearest track point. Afterwards "is this on the
+track", "how far is the edge" and "which track point is nearest" are array lookups, whatever the number of query
+points, without going through the quads or the KD-tree.
+
+Values are those of the center of the cell a point falls in, which is at most half a cell diagonal away
+(`resolution / sqrt(2)` meters), so they are accurate to that: points are on the track unless they are that close to
+the edge, signed distances are within that (and a thirty-second of a cell, the sampling of the edge) of the exact ones
+and the nearest track point is that of a point that close. Rasterizing takes a few seconds at 0.25 m and more at finer
+resolutions, the grids are cached by the WorldMap.
+Points beyond the grid (which has a margin of `margin` meters around the track) are off the track, their signed
+distance is that of the nearest grid cell minus their distance to the grid.
+
+`ego_crops` resamples the grids into bird's-eye views around vehicles, rotated so that they face the top of the image,
+for a whole batch of vehicles with a few array operations.
+
+Usage as follows:
+    raster = world.get_raster(resolution=0.25)
+    raster.on_track(points), raster.signed_distance(points), raster.nearest_index(points)
+    crops = raster.ego_crops(positions, headings, shape=(64, 64))  # (N, 64, 64)
+"""
+
+import logging
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from .bounds import footprint_inside
+
+LOGGER = logging.getLogger("raster")
+
+# Points per batch of on-track tests when rasterizing, bounds the temporary memory
+_RASTER_BATCH = 1 << 16
+
+# Samples of the track edge per cell side, the signed distances of the cell centers are measured to them
+_EDGE_SAMPLES = 16
+
+# Levels of ever sparser edge samples, and the ratio of their sample counts. Off the corners of the edge, the nearest
+# of samples `spacing` apart is at most about spacing ** 2 / (2 * distance) further than the edge, so that the cells far
+# from the edge are measured as well by sparse samples, which are much faster to search. The samples at the corners
+# are kept on every level.
+_EDGE_LEVELS = 3
+_EDGE_LEVEL_RATIO = 4
+
+# Pixels per batch of ego crops, bounds the temporary memory
+_CROP_BATCH = 1 << 20
+
+# Grids which can be cropped, and the dtype of their crops
+CROP_LAYERS = {
+    "occupancy": np.uint8,
+    "signed_distance": np.float32,
+}
+
+
+def _edge_levels(points, spacing):
+    """
+    Builds the KD-trees of ever sparser edge samples
+
+    :param points:  (M, 2) array of edge samples at most `spacing` apart, in order along the quad sides
+    :param spacing: distance between the samples in meters
+
+    :return: a list of (spacing, KD-tree) of the levels, from the sparsest to the densest
+    """
+
+    # The corners, where the step to the next sample changes, and the ends of the gaps
+    steps = np.diff(points, axis=0)
+    turns = np.any(np.abs(np.diff(steps, axis=0)) > 1e-6 * spacing, axis=1)
+    corners = np.zeros(len(points), dtype=bool)
+    corners[[0, -1]] = True
+    corners[1:-1] = turns
+
+    levels = []
+    for level in range(_EDGE_LEVELS):
+        stride = _EDGE_LEVEL_RATIO ** level
+        kept = corners | (np.arange(len(points)) % stride == 0)
+        levels.append((spacing * stride, cKDTree(points[kept], balanced_tree=False)))
+
+    return levels[::-1]
+
+
+def _edge_distances(edge_levels, points, tolerance):
+    """
+    Measures the distance of points to the track edge, to its sparsest samples that are dense enough
+
+    :param edge_levels: list of (spacing, KD-tree of the edge samples that far apart), from the sparsest to the densest
+    :param points:      (N, 2) array
+    :param tolerance:   distance in meters the sparse samples may add to that to the densest ones
+
+    :return: an (N,) array of distances in meters
+    """
+
+    distances = np.empty(len(points))
+    pending = np.arange(len(points))
+    for level, (spacing, tree) in enumerate(edge_levels):
+        found = tree.query(points[pending])[0]
+        settled = found > spacing ** 2 / (2 * tolerance) if level < len(edge_levels) - 1 else np.ones_like(found, bool)
+        distances[pending[settled]] = found[settled]
+        pending = pending[~settled]
+
+    return distances
+
+
+class TrackRaster(object):
+    """
+    Grids of the track surface, signed distance to its edge and nearest track point
+    """
+
+    def __init__(self, occupancy, signed_distance, nearest_index, origin, resolution):
+        """
+        :param occupancy:       (W, H) boolean grid, True on the track. Cell [i, j] spans origin + [i, j] * resolution
+                                to origin + [i + 1, j + 1] * resolution.
+        :param signed_distance: (W, H) float32 grid of the distance to the track edge in meters, positive on the
+                                track and negative off it
+        :param nearest_index:   (W, H) int32 grid of the index of the nearest track point
+        :param origin:          x-y of the corner of cell [0, 0]
+        :param resolution:      side of a cell in meters
+        """
+
+        self.occupancy = occupancy
+        self.signed_distance_grid = signed_distance
+        self.nearest_index_grid = nearest_index
+        self.origin = np.asarray(origin, dtype=np.float64)
+        self.resolution = float(resolution)
+        self.shape = occupancy.shape
+
+    @classmethod
+    def from_world(cls, world, resolution=0.5, margin=10.0):
+        """
+        Rasterizes the track of a WorldMap
+
+        :param world:       the WorldMap
+        :param resolution:  side of a cell in meters
+        :param margin:      extent of the grid beyond the track surface, in meters
+
+        :return: a TrackRaster
+        """
+
+        bounds = world.track_bounds
+        lower = bounds.quads.reshape(-1, 2).min(axis=0) - margin
+        upper = bounds.quads.reshape(-1, 2).max(axis=0) + margin
+        shape = tuple(np.ceil((upper - lower) / resolution).astype(int))
+
+        # Cell centers, in x-major order
+        xs = lower[0] + (np.arange(shape[0]) + 0.5) * resolution
+        ys = lower[1] + (np.arange(shape[1]) + 0.5) * resolution
+        centers = np.stack(np.meshgrid(xs, ys, indexing="ij"), axis=-1).reshape(-1, 2)
+
+        # The distance to the edge is that to its nearest sample, off by about half their spacing at most
+        spacing = resolution / _EDGE_SAMPLES
+        edge_levels = _edge_levels(bounds.edge_points(spacing), spacing)
+
+        occupancy = np.empty(len(centers), dtype=bool)
+        signed_distance = np.empty(len(centers), dtype=np.float32)
+        nearest_index = np.empty(len(centers), dtype=np.int32)
+        for start in range(0, len(centers), _RASTER_BATCH):
+            batch = slice(start, start + _RASTER_BATCH)
+            occupancy[batch] = bounds.contains(centers[batch])
+            distances = _edge_distances(edge_levels, centers[batch], spacing / 2)
+            signed_distance[batch] = np.where(occupancy[batch], distances, -distances)
+            nearest_index[batch] = world.spatial_index.query(centers[batch])[1]
+
+        LOGGER.debug("Rasterized the track into %s cells of %.2f m", shape, resolution)
+        return cls(occupancy.reshape(shape), signed_distance.reshape(shape), nearest_index.reshape(shape), lower,
+                   resolution)
+
+    @property
+    def nbytes(self):
+        """
+        Memory taken by the grids, in bytes
+        """
+
+        return self.occupancy.nbytes + self.signed_distance_grid.nbytes + self.nearest_index_grid.nbytes
+
+    def cell_indices(self, points):
+        """
+        Finds the cells holding points, clamped to the grid
+
+        :param points: array-like of shape (..., 2)
+
+        :return: a 3-tuple of the column and row indexes (integer arrays of shape (...)) and a boolean array of shape
+                 (...), False for the points beyond the grid
+        """
+
+        cells = np.floor((np.asarray(points, dtype=np.float64) - self.origin) / self.resolution).astype(np.intp)
+        columns = cells[..., 0]
+        rows = cells[..., 1]
+        in_grid = (columns >= 0) & (columns < self.shape[0]) & (rows >= 0) & (rows < self.shape[1])
+
+        np.clip(columns, 0, self.shape[0] - 1, out=columns)
+        np.clip(rows, 0, self.shape[1] - 1, out=rows)
+        return columns, rows, in_grid
+
+    def on_track(self, points):
+        """
+        Tests whether points lie on the track
+
+        :param points: array-like of shape (..., 2)
+
+        :return: a boolean array of shape (...)
+        """
+
+        columns, rows, in_grid = self.cell_indices(points)
+        return self.occupancy[columns, rows] & in_grid
+
+    def signed_distance(self, points):
+        """
+        Gets the distance of points to the track edge
+
+        :param points: array-like of shape (..., 2)
+
+        :return: a float array of shape (...) of distances in meters, positive on the track and negative off it
+        """
+
+        points = np.asarray(points, dtype=np.float64)
+        columns, rows, in_grid = self.cell_indices(points)
+        distances = self.signed_distance_grid[columns, rows].astype(np.float64)
+
+        if not np.all(in_grid):
+            # Distance to the grid, for the points beyond it
+            lower = self.origin
+            upper = self.origin + np.array(self.shape) * self.resolution
+            beyond = np.maximum(np.maximum(lower - points, points - upper), 0)
+            distances -= np.hypot(beyond[..., 0], beyond[..., 1])
+
+        return distances
+
+    def nearest_index(self, points):
+        """
+        Gets the index of the track point nearest to points
+
+        :param points: array-like of shape (..., 2)
+
+        :return: an integer array of shape (...)
+        """
+
+        columns, rows, _ = self.cell_indices(points)
+        return self.nearest_index_grid[columns, rows]
+
+    def footprint_inside(self, positions, headings, length, width, mode="any"):
+        """
+        Tests vehicle footprints against the track, see bounds.footprint_inside()
+
+        :return: a boolean array of shape (N,), True for the vehicles still on the track
+        """
+
+        return footprint_inside(self.on_track, positions, headings, length, width, mode=mode)
+
+    def ego_crops(self, positions, headings, shape=(64, 64), resolution=None, ahead=0.0, layer="occupancy", out=None):
+        """
+        Crops bird's-eye views of the track around vehicles, each rotated so that its vehicle faces up
+
+        Row 0 of a crop is the farthest ahead and column 0 the farthest to the left. Every pixel takes the value of the
+        grid cell under its center (nearest neighbor sampling), pixels beyond the grid that of the nearest border cell,
+        which lies off the track.
+
+        :param positions:   array-like of shape (N, 2), the vehicle positions
+        :param headings:    array-like of shape (N,), from the positive y-axis
+        :param shape:       (H, W) of a crop, in pixels
+        :param resolution:  side of a pixel in meters, the grid resolution by default
+        :param ahead:       distance in meters from the vehicle to the center of its crop, along its heading
+        :param layer:       "occupancy" for 1 on the track and 0 off it (uint8), "signed_distance" for the distance
+                            to the track edge in meters (float32)
+        :param out:         an optional (N, H, W) array of the layer's dtype to write into
+
+        :return: an (N, H, W) array
+        """
+
+        if layer not in CROP_LAYERS:
+            raise ValueError("Unknown layer {}, expected one of {}".format(layer, list(CROP_LAYERS)))
+        grid = (self.occupancy if layer == "occupancy" else self.signed_distance_grid).ravel()
+
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        headings = np.asarray(headings, dtype=np.float64).reshape(-1)
+        height, width = shape
+        resolution = self.resolution if resolution is None else resolution
+        if out is None:
+            out = np.empty((len(positions), height, width), dtype=CROP_LAYERS[layer])
+
+        # Pixel centers in the vehicle frame, in grid cells: forward (up the image) and to the right
+        forward = (ahead + (height / 2 - 0.5 - np.arange(height)) * resolution) / self.resolution
+        right = ((np.arange(width) + 0.5 - width / 2) * resolution) / self.resolution
+        forward = forward.astype(np.float32)[:, None]
+        right = right.astype(np.float32)[None, :]
+
+        # The affine map of every vehicle, from (forward, right) to grid columns and rows
+        sin = np.sin(headings).astype(np.float32)[:, None, None]
+        cos = np.cos(headings).astype(np.float32)[:, None, None]
+        origins = ((positions - self.origin) / self.resolution).astype(np.float32)
+
+        batch_size = max(1, _CROP_BATCH // (height * width))
+        for start in range(0, len(positions), batch_size):
+            batch = slice(start, start + batch_size)
+            columns = origins[batch, 0, None, None] + forward * sin[batch] + right * cos[batch]
+            rows = origins[batch, 1, None, None] + forward * cos[batch] - right * sin[batch]
+
+            # Clipping before the truncation towards zero makes it a floor
+            np.clip(columns, 0, self.shape[0] - 1, out=columns)
+            np.clip(rows, 0, self.shape[1] - 1, out=rows)
+            cells = columns.astype(np.intp) * self.shape[1] + rows.astype(np.intp)
+
+            out[batch] = np.take(grid, cells)
+
+        return out
@@ -0,0 +1,306 @@
+"""
+Nearest track point queries, with interchangeable backends
+
+Every backend indexes a fixed (N, 2) array of points and answers batched nearest neighbour queries the way
+`scipy.spatial.cKDTree.query` does, so they can stand in for each other:
+
+kdtree: scipy's cKDTree, a good default for any track
+grid:   a uniform grid along the track whose cells list the few points which can be nearest to a query within
+        them, precomputed for polylines. Queries far from the track are answered by a KD-tree.
+brute:  measures every point, cheapest for tiny tracks
+
+All of them return the exact nearest point. When several points are equally near (such as the duplicated start point
+of a closed track) any of them may be returned, the grid and brute force backends return the lowest index.
+
+`select_backend` times the backends on a set of points and returns the fastest, `flatlands-bench spatial` does so
+for several track sizes.
+
+Usage as follows:
+    index = make_index(path_array, backend="grid")
+    distances, indexes = index.query(positions)  # positions: (..., 2)
+"""
+
+import time
+import logging
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+LOGGER = logging.getLogger("spatial")
+
+# Query points per batch of the brute force search, times the number of points, bounds the temporary memory
+_BRUTE_FORCE_BATCH = 1 << 20
+
+# Standard deviation in meters of the offsets of the benchmark queries from the track points
+_QUERY_SPREAD = 3.0
+
+
+class SpatialIndex(object):
+    """
+    Nearest neighbour queries over a fixed set of 2D points
+    """
+
+    def __init__(self, points):
+        """
+        :param points: array-like of shape (N, 2)
+        """
+
+        # Not copied, so that memory-mapped points stay shared between processes
+        self.data = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+
+    def __len__(self):
+        return len(self.data)
+
+    def query(self, points):
+        """
+        Finds the nearest indexed point to each of the query points
+
+        :param points: array-like of shape (2,) or (..., 2)
+
+        :return: a 2-tuple of the distances and the indexes of the nearest points, of shape (...), or scalars for a
+                 single point
+        """
+
+        points = np.asarray(points, dtype=np.float64)
+        distances, indexes = self._query(points.reshape(-1, 2))
+        if points.ndim == 1:
+            return distances[0], indexes[0]
+        return distances.reshape(points.shape[:-1]), indexes.reshape(points.shape[:-1])
+
+    def _query(self, points):
+        """
+        Finds the nearest indexed point to each row of an (M, 2) array
+
+        :return: a 2-tuple of (M,) arrays of the distances and the indexes
+        """
+
+        raise NotImplementedError
+
+
+class KDTreeIndex(SpatialIndex):
+    """
+    scipy's cKDTree
+    """
+
+    def __init__(self, points):
+        super().__init__(points)
+        self._tree = cKDTree(self.data)
+
+    def _query(self, points):
+        distances, indexes = self._tree.query(points)
+        return distances, indexes.astype(np.intp, copy=False)
+
+
+class BruteForceIndex(SpatialIndex):
+    """
+    Measures the distance to every point
+    """
+
+    def _query(self, points):
+        distances = np.empty(len(points))
+        indexes = np.empty(len(points), dtype=np.intp)
+
+        batch_size = max(1, _BRUTE_FORCE_BATCH // len(self.data))
+        for start in range(0, len(points), batch_size):
+            batch = slice(start, start + batch_size)
+            squared = np.square(points[batch, 0, None] - self.data[:, 0])
+            squared += np.square(points[batch, 1, None] - self.data[:, 1])
+            indexes[batch] = np.argmin(squared, axis=1)
+            distances[batch] = np.sqrt(squared[np.arange(len(squared)), indexes[batch]])
+
+        return distances, indexes
+
+
+class GridIndex(SpatialIndex):
+    """
+    Uniform grid along the track, every cell listing the only points which can be nearest to a query within it
+
+    A query point within a cell is at most half a cell diagonal from its center, so its nearest point lies within that
+    distance plus the center's nearest distance, and within another half diagonal of the center. Along a polyline
+    that leaves a handful of candidates for the cells near it, kept in a table padded to the same width, so a batch
+    of queries is a gather and an argmin. Queries in cells farther than `margin` from every point, or with more than
+    `max_candidates` candidates, go through a KD-tree instead.
+    """
+
+    def __init__(self, points, cell_size=None, margin=10.0, max_candidates=32, max_cells=1 << 18):
+        """
+        :param points:          array-like of shape (N, 2)
+        :param cell_size:       side of the grid cells in meters, by default half the median distance between
+                                consecutive points, made larger where the grid would have over `max_cells` cells
+        :param margin:          cells whose center is farther from every point (in meters) are left to the KD-tree
+        :param max_candidates:  cells with more candidates are left to the KD-tree
+        :param max_cells:       upper bound of the number of cells of the default cell size
+        """
+
+        super().__init__(points)
+        self._tree = cKDTree(self.data)
+
+        lower = self.data.min(axis=0) - margin
+        upper = self.data.max(axis=0) + margin
+        steps = np.hypot(*np.diff(self.data, axis=0).T)
+        step = float(np.median(steps[steps > 0])) if np.any(steps > 0) else 1.0
+        if cell_size is None:
+            cell_size = max(step / 2, float(np.sqrt(np.prod(upper - lower) / max_cells)))
+        self.cell_size = cell_size
+
+        self.origin = lower
+        self.shape = np.ceil((upper - lower) / cell_size).astype(np.int64)
+
+        xs = lower[0] + (np.arange(self.shape[0]) + 0.5) * cell_size
+        ys = lower[1] + (np.arange(self.shape[1]) + 0.5) * cell_size
+        centers = np.stack(np.meshgrid(xs, ys, indexing="ij"), axis=-1).reshape(-1, 2)
+        # Cells beyond the margin only need to be known as such, the bound spares searching for their nearest point
+        nearest = self._tree.query(centers, distance_upper_bound=margin * (1 + 1e-9))[0]
+        near = np.flatnonzero(nearest <= margin)
+        radii = nearest[near] + np.sqrt(2) * cell_size * (1 + 1e-9)
+
+        # Skip the cells where a straight polyline through the nearest point would already cross the candidate circle
+        # over too many points
+        crossed = 2 * np.sqrt(np.square(radii) - np.square(nearest[near])) / step
+        near = near[crossed <= 2 * max_candidates]
+        radii = radii[crossed <= 2 * max_candidates]
+
+        # The candidates of a cell are its nearest points within the radius, cells which may have more than
+        # max_candidates are left out
+        num_neighbours = min(max_candidates, len(self.data))
+        neighbour_distances, neighbours = self._tree.query(centers[near], k=num_neighbours)
+        outside = neighbour_distances.reshape(len(near), num_neighbours) > radii[:, None]
+        complete = outside[:, -1] | (num_neighbours == len(self.data))
+        listed = near[complete]
+
+        # Row i lists the candidates of cell i in increasing order, padded with len(points), an extra point at
+        # infinity. Cells without a row (-1) are left to the KD-tree.
+        self.cell_rows = np.full(len(centers), -1, dtype=np.intp)
+        self.cell_rows[listed] = np.arange(len(listed))
+        candidates = np.where(outside, len(self.data), neighbours.reshape(len(near), num_neighbours))[complete]
+        width = max(1, int(np.count_nonzero(~outside[complete], axis=1).max(initial=1)))
+        self.candidates = np.sort(candidates, axis=1)[:, :width].astype(np.intp)
+
+        # Coordinates gathered one axis at a time, which is several times faster than gathering rows
+        self._xs = np.append(self.data[:, 0], np.inf)
+        self._ys = np.append(self.data[:, 1], np.inf)
+
+        LOGGER.debug("Indexed %d points in a %s grid of %.2f m cells, %d of them listing up to %d candidates",
+                     len(self.data), self.shape, cell_size, len(self.candidates), self.candidates.shape[1])
+
+    def _query(self, points):
+        cells = np.floor((points - self.origin) / self.cell_size).astype(np.int64)
+        in_grid = np.all((cells >= 0) & (cells < self.shape), axis=1)
+        rows = np.full(len(points), -1, dtype=np.intp)
+        rows[in_grid] = self.cell_rows[cells[in_grid, 0] * self.shape[1] + cells[in_grid, 1]]
+
+        distances = np.empty(len(points))
+        indexes = np.empty(len(points), dtype=np.intp)
+
+        listed = np.flatnonzero(rows >= 0)
+        if len(listed):
+            # Nearest candidate of every query, argmin takes the first and so the lowest index among equally near ones
+            candidates = self.candidates[rows[listed]]
+            squared = np.square(points[listed, 0, None] - np.take(self._xs, candidates))
+            squared += np.square(points[listed, 1, None] - np.take(self._ys, candidates))
+            best = np.argmin(squared, axis=1)
+            indexes[listed] = candidates[np.arange(len(listed)), best]
+            distances[listed] = np.sqrt(squared[np.arange(len(listed)), best])
+
+        unlisted = np.flatnonzero(rows < 0)
+        if len(unlisted):
+            distances[unlisted], indexes[unlisted] = self._tree.query(points[unlisted])
+
+        return distances, indexes
+
+
+# Backend name -> SpatialIndex class
+SPATIAL_BACKENDS = {
+    "kdtree": KDTreeIndex,
+    "grid": GridIndex,
+    "brute": BruteForceIndex,
+}
+
+
+def make_index(points, backend="kdtree"):
+    """
+    Indexes points with a backend
+
+    :param points:  array-like of shape (N, 2)
+    :param backend: one of SPATIAL_BACKENDS, or "auto" for the fastest on batches of queries around these points (see
+                    select_backend)
+
+    :return: a SpatialIndex
+    """
+
+    if backend == "auto":
+        backend = select_backend(points)[0]
+    if backend not in SPATIAL_BACKENDS:
+        raise ValueError("Unknown spatial backend {}, expected one of {}".format(
+            backend, list(SPATIAL_BACKENDS) + ["auto"]))
+
+    return SPATIAL_BACKENDS[backend](points)
+
+
+def benchmark_queries(points, num_queries=4096, seed=0):
+    """
+    Random query points around the track, as the positions of cars driving on it
+
+    :param points:      array-like of shape (N, 2), the track points
+    :param num_queries: number of query points
+    :param seed:        seed of the random number generator
+
+    :return: an (num_queries, 2) array
+    """
+
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    rng = np.random.default_rng(seed)
+    return points[rng.integers(0, len(points), num_queries)] + rng.normal(0, _QUERY_SPREAD, (num_queries, 2))
+
+
+def time_backends(points, queries=None, batch_size=None, backends=None, repeat=3):
+    """
+    Times building every backend on points, and querying it
+
+    :param points:      array-like of shape (N, 2)
+    :param queries:     (M, 2) array of query points, by default benchmark_queries(points)
+    :param batch_size:  number of points per query call, all of them at once by default. 1 times single point queries,
+                        as a FlatlandsEnv makes them.
+    :param backends:    names of the backends to time, all of SPATIAL_BACKENDS by default
+    :param repeat:      number of timed runs over the queries, the best counts
+
+    :return: a dict of backend name -> {"build", "query"} times in seconds, "query" being per query point
+    """
+
+    queries = benchmark_queries(points) if queries is None else np.asarray(queries, dtype=np.float64)
+    if batch_size == 1:
+        batches = list(queries)
+    else:
+        batch_size = batch_size or len(queries)
+        batches = [queries[start:start + batch_size] for start in range(0, len(queries), batch_size)]
+
+    timings = {}
+    for name in backends or SPATIAL_BACKENDS:
+        start = time.perf_counter()
+        index = SPATIAL_BACKENDS[name](points)
+        build = time.perf_counter() - start
+
+        query = np.inf
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for batch in batches:
+                index.query(batch)
+            query = min(query, (time.perf_counter() - start) / len(queries))
+
+        timings[name] = {"build": build, "query": query}
+        LOGGER.debug("%s on %d points: %s", name, len(index), timings[name])
+
+    return timings
+
+
+def select_backend(points, queries=None, batch_size=None, backends=None, repeat=3):
+    """
+    Picks the backend answering queries on points the fastest, see time_backends
+
+    :return: a 2-tuple of the backend name and the timings of all of them
+    """
+
+    timings = time_backends(points, queries=queries, batch_size=batch_size, backends=backends, repeat=repeat)
+    fastest = min(timings, key=lambda name: timings[name]["query"])
+    LOGGER.debug("Fastest spatial backend on %d points: %s", len(np.asarray(points).reshape(-1, 2)), fastest)
+    return fastest, timings
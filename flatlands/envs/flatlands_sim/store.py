@@ -0,0 +1,126 @@
+"""
+Memory-mapped storage of the arrays derived from a track
+
+Everything a WorldMap derives from its track file (the parsed points, the projected path, the centerline, its levels
+of detail and the rasters) only depends on the file, so it is computed once and saved as `.npy` files in a cache
+directory. Every process then maps the files read-only with `np.load(..., mmap_mode="r")`: the pages live once in the
+OS page cache and are shared by all the workers driving on the track, instead of each worker holding its own copy.
+
+Each entry is a group of arrays stored under a name. Its arrays are written to temporary files and renamed, and a
+small JSON listing them is renamed into place last, so processes building the same entry at once never read a
+partial one. The cache directory of a track is keyed by the path, size and modification time of the track file, so
+an edited track gets fresh arrays.
+
+Usage as follows:
+    store = ArrayStore.for_track("map_files/original_circuit_green.csv")
+    arrays = store.load("raster_0.5", lambda: {"occupancy": occupancy, ...})
+"""
+
+import os
+import json
+import hashlib
+import logging
+
+import numpy as np
+
+LOGGER = logging.getLogger("store")
+
+# Bumped whenever the layout of the stored arrays changes, so that stale caches are ignored
+STORE_VERSION = 1
+
+# Where the arrays of every track are cached, unless a cache_dir is given
+DEFAULT_CACHE_DIR = os.environ.get("FLATLANDS_CACHE_DIR") or os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "flatlands")
+
+
+class ArrayStore(object):
+    """
+    Groups of arrays saved once and memory-mapped afterwards
+    """
+
+    def __init__(self, directory):
+        """
+        :param directory: where to keep the arrays (created on the first save)
+        """
+
+        self.directory = directory
+
+    @classmethod
+    def for_track(cls, track_file, cache_dir=None, salt=""):
+        """
+        Creates the store of a track file
+
+        :param track_file:  path of the track
+        :param cache_dir:   directory holding the stores of all tracks, DEFAULT_CACHE_DIR by default
+        :param salt:        anything else the arrays depend on, e.g. the loader class
+
+        :return: an ArrayStore
+        """
+
+        path = os.path.abspath(track_file)
+        status = os.stat(path)
+        key = "{}|{}|{}|{}|{}".format(STORE_VERSION, path, status.st_size, status.st_mtime_ns, salt)
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+        name = os.path.splitext(os.path.basename(path))[0]
+        return cls(os.path.join(cache_dir or DEFAULT_CACHE_DIR, "{}-{}".format(name, digest)))
+
+    def load(self, name, build):
+        """
+        Gets a group of arrays, building and saving it if it isn't stored yet
+
+        :param name:    name of the group, unique within the store
+        :param build:   function without arguments returning the group as a dict of name -> array
+
+        :return: a dict of name -> read-only memory-mapped array. If the store can't be written to, the built
+                 arrays are returned as they are.
+        """
+
+        arrays = self._read(name)
+        if arrays is not None:
+            return arrays
+
+        arrays = build()
+        try:
+            self._write(name, arrays)
+        except OSError as error:
+            LOGGER.warning("Can't store %s in %s, keeping it in memory: %s", name, self.directory, error)
+            return arrays
+
+        # Map the saved files, so that this process shares their pages with the others as well
+        return self._read(name)
+
+    def _read(self, name):
+        """
+        Maps the arrays of a group, or returns None if the group isn't complete on disk
+        """
+
+        try:
+            with open(os.path.join(self.directory, name + ".json")) as listing:
+                keys = json.load(listing)
+            return {key: np.load(self._path(name, key), mmap_mode="r") for key in keys}
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, name, arrays):
+        """
+        Saves the arrays of a group, the listing last
+        """
+
+        os.makedirs(self.directory, exist_ok=True)
+        # Unique temporary names, processes may be writing the same group at once
+        suffix = ".{}.tmp".format(os.getpid())
+        for key, array in arrays.items():
+            path = self._path(name, key)
+            with open(path + suffix, "wb") as array_file:
+                np.save(array_file, np.asarray(array))
+            os.replace(path + suffix, path)
+
+        listing_path = os.path.join(self.directory, name + ".json")
+        with open(listing_path + suffix, "w") as listing:
+            json.dump(list(arrays), listing)
+        os.replace(listing_path + suffix, listing_path)
+        LOGGER.debug("Stored %s in %s", name, self.directory)
+
+    def _path(self, name, key):
+        return os.path.join(self.directory, "{}.{}.npy".format(name, key))
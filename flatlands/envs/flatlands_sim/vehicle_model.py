@@ -12,14 +12,15 @@ https://nabinsharma.wordpress.com/2014/01/02/kinematics-of-a-robot-bicycle-model
 """
 
 from abc import ABCMeta, abstractmethod
-import random
 import logging
 from math import pi, sin, cos, tan
 
 import numpy as np
-import pygame
 
 from .geoutils import offset
+from .kinematics import rollout
+from .dynamics import dynamic_step, dynamic_rollout, CG_TO_FRONT
+from .noise import NoiseBuffer
 
 LOGGER = logging.getLogger("vehicle")
 
@@ -27,7 +28,7 @@ LOGGER = logging.getLogger("vehicle")
 class IVehicleModel:
     __metaclass__ = ABCMeta
 
-    def __init__(self, x, y, theta=0.0, vehicle_id="Base model", debug=False):
+    def __init__(self, x, y, theta=0.0, vehicle_id="Base model", debug=False, noise_buffer=None):
         """
         Interface for vehicle models. All models should implement a reference point which corresponds to its pose,
         velocity, and acceleration. This can be the center of mass or anything else but it should be the egocentric
@@ -38,9 +39,11 @@ class IVehicleModel:
         :param theta: starting heading angle [optional]
         :param vehicle_id: string identifier of this object [optional]
         :param debug: turns on or off debug messages (verbose mode) [optional]
+        :param noise_buffer: NoiseBuffer to draw all randomness from, so that the owner controls seeding [optional]
         """
         self._id = vehicle_id
         self._debug = debug
+        self._noise_buffer = noise_buffer if noise_buffer is not None else NoiseBuffer()
         # save initial pose so that we can reset later
         self._initial_pose = np.array([x, y, theta % (2 * pi)])
         self._pose = self._initial_pose
@@ -103,9 +106,9 @@ class IVehicleModel:
         if randomize > 0:
             x, y, theta = self._initial_pose
             # this is in projected meters
-            rnd = random.uniform(-randomize, randomize)
+            rnd = self._noise_buffer.uniform(-randomize, randomize)
             x += rnd
-            rnd = random.uniform(-randomize, randomize)
+            rnd = self._noise_buffer.uniform(-randomize, randomize)
             y += rnd
             # as of now, we don't need theta noise/randomization here, it is handled in the simulator
             self._pose = np.array([x, y, theta])
@@ -127,10 +130,11 @@ class IVehicleModel:
         self._velocity = 0.0
         self._acceleration = 0.0
 
-        rnd = random.uniform(-randomize, randomize)
-        x += rnd
-        rnd = random.uniform(-randomize, randomize)
-        y += rnd
+        if randomize:
+            rnd = self._noise_buffer.uniform(-randomize, randomize)
+            x += rnd
+            rnd = self._noise_buffer.uniform(-randomize, randomize)
+            y += rnd
         self._pose = np.array([x, y, theta % (2 * pi)])
 
     @abstractmethod
@@ -154,9 +158,21 @@ class IVehicleModel:
 
 
 class PointModel(IVehicleModel):
-    def __init__(self, x, y, theta=0.0, max_velocity=0.5, max_accel=0.1, vehicle_id="Point model", noise=0, **kwargs):
-
-        super().__init__(x, y, theta, vehicle_id=vehicle_id)
+    # Length of the flat state vector returned by get_state()
+    STATE_SIZE = 6
+
+    def __init__(self,
+                 x,
+                 y,
+                 theta=0.0,
+                 max_velocity=0.5,
+                 max_accel=0.1,
+                 vehicle_id="Point model",
+                 noise=0,
+                 noise_buffer=None,
+                 **kwargs):
+
+        super().__init__(x, y, theta, vehicle_id=vehicle_id, noise_buffer=noise_buffer)
 
         # private members
         self._max_velocity = max_velocity
@@ -165,12 +181,8 @@ class PointModel(IVehicleModel):
         self._previous_theta = theta % (pi * 2)
         self._pose = np.array([x, y, theta % (pi * 2)])
 
-        # construct visual representation of model
-
-        self._sprite = (200, pygame.Surface((1000, 1000), pygame.SRCALPHA, 32))
-        car_corners = [(500, 240), (620, 760), (380, 760)]
-        pygame.draw.aalines(self._sprite[1], (0, 0, 0), True, car_corners)
-        pygame.draw.polygon(self._sprite[1], (0, 0, 0), car_corners)
+        # visual representation of model, built on first use (see sprite)
+        self._sprite = None
 
     @property
     def pose(self):
@@ -235,9 +247,27 @@ class PointModel(IVehicleModel):
         """
         return self.orientation - self._previous_theta
 
+    def __getstate__(self):
+        """
+        Leaves the sprite out when pickling, it's rebuilt on first use
+        """
+
+        state = self.__dict__.copy()
+        state["_sprite"] = None
+        return state
+
     @property
     def sprite(self):
         """Get the visual representation of the model."""
+        if self._sprite is None:
+            # Deferred so that headless runs never load pygame
+            import pygame
+
+            self._sprite = (200, pygame.Surface((1000, 1000), pygame.SRCALPHA, 32))
+            car_corners = [(500, 240), (620, 760), (380, 760)]
+            pygame.draw.aalines(self._sprite[1], (0, 0, 0), True, car_corners)
+            pygame.draw.polygon(self._sprite[1], (0, 0, 0), car_corners)
+
         return self._sprite
 
     #region Public methods
@@ -266,8 +296,10 @@ class PointModel(IVehicleModel):
         v = self.velocity + a
 
         # generate noise
-        rand_v = random.uniform(v * (-self._noise / 100), v * (self._noise / 100))
-        rand_t = random.uniform(theta * (-self._noise / 10000), theta * (self._noise / 10000))
+        rand_v = rand_t = 0.0
+        if self._noise:
+            rand_v = self._noise_buffer.uniform(v * (-self._noise / 100), v * (self._noise / 100))
+            rand_t = self._noise_buffer.uniform(theta * (-self._noise / 10000), theta * (self._noise / 10000))
 
         LOGGER.debug("noise values:    v: {0}  t: {1}".format(rand_v, rand_t))
 
@@ -302,6 +334,35 @@ class PointModel(IVehicleModel):
         accel = v - self.velocity
         self.move_accel(accel, theta)
 
+    def get_state(self, out=None):
+        """
+        Packs everything that influences the next steps into a flat array, see set_state() to restore it.
+
+        :param  out:  optional float64 array of STATE_SIZE elements to write into instead of allocating a new one
+
+        :return: the array [x, y, theta, velocity, acceleration, previous_theta]
+        """
+        if out is None:
+            out = np.empty(self.STATE_SIZE)
+        out[0:3] = self._pose
+        out[3] = self._velocity
+        out[4] = self._acceleration
+        out[5] = self._previous_theta
+        return out
+
+    def set_state(self, state):
+        """
+        Restores a state previously captured with get_state()
+
+        :param  state:  a flat array of STATE_SIZE elements
+
+        :return: None
+        """
+        self._pose = np.array(state[0:3], dtype=np.float64)
+        self._velocity = float(state[3])
+        self._acceleration = float(state[4])
+        self._previous_theta = float(state[5])
+
     def get_info_object(self):
         car_info_object = {
             "car_model": "Point",
@@ -358,6 +419,8 @@ class BicycleModel(PointModel):
     It inherits a lot of functionalities from the simpler PointModel.
     """
 
+    STATE_SIZE = PointModel.STATE_SIZE + 2
+
     # Toyota Corolla has 2.6m wheelbase
     # 50 m/s max speed = 180 kmph
     # WGS84 is in meters, let's keep use meters for now
@@ -372,9 +435,17 @@ class BicycleModel(PointModel):
             max_velocity=0.5,
             max_accel=0.1,
             vehicle_id="Bicycle model",
-            noise=0):
+            noise=0,
+            noise_buffer=None):
 
-        super().__init__(x, y, theta, vehicle_id=vehicle_id, max_velocity=max_velocity, max_accel=max_accel)
+        super().__init__(
+            x,
+            y,
+            theta,
+            vehicle_id=vehicle_id,
+            max_velocity=max_velocity,
+            max_accel=max_accel,
+            noise_buffer=noise_buffer)
 
         # private members
         self._wheelbase = wheelbase
@@ -437,6 +508,24 @@ class BicycleModel(PointModel):
         """
         return self._wheel_turn_angle - self._previous_wheel_angle
 
+    @property
+    def footprint_offset(self):
+        """
+        Distance from the position to the middle of the wheelbase, along the heading
+
+        :returns: a distance in meters, half the wheelbase as the position is the rear axle
+        """
+        return self._wheelbase / 2
+
+    @property
+    def footprint_center(self):
+        """
+        Middle of the wheelbase, the center of the footprint the off track tests use
+
+        :returns: an x-y coordinate pair
+        """
+        return self.position + self.footprint_offset * np.array([sin(self.orientation), cos(self.orientation)])
+
     @property
     def center_of_turn(self):
         """
@@ -471,11 +560,6 @@ class BicycleModel(PointModel):
         """
         return self.velocity * cos(self.orientation)
 
-    @property
-    def sprite(self):
-        """Get the visual representation of the model."""
-        return self._sprite
-
     #endregion
 
     #region IVehicleModel implementation
@@ -505,8 +589,11 @@ class BicycleModel(PointModel):
             wheel_angle = np.clip(wheel_angle, -self._max_wheel_angle, self._max_wheel_angle)
 
         # generate noise on the inputted control parameters
-        rand_accel = random.uniform(a * (-self._noise / 100), a * (self._noise / 100))
-        rand_wheel_angle = random.uniform(wheel_angle * (-self._noise / 100), wheel_angle * (self._noise / 100))
+        rand_accel = rand_wheel_angle = 0.0
+        if self._noise:
+            rand_accel = self._noise_buffer.uniform(a * (-self._noise / 100), a * (self._noise / 100))
+            rand_wheel_angle = self._noise_buffer.uniform(wheel_angle * (-self._noise / 100),
+                                                          wheel_angle * (self._noise / 100))
         LOGGER.debug("Added action noise values: acceleration: {0}  wheel_angle: {1}".format(
             rand_accel, rand_wheel_angle))
 
@@ -561,6 +648,49 @@ class BicycleModel(PointModel):
         accel = v - self.velocity
         self.move_accel(accel, wheel_angle)
 
+    def get_state(self, out=None):
+        """
+        Packs everything that influences the next steps into a flat array, see set_state() to restore it.
+
+        :param  out:  optional float64 array of STATE_SIZE elements to write into instead of allocating a new one
+
+        :return: the PointModel state followed by [wheel_turn_angle, previous_wheel_angle]
+        """
+        out = super().get_state(out)
+        out[6] = self._wheel_turn_angle
+        out[7] = self._previous_wheel_angle
+        return out
+
+    def set_state(self, state):
+        """
+        Restores a state previously captured with get_state()
+
+        :param  state:  a flat array of STATE_SIZE elements
+
+        :return: None
+        """
+        super().set_state(state)
+        self._wheel_turn_angle = float(state[6])
+        self._previous_wheel_angle = float(state[7])
+
+    def rollout(self, actions):
+        """
+        Simulates candidate action sequences starting from the current state, without changing this model.
+        Noise is not applied, see `kinematics.rollout` for the details.
+
+        :param  actions:  array of shape (K, T, 2) holding [acceleration, wheel_angle] for every step
+
+        :return: an array of shape (K, T, 4) holding the [x, y, theta, velocity] reached after every step
+        """
+        return rollout(
+            self.pose,
+            self.velocity,
+            actions,
+            wheelbase=self.wheelbase,
+            max_wheel_angle=self.max_wheel_angle,
+            max_velocity=self.max_velocity,
+            max_accel=self.max_accel)
+
     def get_info_object(self):
         car_info_object = {
             "car_model": "Bicycle",
@@ -580,3 +710,204 @@ class BicycleModel(PointModel):
         return car_info_object
 
     #endregion
+
+
+class DynamicBicycleModel(BicycleModel):
+    """
+    Bicycle model with mass, yaw inertia and linear tires, see `dynamics.py`. The car slides when the tires slip, so
+    its velocity doesn't necessarily point where it's heading.
+    Its pose ([x, y, theta]) represents its center of gravity, `velocity` is its forward velocity.
+    """
+
+    STATE_SIZE = BicycleModel.STATE_SIZE + 2
+
+    def __init__(self,
+                 x,
+                 y,
+                 theta=0.0,
+                 wheelbase=2.6,
+                 track=1.2,
+                 max_wheel_angle=pi / 3,
+                 max_velocity=0.5,
+                 max_accel=0.1,
+                 vehicle_id="Dynamic bicycle model",
+                 noise=0,
+                 noise_buffer=None,
+                 **dynamics_params):
+        """
+        :param dynamics_params: keyword arguments of `dynamics.dynamic_step`, such as dt (the duration of a step in
+                                seconds), mass, yaw_inertia, cg_to_front, front_stiffness and rear_stiffness [optional]
+        """
+
+        super().__init__(
+            x,
+            y,
+            theta,
+            wheelbase=wheelbase,
+            track=track,
+            max_wheel_angle=max_wheel_angle,
+            max_velocity=max_velocity,
+            max_accel=max_accel,
+            vehicle_id=vehicle_id,
+            noise=noise,
+            noise_buffer=noise_buffer)
+
+        self._dynamics_params = dynamics_params
+        self._lateral_velocity = 0.0
+        self._yaw_rate = 0.0
+
+    #region Properties
+    @property
+    def lateral_velocity(self):
+        """
+        Sideways velocity of the center of gravity, positive to the right
+
+        :returns: a velocity value (meters / step)
+        """
+        return self._lateral_velocity
+
+    @property
+    def yaw_rate(self):
+        """
+        Current rate of turn, positive to the right
+
+        :returns: an angular velocity value (radians / step)
+        """
+        return self._yaw_rate
+
+    @property
+    def footprint_offset(self):
+        """
+        Distance from the position to the middle of the wheelbase, along the heading
+
+        :returns: a distance in meters, negative when the center of gravity lies in front of the middle
+        """
+        return self._dynamics_params.get("cg_to_front", CG_TO_FRONT) - self._wheelbase / 2
+
+    @property
+    def slip_angle(self):
+        """
+        Angle between the heading and the direction of travel of the center of gravity
+
+        :returns: an angle in radians, positive when sliding to the right
+        """
+        return np.arctan2(self._lateral_velocity, self.velocity)
+
+    #endregion
+
+    #region IVehicleModel implementation
+
+    def move_accel(self, a=None, wheel_angle=None):
+        """
+        Acceleration-based step simulation, integrating the dynamics over one step.
+
+        :param  a:            acceleration with which the model should move
+        :param  wheel_angle:  angle in which direction the wheel should be turned before movement
+
+        :return: None
+        """
+
+        if a is None:
+            a = self.acceleration
+            LOGGER.debug("No acceleration provided, keeping previous value: %f", self.acceleration)
+        if wheel_angle is None:
+            wheel_angle = self.wheel_turn_angle
+            LOGGER.debug("No steer angle provided, keeping previous value: %f", self.wheel_turn_angle)
+
+        # clip before drawing the noise, as the kinematic model does
+        if self.max_accel is not None:
+            a = float(np.clip(a, -self.max_accel, self.max_accel))
+        if self._max_wheel_angle is not None:
+            wheel_angle = float(np.clip(wheel_angle, -self._max_wheel_angle, self._max_wheel_angle))
+
+        action_noise = None
+        if self._noise:
+            action_noise = np.array([[
+                self._noise_buffer.uniform(-self._noise / 100, self._noise / 100),
+                self._noise_buffer.uniform(-self._noise / 100, self._noise / 100)
+            ]])
+
+        state = np.array([[*self._pose, self._velocity, self._lateral_velocity, self._yaw_rate]])
+        x, y, theta, v, self._lateral_velocity, self._yaw_rate = dynamic_step(
+            state, [[a, wheel_angle]],
+            wheelbase=self.wheelbase,
+            max_wheel_angle=self.max_wheel_angle,
+            max_velocity=self.max_velocity,
+            max_accel=self.max_accel,
+            action_noise=action_noise,
+            **self._dynamics_params)[0].tolist()
+
+        self._previous_wheel_angle = self._wheel_turn_angle
+        self._wheel_turn_angle = wheel_angle if action_noise is None else wheel_angle * (1 + action_noise[0, 1])
+        self._set_pose(x, y, theta)
+        self._acceleration = v - self._velocity
+        self._velocity = v
+
+    def set(self, x, y, theta, randomize=0):
+        """
+        Sets vehicle to a location-heading, standing still
+        """
+        super().set(x, y, theta, randomize=randomize)
+        self._lateral_velocity = 0.0
+        self._yaw_rate = 0.0
+
+    def reset(self, randomize=0):
+        """
+        Resets vehicle to its original (intitialized) location-heading, standing still
+        """
+        super().reset(randomize=randomize)
+        self._lateral_velocity = 0.0
+        self._yaw_rate = 0.0
+
+    def get_state(self, out=None):
+        """
+        Packs everything that influences the next steps into a flat array, see set_state() to restore it.
+
+        :param  out:  optional float64 array of STATE_SIZE elements to write into instead of allocating a new one
+
+        :return: the BicycleModel state followed by [lateral_velocity, yaw_rate]
+        """
+        out = super().get_state(out)
+        out[8] = self._lateral_velocity
+        out[9] = self._yaw_rate
+        return out
+
+    def set_state(self, state):
+        """
+        Restores a state previously captured with get_state()
+
+        :param  state:  a flat array of STATE_SIZE elements
+
+        :return: None
+        """
+        super().set_state(state)
+        self._lateral_velocity = float(state[8])
+        self._yaw_rate = float(state[9])
+
+    def rollout(self, actions):
+        """
+        Simulates candidate action sequences starting from the current state, without changing this model.
+        Noise is not applied, see `dynamics.dynamic_rollout` for the details.
+
+        :param  actions:  array of shape (K, T, 2) holding [acceleration, wheel_angle] for every step
+
+        :return: an array of shape (K, T, 6) holding the [x, y, theta, velocity, lateral_velocity, yaw_rate] reached
+                 after every step, the first 4 columns lining up with the kinematic rollout
+        """
+        return dynamic_rollout(
+            [*self._pose, self._velocity, self._lateral_velocity, self._yaw_rate],
+            actions,
+            wheelbase=self.wheelbase,
+            max_wheel_angle=self.max_wheel_angle,
+            max_velocity=self.max_velocity,
+            max_accel=self.max_accel,
+            **self._dynamics_params)
+
+    def get_info_object(self):
+        car_info_object = super().get_info_object()
+        car_info_object["car_model"] = "DynamicBicycle"
+        car_info_object["lateral_speed"] = self.lateral_velocity
+        car_info_object["yaw_rate"] = self.yaw_rate
+        return car_info_object
+
+    #endregion
@@ -2,19 +2,82 @@
 Module for handling world information and generating world related observations
 Usage as follows:
     from map import WorldMap
+
+Worlds are read-only once loaded, load_world() shares one instance per track file within a process. They are pickled
+as a reference to their track file, so sending one to another process costs a path and the track is loaded at most
+once per process. The arrays derived from the track file (points, path, centerline, levels of detail and rasters) are
+saved once in a cache directory and memory-mapped by every process (see store.py), so workers share their pages
+instead of each holding a copy.
 """
 
+import os
 import csv
+import inspect
 from collections import namedtuple
 import math
 import logging
 
-from scipy.spatial import cKDTree as KDTree
+import numpy as np
 
-from .geoutils import bearing, proj_to_local, get_distance_to_lines, relative_distance
+from .bounds import TrackBounds
+from .centerline import Centerline
+from .raster import TrackRaster
+from .spatial import make_index
+from .store import ArrayStore
+from .geoutils import bearing, proj_to_local, get_distance_to_lines, relative_distance, relative_distances
 
 LOGGER = logging.getLogger("world")
 
+# Columns of WorldMap.track_data, in the order of the map_point namedtuple
+TRACK_DTYPE = np.dtype([
+    ("lat", np.float64),
+    ("lon", np.float64),
+    ("width", np.float64),
+    ("direction", np.float64),
+    ("segment_length", np.float64),
+])
+
+LocalCoord = namedtuple("local_coord", "x_local, y_local")
+
+# Worlds loaded by load_world(), keyed by track file and constructor arguments
+_WORLD_CACHE = {}
+
+
+def load_world(track_file, **kwargs):
+    """
+    Gets the WorldMap of a track file, loading it only once per process
+
+    Accepts:
+        track_file: path of the track
+        kwargs: passed on to the WorldMap constructor
+    Returns:
+        The WorldMap shared by all callers in this process with the same arguments
+    """
+
+    key = _world_key(track_file, kwargs)
+    if key not in _WORLD_CACHE:
+        LOGGER.debug("Loading %s into the world cache", track_file)
+        _WORLD_CACHE[key] = WorldMap(track_file, **kwargs)
+
+    return _WORLD_CACHE[key]
+
+
+def _world_key(track_file, kwargs):
+    """
+    Identifies the world of a track file and constructor arguments, the defaults filled in, so that a world pickled
+    with all of its arguments maps back to the entry of the world loaded with only some of them
+    """
+
+    arguments = inspect.signature(WorldMap).bind(track_file, **kwargs)
+    arguments.apply_defaults()
+    arguments = dict(arguments.arguments, track_file=os.path.abspath(track_file))
+    return repr(sorted((name, value) for name, value in arguments.items() if name not in ("args", "kwargs")))
+
+
+def _unpickle_world(track_file, kwargs):
+    """Rebuilds a pickled WorldMap through the world cache."""
+    return load_world(track_file, **kwargs)
+
 
 class WorldMap(object):
     """
@@ -28,15 +91,67 @@ class WorldMap(object):
     formatted with the map_point structure
     """
 
-    def __init__(self, track_file=None, zoomed_percentage_of_window=0.3, debug=False, *args, **kwargs):
-
-        # list of mapping points to be filled after loading data
-        self.map_data = None
+    def __init__(self,
+                 track_file=None,
+                 zoomed_percentage_of_window=0.3,
+                 debug=False,
+                 *args,
+                 lod_resolution=0.5,
+                 lod_tolerances=(0.02, 0.1, 0.5),
+                 spatial_backend="kdtree",
+                 cache_dir=None,
+                 **kwargs):
+        """
+        :param track_file:      path of the track
+        :param lod_resolution:  point spacing of level of detail 0, in meters, see get_lod
+        :param lod_tolerances:  deviations in meters allowed by the next levels of detail, see get_lod
+        :param spatial_backend: nearest track point index, see spatial.py
+        :param cache_dir:       directory to store the arrays derived from the track file in, shared by all processes
+                                (see store.py). store.DEFAULT_CACHE_DIR by default, False to keep them in memory.
+        """
+
+        # Structured array of the track points (see TRACK_DTYPE), filled after loading data. The map_data
+        # list of namedtuples is only built on first use, since it takes several times the memory.
+        self.track_data = None
+        self._map_data = None
         # will be calculated when the map is loaded in load()
         self._path_length = None
 
-        # Projected path data to be filled after loading data
-        self.projected_path = None
+        # Projected path namedtuples, built on first use from path_array
+        self._projected_path = None
+        # The same points as an (N, 2) numpy array, for vectorized lookups
+        self.path_array = None
+        # Arc length parametrization of the path, for Frenet coordinates
+        self.centerline = None
+        # Arc length (in meters) at every point of path_array, to turn a nearest point index into track progress
+        self.path_arc_length = None
+
+        # Level of detail 0 is the path resampled every `lod_resolution` meters, the next levels
+        # simplify it to stay within each of `lod_tolerances` meters. They are built on first use.
+        self.lod_resolution = lod_resolution
+        self.lod_tolerances = tuple(lod_tolerances)
+        self._lods = {}
+        # Grid of the track surface quads for off-track tests, built on first use
+        self._track_bounds = None
+        # Rasters of the track by resolution, built on first use
+        self._rasters = {}
+
+        # Constructor arguments, to pickle the world as a reference to its track file
+        self._load_kwargs = {
+            "zoomed_percentage_of_window": zoomed_percentage_of_window,
+            "debug": debug,
+            "lod_resolution": lod_resolution,
+            "lod_tolerances": self.lod_tolerances,
+            "spatial_backend": spatial_backend,
+            "cache_dir": cache_dir,
+        }
+
+        # Memory-mapped arrays derived from the track file, see store.py. They are only used while the track data
+        # comes from the track file, not from a map_data assigned afterwards.
+        self.store = None
+        if cache_dir is not False and track_file is not None and os.path.isfile(track_file):
+            self.store = ArrayStore.for_track(track_file, cache_dir, salt=type(self).__qualname__)
+        self._from_track_file = False
 
         # This will determine if we should display stuff like text on the screen
         self.debug = debug
@@ -50,8 +165,10 @@ class WorldMap(object):
 
         self._model = None
 
-        # Holds the scipy kd-tree created from all map-points in a x-y projection
-        self.kd_tree = None
+        # Nearest neighbour index over all map-points in a x-y projection: "kdtree", "grid", "brute" or "auto" for
+        # the fastest on this track, see spatial.py
+        self.spatial_backend = spatial_backend
+        self.spatial_index = None
 
         self.map_point = namedtuple('map_point', [
             'lat',
@@ -69,6 +186,21 @@ class WorldMap(object):
 
         LOGGER.debug("Map initialized.")
 
+    def __reduce__(self):
+        """
+        Pickles the world as its track file and constructor arguments, see load_world()
+        """
+
+        return _unpickle_world, (self.map_file, self._load_kwargs)
+
+    @property
+    def kd_tree(self):
+        """
+        The spatial index of the track points, under its original name. It's a KD-tree with the default backend, all
+        backends have the same `data` and `query`.
+        """
+        return self.spatial_index
+
     @property
     def model(self):
         """Gets the vehicle model."""
@@ -79,19 +211,48 @@ class WorldMap(object):
         """Sets the vehicle model."""
         self._model = value
 
+    @property
+    def map_data(self):
+        """
+        Returns the track points as a list of map_point namedtuples
+        """
+        if self._map_data is None and self.track_data is not None:
+            self._map_data = [self.map_point(*point) for point in self.track_data.tolist()]
+        return self._map_data
+
+    @map_data.setter
+    def map_data(self, value):
+        """
+        Sets the track points from a list of map_point namedtuples, as custom load() functions do
+        """
+        self._map_data = value
+        self._from_track_file = False
+        if value is not None:
+            self.track_data = np.array([(x.lat, x.lon, x.width, x.direction, x.segment_length) for x in value],
+                                       dtype=TRACK_DTYPE)
+
+    @property
+    def projected_path(self):
+        """
+        Returns the x-y coordinates of the local projection as a list of namedtuples with x_local and y_local
+        """
+        if self._projected_path is None and self.path_array is not None:
+            self._projected_path = [LocalCoord(*point) for point in self.path_array.tolist()]
+        return self._projected_path
+
     @property
     def path_global(self):
         """
         Returns all of the x-y coords in the map file
         """
-        return [(x.lat, x.lon) for x in self.map_data]
+        return list(zip(self.track_data["lat"].tolist(), self.track_data["lon"].tolist()))
 
     @property
     def path(self):
         """
         Returns x, y coordinates from a local projection
         """
-        return [(x.x_local, x.y_local) for x in self.projected_path]
+        return [tuple(point) for point in self.path_array.tolist()]
 
     @property
     def path_length(self):
@@ -106,63 +267,63 @@ class WorldMap(object):
         Returns a list of all the widths for every point in the track
         """
 
-        return [(x.width) for x in self.map_data]
+        return self.track_data["width"].tolist()
 
     @property
     def start(self):
         """
         Returns only the first set of x-y coords in the map file
         """
-        return (self.projected_path[0].x_local, self.projected_path[0].y_local)
+        return tuple(self.path_array[0].tolist())
 
     @property
     def goal(self):
         """
         Returns only the last set of x-y coords for the map file
         """
-        return (self.projected_path[-1].x_local, self.projected_path[-1].y_local)
+        return tuple(self.path_array[-1].tolist())
 
     @property
     def segment_length(self):
         """
         Returns the distances of each segment towards the next one
         """
-        return [(x.segment_length) for x in self.map_data]
+        return self.track_data["segment_length"].tolist()
 
     @property
     def direction(self):
         """
         Return the direction of a segment of track
         """
-        return [(x.direction) for x in self.map_data]
+        return self.track_data["direction"].tolist()
 
     @property
     def y_min(self):
         """
         Find the minimum y of the track
         """
-        return min([x.y_local for x in self.projected_path])
+        return float(self.path_array[:, 1].min())
 
     @property
     def y_max(self):
         """
         Find the maximum y of the track
         """
-        return max([x.y_local for x in self.projected_path])
+        return float(self.path_array[:, 1].max())
 
     @property
     def x_min(self):
         """
         Find the minimum x of the track
         """
-        return min([x.x_local for x in self.projected_path])
+        return float(self.path_array[:, 0].min())
 
     @property
     def x_max(self):
         """
         Find the maximum x of the track
         """
-        return max([x.x_local for x in self.projected_path])
+        return float(self.path_array[:, 0].max())
 
     def load(self, track_file):
         """
@@ -172,67 +333,106 @@ class WorldMap(object):
 
         try:
             LOGGER.debug("Attempting to open %s", self.map_file_path)
-            with open(self.map_file_path, newline="") as csvfile:
-                spamreader = csv.reader(csvfile, delimiter=",", quotechar='"')
-                map_data = []
-                line = csvfile.readline()
-                scale = float(line[line.index("=") + 1:])
-
-                line = csvfile.readline()
-                height = float(line[line.index("=") + 1:])
-
-                line = csvfile.readline()
-
-                for row in spamreader:
-                    row_float = [float(i) for i in row]
-
-                    map_data.append(
-                        self.map_point(
-                            lon=row_float[0] / scale,
-                            # flip the y-coordinate in preparation for the rotation in draw.py
-                            lat=(height - row_float[1]) / scale,
-                            width=row_float[2],
-                            direction=row_float[4],
-                            segment_length=row_float[3] / scale))
-
-                end = map_data[-1]
-                start = map_data[0]
-
-                theta = bearing((end.lon, end.lat), (start.lon, start.lat))
-                dist = math.sqrt(abs(end.lon - start.lon)**2 + abs(end.lat - start.lat)**2)
-                map_data[-1] = self.map_point(
-                    lon=end.lon, lat=end.lat, width=end.width, direction=theta, segment_length=dist)
-                map_data.append(start)
-                LOGGER.debug("Found %d points of track data", len(map_data))
-                self.map_data = map_data
+            self._from_track_file = True
+            self.track_data = self._shared("track", lambda: {"track_data": self._parse(track_file)})["track_data"]
+            self._map_data = None
         except EnvironmentError:
             LOGGER.error("Failed to import file %s", self.map_file_path)
             LOGGER.error(EnvironmentError)
             raise
 
+    @staticmethod
+    def _parse(track_file):
+        """
+        Reads the points of a track file
+
+        Accepts: track_file: path of the track
+        Returns: a structured array of TRACK_DTYPE, with one more point closing the loop
+        """
+
+        with open(track_file, newline="") as csvfile:
+            spamreader = csv.reader(csvfile, delimiter=",", quotechar='"')
+            line = csvfile.readline()
+            scale = float(line[line.index("=") + 1:])
+
+            line = csvfile.readline()
+            height = float(line[line.index("=") + 1:])
+
+            line = csvfile.readline()
+
+            rows = np.array([[float(i) for i in row] for row in spamreader])
+
+            # One more point, to close the loop
+            track_data = np.zeros(len(rows) + 1, dtype=TRACK_DTYPE)
+            track_data["lon"][:-1] = rows[:, 0] / scale
+            # flip the y-coordinate in preparation for the rotation in draw.py
+            track_data["lat"][:-1] = (height - rows[:, 1]) / scale
+            track_data["width"][:-1] = rows[:, 2]
+            track_data["direction"][:-1] = rows[:, 4]
+            track_data["segment_length"][:-1] = rows[:, 3] / scale
+
+            end = track_data[-2].item()
+            start = track_data[0].item()
+
+            theta = bearing((end[1], end[0]), (start[1], start[0]))
+            dist = math.sqrt(abs(end[1] - start[1])**2 + abs(end[0] - start[0])**2)
+            track_data["direction"][-2] = theta
+            track_data["segment_length"][-2] = dist
+            track_data[-1] = start
+            LOGGER.debug("Found %d points of track data", len(track_data))
+            return track_data
+
     def post_load(self, project_to_local=False):
         """
         After loading data, call this function to initialize the rest of the
         map class for things such as the local coordinate system
         """
 
-        if project_to_local:
-            # Converts our path data to EPSG 30176 x-y space
-            # List of namedtuples with x_local, and y_local attributes
-            # Only required if we're getting GPS coordinates from Japan
-            LOGGER.debug("Generating projection of path")
-            self.projected_path = proj_to_local(self.path_global)
-        else:
-            local_coord = namedtuple("local_coord", "x_local, y_local")
-            self.projected_path = [local_coord(i[1], i[0]) for i in self.path_global]
+        def build_path():
+            if project_to_local:
+                # Converts our path data to EPSG 30176 x-y space
+                # List of namedtuples with x_local, and y_local attributes
+                # Only required if we're getting GPS coordinates from Japan
+                LOGGER.debug("Generating projection of path")
+                path = np.array([tuple(point) for point in proj_to_local(self.path_global)])
+            else:
+                path = np.column_stack([self.track_data["lon"], self.track_data["lat"]])
+
+            arrays = Centerline(path, widths=self.track_data["width"]).arrays()
+            arrays["path"] = path
+            arrays["path_arc_length"] = np.concatenate([[0], np.cumsum(np.hypot(*np.diff(path, axis=0).T))])
+            return arrays
+
+        arrays = self._shared("path_projected" if project_to_local else "path", build_path)
+
+        # Spatial index for efficient lookup of points (like nearest neighbor)
+        LOGGER.debug("Generating %s spatial index of projection", self.spatial_backend)
+        self.spatial_index = make_index(arrays["path"], self.spatial_backend)
+        self.path_array = self.spatial_index.data
+        self._projected_path = None
+        self._track_bounds = None
+        self._rasters = {}
+        self._lods = {}
 
-        # Scipy kd_tree for efficient lookup of points (like nearest neighbor)
-        LOGGER.debug("Generating KD-tree of projection")
-        self.kd_tree = KDTree(self.projected_path)
+        self.centerline = Centerline.from_arrays(arrays)
+        self.path_arc_length = arrays["path_arc_length"]
 
         # precalculate path length here to save time later
-        dists = (i for i in self.segment_length)
-        self._path_length = sum(dists)
+        self._path_length = sum(self.segment_length)
+
+    def _shared(self, name, build):
+        """
+        Gets a group of arrays derived from the track through the store, so that all processes map the same pages
+
+        Accepts:
+            name: name of the group, including every parameter the arrays depend on
+            build: function without arguments returning the group as a dict of name -> array
+        Returns: a dict of name -> array, read-only when stored
+        """
+
+        if self.store is None or not self._from_track_file:
+            return build()
+        return self.store.load(name, build)
 
     def distance_from_track(self, input_location):
         """
@@ -250,13 +450,9 @@ class WorldMap(object):
         LOGGER.debug("The nearest point is at index %s", nearest_index)
 
         # Go forward and back from this point to get two more
-        point1 = self.kd_tree.data[nearest_index - 1]
-        if nearest_index - 1 > len(self.kd_tree.data):
-            point2 = self.kd_tree.data[nearest_index]
-            point3 = self.kd_tree.data[nearest_index + 1]
-        else:
-            point2 = self.kd_tree.data[0]
-            point3 = self.kd_tree.data[1]
+        point1 = self.path_array[nearest_index - 1]
+        point2 = self.path_array[nearest_index]
+        point3 = self.path_array[(nearest_index + 1) % len(self.path_array)]
 
         closest_pt = get_distance_to_lines(input_location, point1, point2, point3)
 
@@ -280,7 +476,7 @@ class WorldMap(object):
 
         return sum(dists) + self.distance_from_track(input_location)
 
-    def get_dist_upcoming_points(self, position, angle, num_points=5):
+    def get_dist_upcoming_points(self, position, angle, num_points=5, nearest_point_idx=None):
         """
         Function for finding the relative location of the upcoming points on
         the track nearest to the target.
@@ -288,6 +484,7 @@ class WorldMap(object):
         Accepts:
             position: x-y tuple containing the search point
             n: the number of points to return distance info for
+            nearest_point_idx: index of the track point nearest to `position`, if the caller already looked it up
         Returns:
             A list of (n) tuples containing the distance in meters (x and y)
             to each of the upcoming points on the track. Positive numbers are right and front.
@@ -299,9 +496,10 @@ class WorldMap(object):
         """
 
         # Get the closest point to the input
-        nearest_point_idx = self.get_nearest_points(position, one_point_only=True, return_index=True)
+        if nearest_point_idx is None:
+            nearest_point_idx = self.get_nearest_points(position, one_point_only=True, return_index=True)
         LOGGER.debug("Nearest point to the input is %s", nearest_point_idx)
-        LOGGER.debug("input:%s, closest:%s", position, self.kd_tree.data[nearest_point_idx - 1])
+        LOGGER.debug("input:%s, closest:%s", position, self.path_array[nearest_point_idx])
 
         # Get the upcoming points on the track
         last_point = nearest_point_idx + num_points + 1
@@ -309,7 +507,7 @@ class WorldMap(object):
 
         # For proper "looping" around the track, go back to the beggining if we run out of values
         for i in range(num_points - len(point_set) + 1):
-            point_set.append(self.path[i])
+            point_set.append(self.projected_path[i])
 
         # Get the distance to each of these points
         distances = [relative_distance(position, destination, angle) for destination in point_set]
@@ -320,6 +518,187 @@ class WorldMap(object):
             return [x.distances for x in distances[1:]]
         return [x.distances for x in distances[:-1]]
 
+    def get_upcoming_points_array(self, position, angle, num_points=5, nearest_point_idx=None, out=None):
+        """
+        Array version of get_dist_upcoming_points, returning the same values without building intermediate lists.
+
+        Accepts:
+            position: x-y tuple containing the search point
+            angle: the heading of the car
+            num_points: the number of points to return distance info for
+            nearest_point_idx: index of the track point nearest to `position`, if the caller already looked it up
+            out: optional (num_points, 2) array to write the result into (for example float32)
+        Returns:
+            An array of shape (num_points, 2) holding the x-y distances in meters to the upcoming points
+        """
+
+        if nearest_point_idx is None:
+            nearest_point_idx = self.get_nearest_points(position, one_point_only=True, return_index=True)
+
+        # Same wrap-around as get_dist_upcoming_points: continue from the beginning of the path
+        idxs = np.arange(nearest_point_idx, nearest_point_idx + num_points + 1) % len(self.path_array)
+        distances = relative_distances(position, self.path_array[idxs], angle)
+
+        # If the first value is behind the origin then don't return it
+        first = 1 if distances[0, 1] < 0 else 0
+
+        if out is None:
+            return distances[first:first + num_points]
+        out[...] = distances[first:first + num_points]
+        return out
+
+    def get_upcoming_points_batch(self, positions, angles, num_points=5, nearest_point_idxs=None, out=None):
+        """
+        Batched get_upcoming_points_array, for many cars at once.
+
+        Accepts:
+            positions: array of shape (N, 2) holding the x-y of every car
+            angles: array of shape (N,) holding the heading of every car
+            num_points: the number of points to return distance info for
+            nearest_point_idxs: indexes of the track points nearest to every car, if already looked up
+            out: optional (N, num_points, 2) array to write the result into
+        Returns:
+            An array of shape (N, num_points, 2) holding the x-y distances in meters to the upcoming points
+        """
+
+        positions = np.asarray(positions, dtype=np.float64)
+        angles = np.asarray(angles, dtype=np.float64)
+        if nearest_point_idxs is None:
+            nearest_point_idxs = self.spatial_index.query(positions)[1]
+
+        idxs = (nearest_point_idxs[:, None] + np.arange(num_points + 1)) % len(self.path_array)
+        distances = relative_distances(positions[:, None, :], self.path_array[idxs], angles[:, None])
+
+        # Drop the first point for the cars which already passed it
+        first = (distances[:, 0, 1] < 0).astype(np.intp)
+        rows = first[:, None] + np.arange(num_points)
+
+        if out is None:
+            out = np.empty((len(positions), num_points, 2))
+        out[...] = np.take_along_axis(distances, rows[:, :, None], axis=1)
+        return out
+
+    @property
+    def track_bounds(self):
+        """
+        The track surface as a TrackBounds, made of the quads DrawMap draws
+        """
+
+        if self._track_bounds is None and self.path_array is not None:
+            self._track_bounds = TrackBounds.from_world(self)
+        return self._track_bounds
+
+    def get_raster(self, resolution=0.5):
+        """
+        Gets the occupancy grid, signed distance field and nearest track point grid of the track
+
+        Accepts: resolution: side of a cell in meters
+        Returns: a TrackRaster, built on first use and shared afterwards
+        """
+
+        resolution = float(resolution)
+        if resolution not in self._rasters:
+
+            def build_raster():
+                raster = TrackRaster.from_world(self, resolution=resolution)
+                return {
+                    "occupancy": raster.occupancy,
+                    "signed_distance": raster.signed_distance_grid,
+                    "nearest_index": raster.nearest_index_grid,
+                    "origin": raster.origin,
+                }
+
+            # Backends may pick different points among equally near ones, so each gets its own nearest index grid
+            arrays = self._shared("raster_{}_{}".format(resolution, type(self.spatial_index).__name__), build_raster)
+            self._rasters[resolution] = TrackRaster(arrays["occupancy"], arrays["signed_distance"],
+                                                    arrays["nearest_index"], arrays["origin"], resolution)
+        return self._rasters[resolution]
+
+    @property
+    def num_lods(self):
+        """
+        Number of available levels of detail (see get_lod)
+        """
+
+        return 1 + len(self.lod_tolerances)
+
+    def get_lod(self, level=0):
+        """
+        Gets a level of detail of the track centerline, each with its own KD-tree
+
+        Accepts:
+            level: 0 for the uniformly resampled track, higher levels are increasingly simplified,
+                None for the centerline of the source points
+        Returns:
+            A Centerline
+        """
+
+        if level is None:
+            return self.centerline
+
+        if level not in self._lods:
+            if not 0 <= level < self.num_lods:
+                raise ValueError("Level of detail must be in [0, {}), got {}".format(self.num_lods, level))
+
+            if level == 0:
+                name = "lod_{}".format(self.lod_resolution)
+                arrays = self._shared(name, lambda: self.centerline.resample(self.lod_resolution).arrays())
+            else:
+                name = "lod_{}_{}".format(self.lod_resolution, self.lod_tolerances[level - 1])
+                arrays = self._shared(name, lambda: self.get_lod(0).simplify(self.lod_tolerances[level - 1]).arrays())
+            lod = Centerline.from_arrays(arrays, closed=self.centerline.closed)
+            LOGGER.debug("Built level of detail %d with %d points", level, len(lod.points))
+            self._lods[level] = lod
+
+        return self._lods[level]
+
+    def to_frenet(self, xy, level=None):
+        """
+        Projects points onto the track centerline
+
+        Accepts:
+            xy: array-like of shape (..., 2) holding any number of x-y points
+            level: level of detail to project onto (see get_lod), the source points by default
+        Returns:
+            A 3-tuple of arrays of shape (...): the arc length s along the track, the signed lateral offset d
+            in meters (positive to the right of the driving direction) and the local track heading
+        """
+
+        return self.get_lod(level).to_frenet(xy)
+
+    def from_frenet(self, s, d=0.0, level=None):
+        """
+        Converts Frenet coordinates (see to_frenet) back to x-y
+
+        Accepts:
+            s: array-like of arc lengths along the track (wrapped around the lap)
+            d: lateral offsets in meters, positive to the right
+            level: level of detail to use (see get_lod), the source points by default
+        Returns:
+            An array of shape s.shape + (2,) holding the x-y coordinates
+        """
+
+        return self.get_lod(level).from_frenet(s, d)
+
+    def get_lookahead_points(self, positions, angles, offsets=(5, 10, 20, 40), level=None, out=None):
+        """
+        Distance-based counterpart of get_dist_upcoming_points: the centerline points at fixed distances
+        along the track ahead of each car, interpolated between the track points so the horizon doesn't
+        depend on how densely the map was sampled.
+
+        Accepts:
+            positions: array of shape (N, 2), or a single x-y tuple
+            angles: array of shape (N,) holding the heading of every car, or a single heading
+            offsets: distances along the track, in meters
+            level: level of detail to interpolate on (see get_lod), the source points by default
+            out: optional (N, len(offsets), 2) array to write the result into
+        Returns:
+            An array of shape (N, len(offsets), 2) holding the distance in meters to the right (x)
+            and to the front (y) of each car, for every offset
+        """
+
+        return self.get_lod(level).lookahead(positions, angles, offsets, out=out)
+
     def get_nearest_points(self, origin, one_point_only=False, return_index=False):
         """
         Find the nearest two points on the track to an arbitrary x-y pair,
@@ -335,27 +714,26 @@ class WorldMap(object):
             nearest point(s) on the track
         """
 
-        closest = self.kd_tree.query(origin)
-        idx = closest[1]
-        closest_local_coords = self.kd_tree.data[idx - 1]
+        idx = self.spatial_index.query(origin)[1]
+        closest_local_coords = tuple(self.path_array[idx].tolist())
 
         if one_point_only is False:
 
             # Catch situation where the closest point is at the end of the track
-            if idx == len(self.path) - 1:
+            if idx == len(self.path_array) - 1:
                 LOGGER.debug("Closest point is the last in the track, taking first instead")
 
                 if return_index:
                     return idx, 0
 
-                return closest_local_coords, self.path[0]
+                return closest_local_coords, self.start
 
             # Index isn't max, so return closest point, plus the next one
             if return_index:
                 return idx, idx + 1
 
-            return closest_local_coords, self.path[idx + 1]
+            return closest_local_coords, tuple(self.path_array[idx + 1].tolist())
 
         if return_index:
             return idx
-        return self.path[idx]
+        return tuple(self.path_array[idx].tolist())
@@ -0,0 +1,301 @@
+"""
+Batched version of the Flatlands environment
+
+`FlatlandsVecEnv` simulates many cars on one shared track with a single vectorized update per step, using the
+stateless kinematics of `flatlands_sim.kinematics` (or the dynamics of `flatlands_sim.dynamics`). Each car behaves like
+the vehicle of a `FlatlandsEnv`, but there are no per-car Python objects, so the cost of a step grows very slowly with
+the number of cars.
+"""
+
+import logging
+
+import numpy as np
+from gym import spaces
+
+from .flatlands_env import DEFAULT_MAP_FILE
+from .flatlands_sim.world import load_world
+from .flatlands_sim import dynamics
+from .flatlands_sim.kinematics import bicycle_step, X, Y, THETA, VELOCITY, STATE_SIZE, WHEEL_ANGLE
+from .flatlands_sim.noise import NoiseBuffer
+from .flatlands_sim.bounds import OFF_TRACK_MODES
+from ..viewer import StatePublisher
+
+LOGGER = logging.getLogger("flatlands_vec_env")
+
+
+class FlatlandsVecEnv(object):
+    """
+    Steps `num_envs` cars on the same track at once
+    """
+
+    def __init__(self,
+                 num_envs,
+                 seed=None,
+                 noise=0,
+                 num_points=5,
+                 lookahead_distances=None,
+                 local_map_shape=None,
+                 local_map_resolution=0.5,
+                 off_track=None,
+                 off_track_resolution=None,
+                 vehicle="kinematic",
+                 vehicle_params=None,
+                 viewer_address=None,
+                 viewer_env_ids=(0, ),
+                 world=None,
+                 wheelbase=2.6,
+                 track=1.2,
+                 max_wheel_angle=np.pi / 3,
+                 max_velocity=1,
+                 max_accel=0.1):
+        """
+        :param num_envs: number of cars to simulate
+        :param seed: seed for the random number generator [optional]
+        :param noise: percentage of random noise added to the actions, as in the vehicle models [optional]
+        :param num_points: number of upcoming track points in each observation [optional]
+        :param lookahead_distances: distances along the track (in meters) to observe the centerline at, instead
+            of the next `num_points` track points [optional]
+        :param local_map_shape: (H, W) of an ego-centric crop of the track raster to observe around every car, kept
+            in `local_maps`, see TrackRaster.ego_crops [optional]
+        :param local_map_resolution: side of a local map pixel, in meters [optional]
+        :param off_track: set a car's done flag when it leaves the track surface: "center" when its center does,
+            "any" as soon as any corner of its footprint does, "all" once every corner did. None never sets it.
+            [optional]
+        :param off_track_resolution: test the footprints against the track raster of this resolution (in meters, see
+            WorldMap.get_raster) instead of the exact track quads [optional]
+        :param vehicle: "kinematic" for the update of kinematics.bicycle_step, "dynamic" for the one of
+            dynamics.dynamic_step with tire slip [optional]
+        :param vehicle_params: keyword arguments of the vehicle update, overriding the vehicle parameters below: only
+            those for the kinematic vehicle, any of dynamics.dynamic_step (e.g. dt or mass) for the dynamic one
+            [optional]
+        :param viewer_address: (host, port) to publish the state of the `viewer_env_ids` cars to after every step,
+            for a `flatlands-viewer` to draw them from another process (see flatlands/viewer.py) [optional]
+        :param viewer_env_ids: indexes of the cars to publish, each under its index as env id [optional]
+        :param world: a WorldMap to drive on, the track installed with the package by default (see load_world)
+            [optional]
+        :param wheelbase, track, max_wheel_angle, max_velocity, max_accel: vehicle parameters, see BicycleModel.
+            The footprint is `wheelbase` long and `track` wide. [optional]
+        """
+
+        self.num_envs = num_envs
+        self.world = world if world is not None else load_world(DEFAULT_MAP_FILE)
+        self.num_points = num_points
+        self.lookahead_distances = None if lookahead_distances is None else np.asarray(lookahead_distances, float)
+        self.noise = noise
+
+        if off_track is not None and off_track not in OFF_TRACK_MODES:
+            raise ValueError("Unknown off track mode {}, expected one of {}".format(off_track, OFF_TRACK_MODES))
+        self.off_track = off_track
+        self.off_track_resolution = off_track_resolution
+        self.track = track
+
+        self.vehicle_params = {
+            "wheelbase": wheelbase,
+            "max_wheel_angle": max_wheel_angle % np.pi,
+            "max_velocity": max_velocity,
+            "max_accel": max_accel,
+        }
+
+        vehicle_params = dict(vehicle_params or {})
+
+        # Distance from the simulated position to the middle of the wheelbase, where the footprints are centered: the
+        # kinematic state is the rear axle, the dynamic one the center of gravity (see BicycleModel.footprint_offset)
+        if vehicle == "kinematic":
+            # bicycle_step has no other parameters, anything else would be silently ignored
+            unsupported = sorted(set(vehicle_params) - set(self.vehicle_params))
+            if unsupported:
+                raise ValueError("Unsupported vehicle_params {} for the kinematic vehicle, expected some of {}".format(
+                    unsupported, list(self.vehicle_params)))
+            self._step_function = bicycle_step
+            self.vehicle_params.update(vehicle_params)
+            state_size = STATE_SIZE
+            self.footprint_offset = self.vehicle_params["wheelbase"] / 2
+        elif vehicle == "dynamic":
+            self._step_function = dynamics.dynamic_step
+            self.vehicle_params.update(vehicle_params)
+            state_size = dynamics.STATE_SIZE
+            self.footprint_offset = (self.vehicle_params.get("cg_to_front", dynamics.CG_TO_FRONT) -
+                                     self.vehicle_params["wheelbase"] / 2)
+        else:
+            raise ValueError("Unknown vehicle model {}, expected 'kinematic' or 'dynamic'".format(vehicle))
+        self.vehicle = vehicle
+
+        self.noise_buffer = NoiseBuffer(seed)
+
+        # [x, y, theta, velocity] of every car, see kinematics.py, followed by [lateral velocity, yaw rate] for the
+        # dynamic model (see dynamics.py)
+        self.states = np.zeros((num_envs, state_size))
+        # The last applied (clipped) acceleration and wheel angle of every car
+        self.accelerations = np.zeros(num_envs)
+        self.wheel_angles = np.zeros(num_envs)
+        # Index of the track point nearest to every car
+        self.progress_index = np.zeros(num_envs, dtype=np.int64)
+
+        # Spaces of a single car, the batched arrays have a leading num_envs dimension
+        action_limits = np.array([self.vehicle_params["max_accel"], self.vehicle_params["max_wheel_angle"]],
+                                 dtype=np.float32)
+        self.action_space = spaces.Box(low=-action_limits, high=action_limits, dtype=np.float32)
+        observed_points = num_points if self.lookahead_distances is None else len(self.lookahead_distances)
+        self.observation_space = spaces.Box(low=-np.inf, high=np.inf, shape=(observed_points, 2), dtype=np.float32)
+
+        # Latest results of every car, updated in place by reset() and step()
+        self.observations = np.zeros((num_envs, ) + self.observation_space.shape, dtype=np.float32)
+        self.rewards = np.zeros(num_envs, dtype=np.float32)
+        self.dones = np.zeros(num_envs, dtype=bool)
+
+        # (num_envs, H, W) bird's-eye views of the track around every car, facing up: 1 on the track, 0 off it
+        self.local_map_shape = None if local_map_shape is None else tuple(local_map_shape)
+        self.local_map_resolution = local_map_resolution
+        self.local_maps = None
+        if self.local_map_shape is not None:
+            self.local_maps = np.zeros((num_envs, ) + self.local_map_shape, dtype=np.uint8)
+
+        self.publisher = None if viewer_address is None else StatePublisher(viewer_address)
+        self.viewer_env_ids = np.asarray(viewer_env_ids, dtype=np.intp).reshape(-1)
+
+    @property
+    def track_surface(self):
+        """
+        The track surface the off track tests run against: the world's TrackBounds, or its TrackRaster with
+        `off_track_resolution`
+        """
+
+        if self.off_track_resolution is not None:
+            return self.world.get_raster(self.off_track_resolution)
+        return self.world.track_bounds
+
+    def seed(self, seed=None):
+        """
+        Seeds the random number generator shared by all cars
+
+        Accepts: seed: an integer, or None to pick fresh entropy from the OS
+        Returns: a list holding the seed
+        """
+
+        self.noise_buffer.seed(seed)
+        return [seed]
+
+    def reset(self, env_ids=None):
+        """
+        Places cars at random points of the track, standing still and facing along the track
+
+        Accepts: env_ids: indexes of the cars to reset, all of them by default
+        Returns: the observations of all cars, an array of shape (num_envs, num_points, 2)
+        """
+
+        env_ids = self._as_ids(env_ids)
+        num_points = len(self.world.path_array)
+
+        idxs = np.minimum(self.noise_buffer.uniform_batch(0, num_points, len(env_ids)).astype(np.int64),
+                          num_points - 1)
+        LOGGER.debug("Placing %d cars at map points %s", len(env_ids), idxs)
+
+        self.states[env_ids, X] = self.world.path_array[idxs, 0]
+        self.states[env_ids, Y] = self.world.path_array[idxs, 1]
+        self.states[env_ids, THETA] = self.world.track_data["direction"][idxs] % (2 * np.pi)
+        self.states[env_ids, VELOCITY:] = 0
+        self.accelerations[env_ids] = 0
+        self.wheel_angles[env_ids] = 0
+        self.progress_index[env_ids] = idxs
+        self.dones[env_ids] = False
+
+        self._observe(env_ids)
+        return self.observations
+
+    def step(self, actions, env_ids=None):
+        """
+        Advances cars by one step, in one vectorized update
+
+        Accepts:
+            actions: array of shape (len(env_ids), 2) holding [accel, wheel_angle] for each stepped car
+            env_ids: indexes of the cars to step, all of them by default
+        Returns:
+            A 3-tuple of arrays for all cars: observations (num_envs, num_points, 2), rewards and dones.
+            The arrays are owned by the env and overwritten by the next call, rows of cars which were not
+            stepped are left untouched.
+        """
+
+        env_ids = self._as_ids(env_ids)
+        actions = np.asarray(actions, dtype=np.float64).reshape(len(env_ids), 2)
+
+        action_noise = None
+        if self.noise:
+            action_noise = self.noise_buffer.uniform_batch(-self.noise / 100, self.noise / 100, actions.shape)
+
+        previous_velocity = self.states[env_ids, VELOCITY]
+        self.states[env_ids] = self._step_function(
+            self.states[env_ids], actions, action_noise=action_noise, **self.vehicle_params)
+
+        # Keep the applied values around, like the vehicle models do
+        limit = self.vehicle_params["max_wheel_angle"]
+        self.wheel_angles[env_ids] = np.clip(actions[:, WHEEL_ANGLE], -limit, limit)
+        if action_noise is not None:
+            self.wheel_angles[env_ids] *= 1 + action_noise[:, WHEEL_ANGLE]
+        self.accelerations[env_ids] = self.states[env_ids, VELOCITY] - previous_velocity
+
+        self.progress_index[env_ids] = self.world.spatial_index.query(self.states[env_ids, X:Y + 1])[1]
+
+        if self.off_track is not None:
+            # Dones stay set until the car is reset
+            theta = self.states[env_ids, THETA]
+            forward = np.stack([np.sin(theta), np.cos(theta)], axis=-1)
+            centers = self.states[env_ids, X:Y + 1] + self.footprint_offset * forward
+            self.dones[env_ids] |= ~self.track_surface.footprint_inside(
+                centers,
+                theta,
+                self.vehicle_params["wheelbase"],
+                self.track,
+                mode=self.off_track)
+
+        self._observe(env_ids)
+        if self.publisher is not None:
+            self._publish(np.intersect1d(self.viewer_env_ids, env_ids))
+        return self.observations, self.rewards, self.dones
+
+    def _observe(self, env_ids):
+        """
+        Updates the observation rows (and local maps) of the given cars
+        """
+
+        if self.local_maps is not None:
+            self.local_maps[env_ids] = self.world.get_raster(self.local_map_resolution).ego_crops(
+                self.states[env_ids, X:Y + 1], self.states[env_ids, THETA], shape=self.local_map_shape)
+
+        if self.lookahead_distances is not None:
+            self.observations[env_ids] = self.world.get_lookahead_points(
+                self.states[env_ids, X:Y + 1], self.states[env_ids, THETA], self.lookahead_distances)
+            return
+
+        self.observations[env_ids] = self.world.get_upcoming_points_batch(
+            self.states[env_ids, X:Y + 1],
+            self.states[env_ids, THETA],
+            num_points=self.num_points,
+            nearest_point_idxs=self.progress_index[env_ids])
+
+    def _publish(self, env_ids):
+        """
+        Sends the state of the given cars to the viewer address, in the fields of BicycleModel.get_info_object()
+        """
+
+        for env_id in env_ids:
+            self.publisher.publish({
+                "car_position_x": self.states[env_id, X],
+                "car_position_y": self.states[env_id, Y],
+                "car_direction": self.states[env_id, THETA],
+                "steering_angle": self.wheel_angles[env_id],
+                "car_speed": self.states[env_id, VELOCITY],
+                "car_accel": self.accelerations[env_id],
+                "max_wheel_angle": self.vehicle_params["max_wheel_angle"],
+                "max_speed": self.vehicle_params["max_velocity"],
+                "max_accel": self.vehicle_params["max_accel"],
+                "wheelbase": self.vehicle_params["wheelbase"],
+            }, env_id=int(env_id))
+
+    def _as_ids(self, env_ids):
+        """
+        Normalizes env_ids into an index array
+        """
+
+        if env_ids is None:
+            return np.arange(self.num_envs)
+        return np.asarray(env_ids, dtype=np.intp).reshape(-1)
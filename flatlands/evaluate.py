@@ -0,0 +1,300 @@
+"""
+Evaluates a driving policy over many episodes in parallel
+
+Episodes are spread over a pool of worker processes, each holding one `FlatlandsEnv`. Every episode gets a fixed seed
+and start point, so two evaluations of the same policy with the same settings drive the exact same episodes no matter
+how many workers are used. Per-episode lap and sector times (from the env's lap timer), off-track events and speeds
+are gathered into one report.
+
+A policy is any picklable callable (for example a module-level function) mapping an observation to an action, as
+accepted by `FlatlandsEnv.step`. On the command line it's given as "module:attribute".
+
+Usage as follows:
+    report = evaluate(my_policy, num_episodes=64, num_workers=8, max_steps=5000)
+
+    flatlands-eval my_package.policies:drive --episodes 64 --workers 8 --output report.json
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import importlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+LOGGER = logging.getLogger("evaluate")
+
+# The env of the current worker process, and the policy it runs
+_WORKER = {}
+
+
+def follow_track_policy(obs):
+    """
+    Steers towards the 4th upcoming track point, as in demo_flatlands.py
+
+    Accepts: obs: an observation of FlatlandsEnv, as a dict or a flat array
+    Returns: a dict action
+    """
+
+    points = obs["dist_upcoming_points"] if isinstance(obs, dict) else obs
+    point = points[min(3, len(points) - 1)]
+
+    return {"accel": 0.5, "wheel_angle": float(np.arctan2(point[0], point[1]))}
+
+
+def load_policy(name):
+    """
+    Imports a policy given as "module:attribute"
+
+    Accepts: name: the module path and the attribute name, separated by a colon
+    Returns: the policy callable
+    """
+
+    module_name, _, attribute = name.partition(":")
+    if not attribute:
+        raise ValueError("Policies are given as 'module:attribute', got '{}'".format(name))
+
+    policy = importlib.import_module(module_name)
+    for part in attribute.split("."):
+        policy = getattr(policy, part)
+    return policy
+
+
+def evaluate(policy,
+             num_episodes=16,
+             max_steps=5000,
+             num_workers=None,
+             seed=0,
+             start_indices=None,
+             env_kwargs=None):
+    """
+    Runs a policy for a number of episodes and aggregates their statistics
+
+    Accepts:
+        policy: a callable mapping an observation to an action, picklable when num_workers > 1
+        num_episodes: number of episodes to run
+        max_steps: length of every episode, in steps. Episodes end earlier when the env is done, see the off_track
+            env argument.
+        num_workers: number of worker processes, one per CPU by default. With 1, episodes run in this process.
+        seed: episode i is seeded with seed + i
+        start_indices: track point index to start each episode at, spread evenly around the track by default
+        env_kwargs: keyword arguments for FlatlandsEnv (noise, num_points, flat_observations, ...)
+    Returns:
+        A report dict, holding the aggregated statistics and the list of per-episode results under "episodes"
+    """
+
+    env_kwargs = dict(env_kwargs or {})
+    if num_workers is None:
+        # Only the CPUs this process may run on, which can be fewer than the machine has
+        num_workers = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    num_workers = max(1, min(num_workers, num_episodes))
+
+    # Checked before any worker gets started
+    if start_indices is not None:
+        start_indices = [int(idx) for idx in start_indices]
+        if len(start_indices) != num_episodes:
+            raise ValueError("Got {} start indices for {} episodes".format(len(start_indices), num_episodes))
+
+    start_time = time.perf_counter()
+
+    if num_workers == 1:
+        _init_worker(policy, env_kwargs)
+        tasks = _episode_tasks(seed, start_indices, len(_WORKER["env"].world.path_array), num_episodes, max_steps)
+        LOGGER.info("Running %d episodes of %d steps on %d workers", num_episodes, max_steps, num_workers)
+        episodes = [_run_episode(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(num_workers, initializer=_init_worker, initargs=(policy, env_kwargs)) as executor:
+            num_track_points = executor.submit(_num_track_points).result()
+            tasks = _episode_tasks(seed, start_indices, num_track_points, num_episodes, max_steps)
+            LOGGER.info("Running %d episodes of %d steps on %d workers", num_episodes, max_steps, num_workers)
+            episodes = list(executor.map(_run_episode, *zip(*tasks)))
+
+    elapsed = time.perf_counter() - start_time
+    for episode_idx, episode in enumerate(episodes):
+        episode["episode"] = episode_idx
+
+    return _aggregate(episodes, elapsed, num_workers)
+
+
+def _episode_tasks(seed, start_indices, num_track_points, num_episodes, max_steps):
+    """
+    Builds the (seed, start index, max steps) arguments of every episode, spreading the start points evenly around
+    the track unless start_indices are given
+    """
+
+    if start_indices is None:
+        start_indices = np.linspace(0, num_track_points, num_episodes, endpoint=False).astype(int).tolist()
+    return [(seed + episode, start_indices[episode], max_steps) for episode in range(num_episodes)]
+
+
+def _init_worker(policy, env_kwargs):
+    """
+    Creates the env of a worker process
+    """
+
+    # Deferred so that the parent process of a pool doesn't need to load the track
+    from .envs import FlatlandsEnv
+
+    _WORKER["env"] = FlatlandsEnv(**env_kwargs)
+    _WORKER["policy"] = policy
+
+
+def _num_track_points():
+    return len(_WORKER["env"].world.path_array)
+
+
+def _run_episode(seed, start_index, max_steps):
+    """
+    Drives one episode in the env of the current worker
+
+    Accepts:
+        seed: seed of the env's random number generator
+        start_index: track point to start at
+        max_steps: maximum number of steps to run
+    Returns: a dict holding the statistics of the episode
+    """
+
+    env = _WORKER["env"]
+    policy = _WORKER["policy"]
+    centerline = env.world.centerline
+
+    env.seed(seed)
+    obs = env.reset(start_index=start_index)
+    start_progress = env.lap_timer.progress
+
+    lap_times = []
+    sector_times = []
+
+    off_track = False
+    off_track_events = 0
+    off_track_steps = 0
+    speed_sum = 0.0
+
+    steps = 0
+    start_time = time.perf_counter()
+    while steps < max_steps and not env.done:
+        obs = env.step(policy(obs))
+        steps += 1
+
+        if env.lap_timer.laps > len(lap_times):
+            lap_times.append(env.lap_timer.last_lap_time)
+            sector_times.append(env.lap_timer.last_sector_times)
+
+        s, offset, _ = centerline.to_frenet(env.vehicle_model.position)
+        half_width = np.interp(s, centerline.cumulative_length, centerline.widths) / 2
+        now_off_track = abs(float(offset)) > half_width
+        off_track_events += now_off_track and not off_track
+        off_track_steps += now_off_track
+        off_track = now_off_track
+
+        speed_sum += env.vehicle_model.velocity
+    elapsed = time.perf_counter() - start_time
+
+    return {
+        "seed": seed,
+        "start_index": start_index,
+        "steps": steps,
+        "done": env.done,
+        "distance": env.lap_timer.progress - start_progress,
+        "lap_times": lap_times,
+        "sector_times": sector_times,
+        "off_track_events": int(off_track_events),
+        "off_track_steps": int(off_track_steps),
+        "mean_speed": speed_sum / max(steps, 1),
+        "steps_per_sec": steps / elapsed,
+    }
+
+
+def _aggregate(episodes, elapsed, num_workers):
+    """
+    Builds the evaluation report out of the per-episode results
+    """
+
+    lap_times = [lap_time for episode in episodes for lap_time in episode["lap_times"]]
+    sector_times = [split_times for episode in episodes for split_times in episode["sector_times"]]
+    total_steps = sum(episode["steps"] for episode in episodes)
+
+    return {
+        "num_episodes": len(episodes),
+        "num_workers": num_workers,
+        "total_steps": total_steps,
+        "elapsed": elapsed,
+        "steps_per_sec": total_steps / elapsed,
+        "worker_steps_per_sec": float(np.mean([episode["steps_per_sec"] for episode in episodes])),
+        "num_done": sum(episode["done"] for episode in episodes),
+        "num_laps": len(lap_times),
+        "mean_lap_time": float(np.mean(lap_times)) if lap_times else None,
+        "best_lap_time": float(np.min(lap_times)) if lap_times else None,
+        "mean_sector_times": np.nanmean(sector_times, axis=0).tolist() if sector_times else None,
+        "off_track_events": sum(episode["off_track_events"] for episode in episodes),
+        "off_track_fraction": sum(episode["off_track_steps"] for episode in episodes) / total_steps,
+        "mean_speed": float(np.mean([episode["mean_speed"] for episode in episodes])),
+        "episodes": episodes,
+    }
+
+
+def main(argv=None):
+    """
+    Command line entry point, see `flatlands-eval --help`
+    """
+
+    parser = argparse.ArgumentParser(description="Evaluate a driving policy on Flatlands over many episodes")
+    parser.add_argument(
+        "policy",
+        nargs="?",
+        default="flatlands.evaluate:follow_track_policy",
+        help="the policy to evaluate, as module:attribute (default: %(default)s)")
+    parser.add_argument("--episodes", type=int, default=16, help="number of episodes")
+    parser.add_argument("--max-steps", type=int, default=5000, help="length of every episode, in steps")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: one per CPU)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first episode, the others follow")
+    parser.add_argument(
+        "--start-indices", type=int, nargs="+", default=None, help="track point to start each episode at")
+    parser.add_argument("--noise", type=float, default=0, help="action noise percentage")
+    parser.add_argument("--num-points", type=int, default=5, help="number of upcoming points in each observation")
+    parser.add_argument("--flat", action="store_true", help="pass observations as float32 arrays instead of dicts")
+    parser.add_argument("--lookahead", type=float, nargs="+", default=None, help="lookahead distances, in meters")
+    parser.add_argument("--sectors", type=float, nargs="+", default=(), help="sector start arc lengths, in meters")
+    parser.add_argument(
+        "--off-track",
+        choices=("center", "any", "all"),
+        default=None,
+        help="end episodes when the car's center, any or all of its corners leave the track")
+    parser.add_argument("--output", default=None, help="write the full report to this JSON file")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+
+    env_kwargs = {
+        "noise": args.noise,
+        "num_points": args.num_points,
+        "flat_observations": args.flat,
+        "lookahead_distances": args.lookahead,
+        "sectors": args.sectors,
+        "off_track": args.off_track,
+    }
+    report = evaluate(
+        load_policy(args.policy),
+        num_episodes=args.episodes,
+        max_steps=args.max_steps,
+        num_workers=args.workers,
+        seed=args.seed,
+        start_indices=args.start_indices,
+        env_kwargs=env_kwargs)
+
+    for key, value in report.items():
+        if key != "episodes":
+            print("{:>22}: {}".format(key, value))
+
+    if args.output is not None:
+        with open(args.output, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+        LOGGER.info("Wrote the report to %s", args.output)
+
+
+if __name__ == "__main__":
+    main()
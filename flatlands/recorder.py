@@ -0,0 +1,391 @@
+"""
+Columnar, memory-mapped trajectory storage
+
+`TrajectoryRecorder` appends per-step vehicle state, action, observation, reward and done flags into preallocated
+`.npy` files which are memory-mapped, so recording never grows Python lists and the OS takes care of paging data out.
+Steps are written into fixed-size chunks. When a chunk is full, recording rolls over into the next one; with
+`max_chunks` set the oldest chunk is overwritten instead, which turns the store into a ring buffer.
+
+A `manifest.json` next to the chunks describes the columns and which chunk holds which steps. `TrajectoryReader`
+uses it to map the same files read-only, so a learner can read (and sample from) the data without copying it.
+
+Usage as follows:
+    recorder = TrajectoryRecorder.for_env(env, "runs/episode_data", chunk_size=100000)
+    recorder.append(env.vehicle_model.get_state(), action, obs["dist_upcoming_points"], obs["reward"])
+    recorder.close()
+
+    reader = TrajectoryReader("runs/episode_data")
+    batch = reader.sample(indices)
+    row = reader.step(3000000)
+"""
+
+import os
+import json
+import logging
+from collections import OrderedDict
+
+import numpy as np
+
+LOGGER = logging.getLogger("recorder")
+
+MANIFEST_NAME = "manifest.json"
+
+# dtypes of the recorded columns. The state keeps double precision since it holds absolute coordinates.
+COLUMN_DTYPES = {
+    "state": np.float64,
+    "action": np.float32,
+    "observation": np.float32,
+    "reward": np.float32,
+    "done": np.bool_,
+}
+
+
+class TrajectoryRecorder(object):
+    """
+    Appends steps into memory-mapped columnar chunks
+    """
+
+    def __init__(self,
+                 directory,
+                 state_shape,
+                 action_shape,
+                 observation_shape,
+                 chunk_size=2**16,
+                 max_chunks=None,
+                 metadata=None):
+        """
+        :param directory:           where to write the chunks and the manifest (created if needed)
+        :param state_shape:         shape of one vehicle state, e.g. (BicycleModel.STATE_SIZE,)
+        :param action_shape:        shape of one action, e.g. (2,)
+        :param observation_shape:   shape of one observation
+        :param chunk_size:          number of steps per chunk file
+        :param max_chunks:          keep at most this many chunks, overwriting the oldest ones (ring buffer).
+                                    None keeps rolling over into new chunks forever.
+        :param metadata:            JSON-serializable dict stored in the manifest, e.g. the vehicle parameters
+        """
+
+        if max_chunks is not None and max_chunks < 1:
+            raise ValueError("max_chunks must be at least 1, got {}".format(max_chunks))
+
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.max_chunks = max_chunks
+        self.metadata = dict(metadata or {})
+        self.shapes = {
+            "state": _as_shape(state_shape),
+            "action": _as_shape(action_shape),
+            "observation": _as_shape(observation_shape),
+            "reward": (),
+            "done": (),
+        }
+
+        # Manifest entries of the chunks on disk, oldest first
+        self.chunks = []
+        self.total_steps = 0
+
+        # Memory maps of the chunk currently written to, and the row to write next
+        self._columns = None
+        self._row = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def for_env(cls, env, directory, num_points=5, **kwargs):
+        """
+        Creates a recorder with the column shapes of a FlatlandsEnv
+
+        Accepts:
+            env: the FlatlandsEnv to record
+            directory: where to store the data
+            num_points: number of upcoming points in each observation
+            kwargs: passed on to the constructor
+        Returns: a TrajectoryRecorder
+        """
+
+        # What a replay needs to draw the car, the state only holds what changes
+        vehicle_model = env.vehicle_model
+        metadata = {
+            "car_model": type(vehicle_model).__name__,
+            "wheelbase": getattr(vehicle_model, "wheelbase", None),
+            "max_wheel_angle": getattr(vehicle_model, "max_wheel_angle", None),
+            "max_speed": vehicle_model.max_velocity,
+            "max_accel": vehicle_model.max_accel,
+        }
+        metadata.update(kwargs.pop("metadata", None) or {})
+
+        return cls(directory, (vehicle_model.STATE_SIZE, ), (2, ), (num_points, 2), metadata=metadata, **kwargs)
+
+    def append(self, state, action, observation, reward, done=False):
+        """
+        Writes one step
+
+        Accepts:
+            state: the vehicle state (see IVehicleModel.get_state)
+            action: an action dict with "accel" and "wheel_angle", or an array-like in that order
+            observation: an array-like of observation_shape, for example obs["dist_upcoming_points"]
+            reward: the step reward
+            done: whether the episode ended with this step
+        Returns: the global index of the step
+        """
+
+        if self._columns is None or self._row == self.chunk_size:
+            self._next_chunk()
+
+        if isinstance(action, dict):
+            action = (action["accel"], action["wheel_angle"])
+
+        row = self._row
+        self._columns["state"][row] = state
+        self._columns["action"][row] = action
+        self._columns["observation"][row] = observation
+        self._columns["reward"][row] = reward
+        self._columns["done"][row] = done
+
+        self._row += 1
+        self.chunks[-1]["count"] = self._row
+        self.total_steps += 1
+
+        return self.total_steps - 1
+
+    def flush(self):
+        """
+        Flushes the current chunk to disk and updates the manifest, so that readers can see every step so far
+        """
+
+        if self._columns is not None:
+            for column in self._columns.values():
+                column.flush()
+        self._write_manifest()
+
+    def close(self):
+        """
+        Flushes and releases the memory maps
+        """
+
+        self.flush()
+        self._columns = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _next_chunk(self):
+        """
+        Rolls over into a new chunk, reusing the files of the oldest one when the ring is full
+        """
+
+        if self._columns is not None:
+            for column in self._columns.values():
+                column.flush()
+
+        if self.max_chunks is not None and len(self.chunks) == self.max_chunks:
+            oldest = self.chunks.pop(0)
+            slot = oldest["slot"]
+            mode = "r+"
+            LOGGER.debug("Ring buffer full, overwriting chunk slot %d (steps %d+)", slot, oldest["start_step"])
+        else:
+            slot = len(self.chunks)
+            mode = "w+"
+
+        self.chunks.append({"slot": slot, "start_step": self.total_steps, "count": 0})
+        self._columns = {
+            name: _open_column(self.directory, slot, name, mode, self.chunk_size, self.shapes[name])
+            for name in COLUMN_DTYPES
+        }
+        self._row = 0
+
+        self._write_manifest()
+
+    def _write_manifest(self):
+        """
+        Atomically replaces the manifest with the current chunk list
+        """
+
+        manifest = {
+            "chunk_size": self.chunk_size,
+            "max_chunks": self.max_chunks,
+            "total_steps": self.total_steps,
+            "columns": {name: list(shape)
+                        for name, shape in self.shapes.items()},
+            "chunks": self.chunks,
+            "metadata": self.metadata,
+        }
+
+        manifest_path = os.path.join(self.directory, MANIFEST_NAME)
+        with open(manifest_path + ".tmp", "w") as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+
+class TrajectoryReader(object):
+    """
+    Read-only, zero-copy access to the data of a TrajectoryRecorder
+
+    Column files are mapped when first read. At most `max_open_chunks` chunks stay mapped, the least recently read
+    ones are released, so that streaming through a long recording doesn't accumulate maps.
+    """
+
+    def __init__(self, directory, max_open_chunks=16):
+        """
+        :param directory:       a directory written by TrajectoryRecorder
+        :param max_open_chunks: number of chunks to keep mapped
+        """
+
+        self.directory = directory
+        self.max_open_chunks = max(1, max_open_chunks)
+        self.manifest = None
+        self.chunks = None
+        # Slot -> {column name -> memmap}, least recently used first
+        self._columns = OrderedDict()
+        self._chunk_starts = None
+
+        self.refresh()
+
+    def refresh(self):
+        """
+        Re-reads the manifest, to pick up the steps written since the reader was opened
+        """
+
+        with open(os.path.join(self.directory, MANIFEST_NAME)) as manifest_file:
+            self.manifest = json.load(manifest_file)
+
+        self.chunks = [chunk for chunk in self.manifest["chunks"] if chunk["count"] > 0]
+        self._chunk_starts = np.array([chunk["start_step"] for chunk in self.chunks], dtype=np.int64)
+        # A ring buffer may have reused the files of a mapped slot since
+        self._columns.clear()
+
+    @property
+    def metadata(self):
+        """
+        The metadata dict the recorder was given, empty for recordings without any
+        """
+
+        return self.manifest.get("metadata") or {}
+
+    @property
+    def first_step(self):
+        """
+        Global index of the oldest step still stored (non-zero once a ring buffer wrapped around)
+        """
+
+        return int(self._chunk_starts[0]) if self.chunks else 0
+
+    @property
+    def last_step(self):
+        """
+        Global index one past the newest stored step
+        """
+
+        if not self.chunks:
+            return 0
+        return self.chunks[-1]["start_step"] + self.chunks[-1]["count"]
+
+    def __len__(self):
+        return sum(chunk["count"] for chunk in self.chunks)
+
+    def column(self, name, chunk_idx):
+        """
+        Gets the valid rows of one column of one chunk, as a read-only memory map
+
+        Accepts:
+            name: the column name (state, action, observation, reward or done)
+            chunk_idx: index into self.chunks
+        Returns: a numpy memmap, without copying any data
+        """
+
+        chunk = self.chunks[chunk_idx]
+        slot = chunk["slot"]
+        if slot in self._columns:
+            self._columns.move_to_end(slot)
+        else:
+            self._columns[slot] = {}
+            if len(self._columns) > self.max_open_chunks:
+                self._columns.popitem(last=False)
+
+        columns = self._columns[slot]
+        if name not in columns:
+            columns[name] = np.load(_column_path(self.directory, slot, name), mmap_mode="r")
+
+        return columns[name][:chunk["count"]]
+
+    def locate(self, step):
+        """
+        Finds the chunk and row holding a step, in constant time: every chunk but the newest is full, and they hold
+        consecutive steps
+
+        Accepts: step: a global step index in [first_step, last_step)
+        Returns: a 2-tuple of the index into self.chunks and the row within the chunk
+        """
+
+        step = int(step)
+        if step < self.first_step or step >= self.last_step:
+            raise IndexError("Step index must lie in [{}, {}), got {}".format(self.first_step, self.last_step, step))
+
+        chunk_idx, row = divmod(step - self.first_step, self.manifest["chunk_size"])
+        return chunk_idx, row
+
+    def step(self, step):
+        """
+        Reads a single step, touching only the pages holding its rows
+
+        Accepts: step: a global step index in [first_step, last_step)
+        Returns: a dict mapping each column name to the row of the step
+        """
+
+        chunk_idx, row = self.locate(step)
+        return {name: self.column(name, chunk_idx)[row] for name in COLUMN_DTYPES}
+
+    def iter_chunks(self):
+        """
+        Yields a dict of columns for every stored chunk, oldest first
+        """
+
+        for chunk_idx in range(len(self.chunks)):
+            yield {name: self.column(name, chunk_idx) for name in COLUMN_DTYPES}
+
+    def sample(self, indices):
+        """
+        Gathers the rows at the given global step indices
+
+        Accepts: indices: an array of global step indices in [first_step, last_step)
+        Returns: a dict mapping each column name to an array with one row per index
+        """
+
+        indices = np.asarray(indices, dtype=np.int64)
+        if indices.size and (indices.min() < self.first_step or indices.max() >= self.last_step):
+            raise IndexError("Step indices must lie in [{}, {})".format(self.first_step, self.last_step))
+
+        chunk_of, rows = np.divmod(indices - self.first_step, self.manifest["chunk_size"])
+
+        batch = {
+            name: np.empty(indices.shape + tuple(shape), dtype=COLUMN_DTYPES[name])
+            for name, shape in self.manifest["columns"].items()
+        }
+        for chunk_idx in np.unique(chunk_of):
+            mask = chunk_of == chunk_idx
+            for name in COLUMN_DTYPES:
+                batch[name][mask] = self.column(name, chunk_idx)[rows[mask]]
+
+        return batch
+
+
+def _as_shape(shape):
+    """Normalizes an int or a sequence of ints into a tuple of Python ints."""
+    return tuple(int(size) for size in np.atleast_1d(shape))
+
+
+def _column_path(directory, slot, name):
+    """Path of the file holding one column of one chunk slot."""
+    return os.path.join(directory, "chunk_{:05d}".format(slot), name + ".npy")
+
+
+def _open_column(directory, slot, name, mode, chunk_size, shape):
+    """Creates (w+) or reopens (r+) the memory-mapped file of one column."""
+    column_path = _column_path(directory, slot, name)
+    if mode == "r+":
+        return np.load(column_path, mmap_mode="r+")
+
+    os.makedirs(os.path.dirname(column_path), exist_ok=True)
+    return np.lib.format.open_memmap(column_path, mode="w+", dtype=COLUMN_DTYPES[name], shape=(chunk_size, ) + shape)
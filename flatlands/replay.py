@@ -0,0 +1,228 @@
+"""
+Plays back recorded trajectories
+
+`TrajectoryPlayer` draws the steps of a `TrajectoryRecorder` recording with `DrawMap`, at any playback speed (also
+fractional or backwards) and from any step. Every recorded row holds the complete vehicle state, so each step is a
+keyframe: seeking finds the chunk and row of a step arithmetically (see TrajectoryReader.locate) and reads that row
+only. Chunks are memory-mapped as playback reaches them, so a recording of millions of steps starts instantly and
+only the pages around the current step are ever read.
+
+Keys while playing:
+    space           pause / resume
+    left, right     step backwards / forwards by one step (with shift: by 1000 steps)
+    up, down        double / halve the playback speed
+    r               reverse the playback direction
+
+Usage as follows:
+    flatlands-replay runs/episode_data --start 3000000 --speed 0.25
+
+    player = TrajectoryPlayer(TrajectoryReader("runs/episode_data"))
+    player.play(start=3000000, speed=0.25)
+"""
+
+import sys
+import time
+import logging
+import argparse
+from math import pi
+
+from .recorder import TrajectoryReader
+
+LOGGER = logging.getLogger("replay")
+
+# Columns of the recorded vehicle states (see IVehicleModel.get_state), the wheel angle is missing for point models
+STATE_X, STATE_Y, STATE_THETA, STATE_VELOCITY, STATE_ACCEL = range(5)
+STATE_WHEEL_ANGLE = 6
+
+# Vehicle parameters assumed for recordings which don't store theirs
+DEFAULT_METADATA = {
+    "car_model": "BicycleModel",
+    "wheelbase": 2.6,
+    "max_wheel_angle": pi / 3,
+    "max_speed": 1.0,
+    "max_accel": 0.1,
+}
+
+# Steps skipped by the arrow keys with and without shift
+SEEK_STEPS = (1, 1000)
+
+
+class TrajectoryPlayer(object):
+    """
+    Draws the steps of a recording, seeking in constant time
+    """
+
+    def __init__(self, reader, world=None, steps_per_second=10.0):
+        """
+        :param reader:              a TrajectoryReader of the recording
+        :param world:               the WorldMap the recording was made on, the track installed with the package by
+                                    default
+        :param steps_per_second:    playback rate at speed 1
+        """
+
+        self.reader = reader
+        self.world = world
+        self.steps_per_second = steps_per_second
+        self.metadata = dict(DEFAULT_METADATA, **{
+            key: value
+            for key, value in reader.metadata.items() if value is not None
+        })
+
+        # The renderer (and pygame) is only loaded by the first draw
+        self.draw_map = None
+
+    def info_object(self, step):
+        """
+        Builds the info object of a recorded step, as the vehicle model's get_info_object() returned it
+
+        Accepts: step: a global step index, see TrajectoryReader.locate
+        Returns: a dict of the fields DrawMap.draw_car() needs, along with the step's reward and done flag
+        """
+
+        row = self.reader.step(step)
+        state = row["state"]
+
+        info_object = dict(self.metadata)
+        info_object.update({
+            "object_type": "car",
+            "step": int(step),
+            "car_position_x": float(state[STATE_X]),
+            "car_position_y": float(state[STATE_Y]),
+            "car_direction": float(state[STATE_THETA]),
+            "car_speed": float(state[STATE_VELOCITY]),
+            "car_accel": float(state[STATE_ACCEL]),
+            "reward": float(row["reward"]),
+            "done": bool(row["done"]),
+        })
+        if len(state) > STATE_WHEEL_ANGLE:
+            info_object["steering_angle"] = float(state[STATE_WHEEL_ANGLE])
+
+        return info_object
+
+    def draw(self, step):
+        """
+        Draws a recorded step
+
+        Accepts: step: a global step index
+        Returns: Nothing
+        """
+
+        if self.draw_map is None:
+            from .envs.flatlands_env import DEFAULT_MAP_FILE
+            from .envs.flatlands_sim.world import load_world
+            from .envs.flatlands_sim.draw import DrawMap
+
+            self.draw_map = DrawMap(self.world if self.world is not None else load_world(DEFAULT_MAP_FILE))
+            self.draw_map.draw()
+
+        self.draw_map.draw_car(self.info_object(step))
+
+    def play(self, start=None, stop=None, speed=1.0, max_fps=60):
+        """
+        Plays back steps in real time until the window is closed, or the end of the range is reached
+
+        The current step follows the wall clock: at speed 1 it advances by steps_per_second every second, frames only
+        draw the step current at the time, so that any speed plays in real time.
+
+        Accepts:
+            start: the step to start at, the oldest stored one by default
+            stop: the step to stop before, one past the newest stored one by default
+            speed: multiple of steps_per_second, negative to play backwards
+            max_fps: upper bound of the number of frames drawn per second
+        Returns: the last step drawn
+        """
+
+        import pygame
+
+        first = self.reader.first_step
+        stop = self.reader.last_step if stop is None else min(stop, self.reader.last_step)
+        start = first if start is None else start
+        if not first <= start < stop:
+            raise IndexError("Start step must lie in [{}, {}), got {}".format(first, stop, start))
+
+        # The playback position is a float, so that slow speeds advance by fractions of a step per frame
+        position = float(start)
+        paused = False
+        drawn = None
+        frame_time = 1.0 / max_fps
+        last_time = time.perf_counter()
+        while True:
+            now = time.perf_counter()
+            if not paused:
+                position += (now - last_time) * self.steps_per_second * speed
+            last_time = now
+
+            for event in pygame.event.get() if self.draw_map is not None else ():
+                if event.type == pygame.QUIT:
+                    self.draw_map.shutdown()
+                    return drawn
+                if event.type != pygame.KEYDOWN:
+                    continue
+
+                seek = SEEK_STEPS[bool(event.mod & pygame.KMOD_SHIFT)]
+                if event.key == pygame.K_SPACE:
+                    paused = not paused
+                elif event.key == pygame.K_RIGHT:
+                    position = float(int(position) + seek)
+                elif event.key == pygame.K_LEFT:
+                    position = float(int(position) - seek)
+                elif event.key == pygame.K_UP:
+                    speed *= 2
+                elif event.key == pygame.K_DOWN:
+                    speed /= 2
+                elif event.key == pygame.K_r:
+                    speed = -speed
+                LOGGER.info("Step %d, speed %g%s", int(position), speed, " (paused)" if paused else "")
+
+            # Past either end playback stops on the end step, while paused seeking out of range only clamps
+            finished = not paused and (position >= stop or position < first)
+            position = min(max(position, first), stop - 1)
+
+            step = int(position)
+            if step != drawn:
+                self.draw(step)
+                drawn = step
+            if finished:
+                return drawn
+
+            time.sleep(max(0.0, frame_time - (time.perf_counter() - now)))
+
+
+def main(argv=None):
+    """
+    Command line entry point, see `flatlands-replay --help`
+    """
+
+    parser = argparse.ArgumentParser(description="Play back a recording of flatlands.recorder")
+    parser.add_argument("directory", help="directory of the recording")
+    parser.add_argument("--start", type=int, default=None, help="step to start at (default: the oldest stored one)")
+    parser.add_argument("--stop", type=int, default=None, help="step to stop before (default: the end)")
+    parser.add_argument("--speed", type=float, default=1.0, help="playback speed, negative to play backwards")
+    parser.add_argument("--steps-per-second", type=float, default=10.0, help="steps played per second at speed 1")
+    parser.add_argument("--track", default=None, help="track file (default: the one installed with the package)")
+    parser.add_argument("--max-fps", type=float, default=60, help="maximum number of frames per second")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+
+    world = None
+    if args.track is not None:
+        from .envs.flatlands_sim.world import load_world
+        world = load_world(args.track)
+
+    reader = TrajectoryReader(args.directory)
+    LOGGER.info("Recording holds steps %d to %d", reader.first_step, reader.last_step - 1)
+
+    player = TrajectoryPlayer(reader, world=world, steps_per_second=args.steps_per_second)
+    start = args.start
+    if start is None and args.speed < 0:
+        start = reader.last_step - 1
+    try:
+        last_step = player.play(start=start, stop=args.stop, speed=args.speed, max_fps=args.max_fps)
+        LOGGER.info("Stopped at step %d", last_step)
+    except KeyboardInterrupt:
+        LOGGER.info("Replay stopped")
+
+
+if __name__ == "__main__":
+    main()
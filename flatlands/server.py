@@ -0,0 +1,304 @@
+"""
+Serves a pool of Flatlands cars over a local socket
+
+Clients (in any language) connect over TCP or a Unix domain socket, get a car of a shared `FlatlandsVecEnv`
+assigned, and drive it with a small fixed-size binary protocol. Step requests arriving from different clients within
+`max_delay` of each other are coalesced into one batched simulator update.
+
+Protocol (all little-endian):
+    On connect, the server sends a handshake:
+        magic (4 bytes, b"FLAT"), version (uint8), status (uint8, 0 = ok, 1 = no free car),
+        num_points (uint16), env_id (uint32)
+    then the client sends requests of 9 bytes:
+        opcode (uint8: 1 = step, 2 = reset, 3 = close), accel (float32), wheel_angle (float32)
+    and receives a response for each step or reset:
+        status (uint8, 0 = ok), reward (float32), done (uint8),
+        followed by the observation as num_points * 2 float32 (x-y distances to the upcoming or lookahead points)
+
+Usage as follows:
+    flatlands-server --num-envs 64 --port 5555
+
+    client = EnvClient(("localhost", 5555))
+    obs = client.reset()
+    obs, reward, done = client.step((0.5, 0.0))
+"""
+
+import sys
+import socket
+import struct
+import asyncio
+import logging
+import argparse
+
+import numpy as np
+
+LOGGER = logging.getLogger("flatlands_server")
+
+MAGIC = b"FLAT"
+PROTOCOL_VERSION = 1
+
+OP_STEP = 1
+OP_RESET = 2
+OP_CLOSE = 3
+
+STATUS_OK = 0
+STATUS_FULL = 1
+STATUS_BAD_REQUEST = 2
+
+HANDSHAKE = struct.Struct("<4sBBHI")
+REQUEST = struct.Struct("<Bff")
+RESPONSE_HEADER = struct.Struct("<BfB")
+
+
+class EnvServer(object):
+    """
+    Hosts the cars of a FlatlandsVecEnv, one per connected client, and batches their step requests
+    """
+
+    def __init__(self, vec_env, max_delay=0.002):
+        """
+        :param vec_env: the FlatlandsVecEnv holding the cars to serve
+        :param max_delay: how long (in seconds) to wait for more clients' step requests before stepping a batch
+        """
+
+        self.vec_env = vec_env
+        self.max_delay = max_delay
+
+        self._free_ids = list(range(vec_env.num_envs - 1, -1, -1))
+        self._connected = set()
+
+        # env_id -> (action, future) of the step requests waiting for the next batch
+        self._pending = {}
+        self._wakeup = None
+        self._all_waiting = None
+
+        # Size of an observation on the wire
+        self._observation_size = int(np.prod(vec_env.observation_space.shape))
+
+    async def serve(self, host="127.0.0.1", port=5555, unix_path=None):
+        """
+        Accepts clients until cancelled
+
+        Accepts:
+            host, port: TCP address to listen on (ignored when unix_path is given)
+            unix_path: path of a Unix domain socket to listen on instead of TCP
+        Returns: Nothing
+        """
+
+        self._wakeup = asyncio.Event()
+        self._all_waiting = asyncio.Event()
+
+        if unix_path is not None:
+            server = await asyncio.start_unix_server(self._handle_client, path=unix_path)
+            LOGGER.info("Serving %d cars on %s", self.vec_env.num_envs, unix_path)
+        else:
+            server = await asyncio.start_server(self._handle_client, host=host, port=port)
+            LOGGER.info("Serving %d cars on %s:%d", self.vec_env.num_envs, host, port)
+
+        batcher = asyncio.ensure_future(self._batch_loop())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+    async def _handle_client(self, reader, writer):
+        """
+        Runs the request loop of one client
+        """
+
+        num_points = self.vec_env.observation_space.shape[0]
+        if not self._free_ids:
+            LOGGER.warning("Refusing client, all %d cars are in use", self.vec_env.num_envs)
+            writer.write(HANDSHAKE.pack(MAGIC, PROTOCOL_VERSION, STATUS_FULL, num_points, 0))
+            await writer.drain()
+            writer.close()
+            return
+
+        env_id = self._free_ids.pop()
+        self._connected.add(env_id)
+        self.vec_env.reset([env_id])
+        LOGGER.debug("Client connected, assigned car #%d", env_id)
+
+        writer.write(HANDSHAKE.pack(MAGIC, PROTOCOL_VERSION, STATUS_OK, num_points, env_id))
+        try:
+            await writer.drain()
+            while True:
+                opcode, accel, wheel_angle = REQUEST.unpack(await reader.readexactly(REQUEST.size))
+
+                if opcode == OP_STEP:
+                    future = asyncio.get_running_loop().create_future()
+                    self._pending[env_id] = ((accel, wheel_angle), future)
+                    self._signal()
+                    response = await future
+                elif opcode == OP_RESET:
+                    self.vec_env.reset([env_id])
+                    response = self._response(env_id)
+                elif opcode == OP_CLOSE:
+                    break
+                else:
+                    LOGGER.warning("Unknown opcode %d from car #%d", opcode, env_id)
+                    response = RESPONSE_HEADER.pack(STATUS_BAD_REQUEST, 0, 0) + bytes(4 * self._observation_size)
+
+                writer.write(response)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            LOGGER.debug("Client of car #%d disconnected", env_id)
+        finally:
+            self._pending.pop(env_id, None)
+            self._connected.discard(env_id)
+            self._free_ids.append(env_id)
+            # The remaining clients may all be waiting now
+            self._signal()
+            writer.close()
+
+    def _signal(self):
+        """
+        Wakes up the batching loop, and lets it step right away once every connected client is waiting
+        """
+
+        if self._pending:
+            self._wakeup.set()
+        if len(self._pending) >= len(self._connected):
+            self._all_waiting.set()
+
+    async def _batch_loop(self):
+        """
+        Steps the pending requests in batches
+        """
+
+        while True:
+            await self._wakeup.wait()
+
+            # Give the other clients a chance to join this batch
+            if len(self._pending) < len(self._connected):
+                try:
+                    await asyncio.wait_for(self._all_waiting.wait(), self.max_delay)
+                except asyncio.TimeoutError:
+                    pass
+
+            pending, self._pending = self._pending, {}
+            self._wakeup.clear()
+            self._all_waiting.clear()
+            if not pending:
+                continue
+
+            env_ids = np.fromiter(pending.keys(), dtype=np.intp, count=len(pending))
+            actions = np.array([action for action, _ in pending.values()], dtype=np.float64)
+            self.vec_env.step(actions, env_ids)
+
+            for env_id, (_, future) in pending.items():
+                if not future.done():
+                    future.set_result(self._response(env_id))
+
+    def _response(self, env_id):
+        """
+        Serializes the latest observation, reward and done flag of a car
+        """
+
+        header = RESPONSE_HEADER.pack(STATUS_OK, float(self.vec_env.rewards[env_id]), int(self.vec_env.dones[env_id]))
+        return header + self.vec_env.observations[env_id].astype("<f4", copy=False).tobytes()
+
+
+class EnvClient(object):
+    """
+    Minimal blocking client for EnvServer, also serves as a reference for implementing the protocol elsewhere
+    """
+
+    def __init__(self, address):
+        """
+        :param address: a (host, port) tuple for TCP, or the path of a Unix domain socket
+        """
+
+        if isinstance(address, str):
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._socket.connect(address)
+
+        magic, version, status, self.num_points, self.env_id = HANDSHAKE.unpack(self._receive(HANDSHAKE.size))
+        if magic != MAGIC or version != PROTOCOL_VERSION:
+            raise ConnectionError("Not a Flatlands server (magic {}, version {})".format(magic, version))
+        if status != STATUS_OK:
+            self._socket.close()
+            raise ConnectionError("The server has no free car")
+
+        self._observation_bytes = 4 * 2 * self.num_points
+
+    def reset(self):
+        """
+        Places the car at a random point of the track
+
+        Accepts: Nothing
+        Returns: the observation, a float32 array of shape (num_points, 2)
+        """
+
+        return self._request(OP_RESET, 0, 0)[0]
+
+    def step(self, action):
+        """
+        Steps the car
+
+        Accepts: action: [accel, wheel_angle]
+        Returns: a 3-tuple of the observation, the reward and the done flag
+        """
+
+        return self._request(OP_STEP, action[0], action[1])
+
+    def close(self):
+        """
+        Releases the car and closes the connection
+        """
+
+        self._socket.sendall(REQUEST.pack(OP_CLOSE, 0, 0))
+        self._socket.close()
+
+    def _request(self, opcode, accel, wheel_angle):
+        self._socket.sendall(REQUEST.pack(opcode, accel, wheel_angle))
+        status, reward, done = RESPONSE_HEADER.unpack(self._receive(RESPONSE_HEADER.size))
+        if status != STATUS_OK:
+            raise ValueError("Request rejected by the server with status {}".format(status))
+        observation = np.frombuffer(self._receive(self._observation_bytes), dtype="<f4").reshape(self.num_points, 2)
+        return observation, reward, bool(done)
+
+    def _receive(self, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = self._socket.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("Connection closed by the server")
+            data.extend(chunk)
+        return bytes(data)
+
+
+def main(argv=None):
+    """
+    Command line entry point, see `flatlands-server --help`
+    """
+
+    parser = argparse.ArgumentParser(description="Serve a pool of Flatlands cars over a local socket")
+    parser.add_argument("--num-envs", type=int, default=16, help="number of cars in the pool")
+    parser.add_argument("--host", default="127.0.0.1", help="TCP address to listen on")
+    parser.add_argument("--port", type=int, default=5555, help="TCP port to listen on")
+    parser.add_argument("--unix", default=None, help="listen on this Unix domain socket instead of TCP")
+    parser.add_argument("--max-delay-ms", type=float, default=2, help="how long to wait to batch step requests")
+    parser.add_argument("--seed", type=int, default=None, help="seed for the random number generator")
+    parser.add_argument("--noise", type=float, default=0, help="action noise percentage")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+
+    # Deferred so that `--help` doesn't load the track
+    from .envs import FlatlandsVecEnv
+
+    vec_env = FlatlandsVecEnv(args.num_envs, seed=args.seed, noise=args.noise)
+    server = EnvServer(vec_env, max_delay=args.max_delay_ms / 1000)
+    try:
+        asyncio.run(server.serve(host=args.host, port=args.port, unix_path=args.unix))
+    except KeyboardInterrupt:
+        LOGGER.info("Server stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Watches running envs from another process
+
+An env given a `viewer_address` publishes the state of its car after every step as one small UDP datagram (the
+`get_info_object()` fields packed as float32). Nothing waits for an answer and nothing fails when no one listens, so
+a training job pays a few microseconds per step and never loads pygame. `flatlands-viewer` listens on that address
+and draws the latest state it received with `DrawMap`; it can be started and stopped at any time.
+
+Datagram layout (little-endian):
+    magic (4 bytes, b"FLVW"), version (uint8), padding (3 bytes), env_id (uint32), sequence number (uint64),
+    followed by the INFO_FIELDS as float32
+
+Usage as follows:
+    env = FlatlandsEnv(viewer_address=("127.0.0.1", 5600))
+
+    flatlands-viewer --port 5600
+"""
+
+import sys
+import time
+import socket
+import struct
+import logging
+import argparse
+
+LOGGER = logging.getLogger("viewer")
+
+MAGIC = b"FLVW"
+PROTOCOL_VERSION = 1
+
+DEFAULT_ADDRESS = ("127.0.0.1", 5600)
+
+# get_info_object() fields sent for every step, in order. Models without a steering angle send 0.
+INFO_FIELDS = (
+    "car_position_x",
+    "car_position_y",
+    "car_direction",
+    "steering_angle",
+    "car_speed",
+    "car_accel",
+    "max_wheel_angle",
+    "max_speed",
+    "max_accel",
+    "wheelbase",
+)
+
+HEADER = struct.Struct("<4sB3xIQ")
+STATE = struct.Struct("<" + "f" * len(INFO_FIELDS))
+PACKET_SIZE = HEADER.size + STATE.size
+
+
+def pack_state(info_object, env_id=0, sequence=0):
+    """
+    Packs the info object of a vehicle model into a datagram
+
+    Accepts:
+        info_object: a dict as returned by get_info_object()
+        env_id: identifies the publishing env, for viewers watching one of several
+        sequence: number of the step, older datagrams arriving late are dropped by the viewer
+    Returns: the datagram, PACKET_SIZE bytes
+    """
+
+    return HEADER.pack(MAGIC, PROTOCOL_VERSION, env_id, sequence) + STATE.pack(
+        *(float(info_object.get(field) or 0.0) for field in INFO_FIELDS))
+
+
+def unpack_state(packet):
+    """
+    Unpacks a datagram built by pack_state()
+
+    Accepts: packet: the datagram
+    Returns: a 3-tuple of the env id, the sequence number and the info object, or None if it's no state datagram
+    """
+
+    if len(packet) != PACKET_SIZE:
+        return None
+    magic, version, env_id, sequence = HEADER.unpack_from(packet)
+    if magic != MAGIC or version != PROTOCOL_VERSION:
+        return None
+
+    info_object = dict(zip(INFO_FIELDS, STATE.unpack_from(packet, HEADER.size)))
+    return env_id, sequence, info_object
+
+
+class StatePublisher(object):
+    """
+    Sends the state of a car to a viewer address, whether or not a viewer is listening
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, env_id=0):
+        """
+        :param address: (host, port) the viewer listens on
+        :param env_id: identifies the publishing env
+        """
+
+        self.address = tuple(address)
+        self.env_id = env_id
+        self.sequence = 0
+
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+
+    def publish(self, info_object, env_id=None):
+        """
+        Sends the state of a car, see pack_state()
+
+        Accepts:
+            info_object: a dict as returned by get_info_object()
+            env_id: identifies the car, the env_id of the publisher by default
+        Returns: Nothing
+        """
+
+        self.sequence += 1
+        env_id = self.env_id if env_id is None else env_id
+        try:
+            self._socket.sendto(pack_state(info_object, env_id, self.sequence), self.address)
+        except OSError as error:
+            # A full send buffer or a missing viewer must never stop the simulation
+            LOGGER.debug("Dropped a state datagram: %s", error)
+
+    def close(self):
+        """
+        Closes the socket
+        """
+
+        self._socket.close()
+
+
+def view(address=DEFAULT_ADDRESS, env_id=None, track_file=None, max_fps=60):
+    """
+    Draws the states received on an address until the window is closed
+
+    Accepts:
+        address: (host, port) to listen on
+        env_id: the env to watch, the first one heard from by default
+        track_file: the track the envs drive on, the one installed with the package by default
+        max_fps: upper bound of the number of frames drawn per second
+    Returns: Nothing
+    """
+
+    # Deferred so that publishers never load the track or pygame through this module
+    import pygame
+    from .envs.flatlands_env import DEFAULT_MAP_FILE
+    from .envs.flatlands_sim.world import load_world
+    from .envs.flatlands_sim.draw import DrawMap
+
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(tuple(address))
+    receiver.setblocking(False)
+    LOGGER.info("Listening for states on %s:%d", *address)
+
+    draw_map = DrawMap(load_world(track_file or DEFAULT_MAP_FILE))
+    draw_map.draw()
+
+    last_sequence = -1
+    frame_time = 1.0 / max_fps
+    while True:
+        frame_start = time.perf_counter()
+
+        # Only the most recent state counts, skip whatever queued up since the last frame
+        latest = None
+        while True:
+            try:
+                packet = receiver.recv(PACKET_SIZE + 1)
+            except BlockingIOError:
+                break
+            state = unpack_state(packet)
+            if state is None:
+                continue
+            if env_id is None:
+                env_id = state[0]
+            if state[0] == env_id and last_sequence < 0:
+                LOGGER.info("Receiving the states of env %d", env_id)
+            # Lower sequence numbers are late datagrams, unless much lower: then the publisher restarted
+            if state[0] == env_id and (state[1] > last_sequence or state[1] + 1000 < last_sequence):
+                latest = state
+                last_sequence = state[1]
+
+        # Handled here rather than by draw_car(), so that the window also closes while no state arrives
+        if any(event.type == pygame.QUIT for event in pygame.event.get()):
+            LOGGER.info("Pygame window closed, stopping the viewer")
+            draw_map.shutdown()
+            break
+        if latest is not None:
+            draw_map.draw_car(latest[2])
+
+        time.sleep(max(0.0, frame_time - (time.perf_counter() - frame_start)))
+
+    receiver.close()
+
+
+def main(argv=None):
+    """
+    Command line entry point, see `flatlands-viewer --help`
+    """
+
+    parser = argparse.ArgumentParser(description="Watch running Flatlands envs, see flatlands/viewer.py")
+    parser.add_argument("--host", default=DEFAULT_ADDRESS[0], help="address to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_ADDRESS[1], help="UDP port to listen on")
+    parser.add_argument("--env-id", type=int, default=None, help="env to watch (default: the first one heard from)")
+    parser.add_argument("--track", default=None, help="track file (default: the one installed with the package)")
+    parser.add_argument("--max-fps", type=float, default=60, help="maximum number of frames per second")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+    try:
+        view((args.host, args.port), env_id=args.env_id, track_file=args.track, max_fps=args.max_fps)
+    except KeyboardInterrupt:
+        LOGGER.info("Viewer stopped")
+
+
+if __name__ == "__main__":
+    main()
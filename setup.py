@@ -14,6 +14,7 @@ setup(
     name='flatlands',
     install_requires=[
         'gym',
+        'numpy>=1.20',
         'scipy',
         'pyproj',
         'pygame',
@@ -31,8 +32,18 @@ setup(
     ],
     keywords='driving simulation gym',  # Optional,
     license='MIT',
-    python_requires='>=3',
+    python_requires='>=3.7',
     data_files=[('flatlands', ['map_files/original_circuit_green.csv'])],
     packages=find_packages(),
     include_package_data=True,
+    entry_points={
+        'console_scripts': [
+            'flatlands-server=flatlands.server:main',
+            'flatlands-eval=flatlands.evaluate:main',
+            'flatlands-bench=flatlands.bench:main',
+            'flatlands-viewer=flatlands.viewer:main',
+            'flatlands-replay=flatlands.replay:main',
+            'flatlands-dataset=flatlands.dataset:main',
+        ],
+    },
 )
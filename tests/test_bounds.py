@@ -0,0 +1,101 @@
+"""
+Checks the on-track tests of TrackBounds, the footprints of the vehicle models and that both envs end episodes alike
+"""
+
+import numpy as np
+import pytest
+
+from flatlands.envs.flatlands_env import FlatlandsEnv
+from flatlands.envs.flatlands_sim.bounds import TrackBounds
+from flatlands.envs.flatlands_sim.vehicle_model import BicycleModel, DynamicBicycleModel
+from flatlands.envs.flatlands_vec_env import FlatlandsVecEnv
+
+LENGTH = 2.6
+WIDTH = 1.2
+
+
+def _straight_road(half_width=2.0, length=100.0, pieces=10):
+    """
+    A road along the y-axis from x = -half_width to half_width, split into quads
+    """
+
+    ys = np.linspace(0, length, pieces + 1)
+    return TrackBounds(np.stack([
+        np.column_stack([np.full(pieces, -half_width), ys[:-1]]),
+        np.column_stack([np.full(pieces, half_width), ys[:-1]]),
+        np.column_stack([np.full(pieces, half_width), ys[1:]]),
+        np.column_stack([np.full(pieces, -half_width), ys[1:]]),
+    ], axis=1))
+
+
+def test_contains():
+    bounds = _straight_road()
+    points = np.array([[0, 50], [1.9, 0.1], [-1.9, 99.9], [2.1, 50], [0, -0.1], [0, 100.1], [-30, 50]])
+
+    np.testing.assert_array_equal(bounds.contains(points), [True, True, True, False, False, False, False])
+    assert bounds.contains(np.zeros((3, 4, 2))).shape == (3, 4)
+
+
+@pytest.mark.parametrize("x, heading, expected", [
+    # Facing along the road, the footprint spans x +- WIDTH / 2
+    (0.0, 0.0, {"center": True, "any": True, "all": True}),
+    (1.5, 0.0, {"center": True, "any": False, "all": True}),
+    (2.3, 0.0, {"center": False, "any": False, "all": True}),
+    (2.7, 0.0, {"center": False, "any": False, "all": False}),
+    # Facing across it, x +- LENGTH / 2
+    (0.5, np.pi / 2, {"center": True, "any": True, "all": True}),
+    (1.0, np.pi / 2, {"center": True, "any": False, "all": True}),
+    (-3.0, np.pi / 2, {"center": False, "any": False, "all": True}),
+    (-3.5, np.pi / 2, {"center": False, "any": False, "all": False}),
+])
+def test_footprint_inside_modes(x, heading, expected):
+    bounds = _straight_road()
+
+    for mode, inside in expected.items():
+        result = bounds.footprint_inside([[x, 50.0]], [heading], LENGTH, WIDTH, mode=mode)
+        np.testing.assert_array_equal(result, [inside], err_msg=mode)
+
+    with pytest.raises(ValueError):
+        bounds.footprint_inside([[x, 50.0]], [heading], LENGTH, WIDTH, mode="corner")
+
+
+def test_footprint_centers():
+    heading = 0.3
+    forward = np.array([np.sin(heading), np.cos(heading)])
+
+    # The kinematic position is the rear axle, half the wheelbase behind the middle
+    kinematic = BicycleModel(10.0, -5.0, heading, wheelbase=LENGTH)
+    np.testing.assert_allclose(kinematic.footprint_center, [10.0, -5.0] + LENGTH / 2 * forward)
+
+    # The dynamic one is the center of gravity, cg_to_front behind the front axle
+    dynamic = DynamicBicycleModel(10.0, -5.0, heading, wheelbase=LENGTH, cg_to_front=0.8)
+    np.testing.assert_allclose(dynamic.footprint_center, [10.0, -5.0] + (0.8 - LENGTH / 2) * forward)
+
+    # The footprint of a car on the edge of the road, facing along it, shifts with the position it is centered on
+    bounds = _straight_road()
+    for model, inside in ((kinematic, False), (dynamic, True)):
+        model.set(0.0, 100.0 - LENGTH / 2 + 0.1, 0.0)
+        np.testing.assert_array_equal(
+            bounds.footprint_inside([model.footprint_center], [0.0], LENGTH, WIDTH, mode="any"), [inside])
+
+
+@pytest.mark.parametrize("vehicle", ["kinematic", "dynamic"])
+@pytest.mark.parametrize("mode", ["center", "any", "all"])
+def test_vec_env_ends_episodes_like_env(vehicle, mode):
+    env = FlatlandsEnv(off_track=mode, vehicle=vehicle, flat_observations=True)
+    vec_env = FlatlandsVecEnv(1, off_track=mode, vehicle=vehicle)
+    env.reset(start_index=100)
+    vec_env.reset()
+    x, y, theta = env.vehicle_model.pose
+    vec_env.states[0, :3] = [x, y, theta]
+
+    # Speeding up with the wheels turned until well off the track
+    env_dones, vec_dones = [], []
+    for _ in range(80):
+        env.step([0.1, 0.3])
+        vec_env.step([[0.1, 0.3]])
+        env_dones.append(env.done)
+        vec_dones.append(bool(vec_env.dones[0]))
+
+    assert env_dones[-1]
+    assert env_dones == vec_dones
@@ -0,0 +1,92 @@
+"""
+Checks the projection of points onto a centerline against measuring every segment
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+from flatlands.envs.flatlands_sim.centerline import Centerline
+from flatlands.envs.flatlands_sim.world import WorldMap
+
+TRACK_FILE = os.path.join(os.path.dirname(__file__), os.pardir, "map_files", "original_circuit_green.csv")
+
+
+def _brute_force_distances(centerline, xy):
+    """
+    Distance of every point to its closest segment
+    """
+
+    relative = xy[:, None, :] - centerline.points[None, :-1]
+    along = np.clip(np.einsum("mkj,kj->mk", relative, centerline.tangents), 0, centerline.segment_lengths)
+    foot = centerline.points[None, :-1] + along[..., None] * centerline.tangents
+    return np.hypot(*(xy[:, None, :] - foot).transpose(2, 0, 1)).min(axis=1)
+
+
+def _near(centerline, num_points=4000, spread=5.0, seed=0):
+    """
+    Points within about `spread` meters of the centerline
+    """
+
+    rng = np.random.default_rng(seed)
+    s = rng.uniform(0, centerline.length, num_points)
+    return centerline.from_frenet(s, rng.uniform(-spread, spread, num_points)) + rng.normal(0, 1, (num_points, 2))
+
+
+def _polygon(num_sides=5, radius=200.0):
+    """
+    A closed track of a few long straights
+    """
+
+    angles = np.linspace(0, 2 * np.pi, num_sides, endpoint=False)
+    return Centerline(np.column_stack([radius * np.sin(angles), radius * np.cos(angles)]))
+
+
+def _zigzag():
+    """
+    An open track of segments of very different lengths
+    """
+
+    xs = np.cumsum(np.tile([1.0, 60.0, 0.5, 25.0], 10))
+    ys = np.tile([0.0, 8.0], 20)
+    return Centerline(np.column_stack([xs, ys]), closed=False)
+
+
+def _hairpin():
+    """
+    A closed track whose single segment straight runs past the many points of the way back
+    """
+
+    way_back = np.column_stack([np.linspace(100, 0, 101), np.full(101, 6.0)])
+    return Centerline(np.vstack([[0.0, 0.0], way_back]))
+
+
+def _track():
+    return WorldMap(TRACK_FILE).centerline
+
+
+@pytest.mark.parametrize("make_centerline", [_polygon, _zigzag, _hairpin, _track])
+def test_projection_finds_closest_segment(make_centerline):
+    centerline = make_centerline()
+    xy = _near(centerline)
+
+    s, d, _ = centerline.to_frenet(xy)
+
+    # The projection is as near as the closest segment, and the lateral offset no further (past a corner, the offset
+    # is only the perpendicular part of the distance)
+    distances = np.hypot(*(xy - centerline.from_frenet(s)).T)
+    expected = _brute_force_distances(centerline, xy)
+    np.testing.assert_allclose(distances, expected, rtol=0, atol=1e-9)
+    assert np.all(np.abs(d) <= distances + 1e-9)
+
+
+@pytest.mark.parametrize("level", [0, 1, 2, 3])
+def test_level_of_detail_projection_finds_closest_segment(level):
+    centerline = WorldMap(TRACK_FILE).get_lod(level)
+    xy = _near(centerline)
+
+    s, _, _ = centerline.to_frenet(xy)
+
+    distances = np.hypot(*(xy - centerline.from_frenet(s)).T)
+    np.testing.assert_allclose(distances, _brute_force_distances(centerline, xy), rtol=0, atol=1e-9)
@@ -0,0 +1,42 @@
+"""
+Checks the dynamic bicycle model: its rollouts against stepping the model, and the batched vehicle of the vec env
+"""
+
+import numpy as np
+import pytest
+
+from flatlands.envs.flatlands_sim.vehicle_model import DynamicBicycleModel
+from flatlands.envs.flatlands_vec_env import FlatlandsVecEnv
+
+
+def _actions(num_candidates=3, horizon=40, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.stack([rng.uniform(-0.1, 0.1, (num_candidates, horizon)),
+                     rng.uniform(-0.6, 0.6, (num_candidates, horizon))], axis=-1)
+
+
+def test_rollout_matches_move_accel():
+    params = {"max_velocity": 1, "dt": 0.2, "mass": 1300}
+    model = DynamicBicycleModel(10.0, -5.0, 0.3, **params)
+    model.move_accel(0.1, 0.0)
+    actions = _actions()
+
+    trajectories = model.rollout(actions)
+
+    assert trajectories.shape == actions.shape[:2] + (6, )
+    for candidate, candidate_actions in enumerate(actions):
+        stepped = DynamicBicycleModel(10.0, -5.0, 0.3, **params)
+        stepped.set_state(model.get_state())
+        for step, (accel, wheel_angle) in enumerate(candidate_actions):
+            stepped.move_accel(accel, wheel_angle)
+            expected = [*stepped.position, stepped.orientation, stepped.velocity, stepped.lateral_velocity,
+                        stepped.yaw_rate]
+            np.testing.assert_allclose(trajectories[candidate, step], expected, rtol=0, atol=1e-9)
+
+
+def test_vec_env_rejects_unknown_kinematic_params():
+    with pytest.raises(ValueError):
+        FlatlandsVecEnv(2, vehicle_params={"mass": 1300})
+
+    vec_env = FlatlandsVecEnv(2, vehicle_params={"max_accel": 0.2})
+    np.testing.assert_allclose(vec_env.action_space.high[0], 0.2)
@@ -0,0 +1,40 @@
+"""
+Checks the gym interface of FlatlandsEnv
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+from flatlands.envs import FlatlandsEnv
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+
+@pytest.mark.parametrize("flat_observations", [False, True])
+def test_steps_and_renders_sampled_actions(flat_observations):
+    env = FlatlandsEnv(seed=0, flat_observations=flat_observations)
+    env.action_space.seed(0)
+    env.reset()
+
+    for _ in range(5):
+        observation = env.step(env.action_space.sample())
+        env.render()
+
+    if flat_observations:
+        assert env.observation_space.contains(observation)
+    assert isinstance(env.vehicle_model.velocity, float)
+
+
+def test_array_and_dict_actions_step_alike():
+    # Seeded alike, so that they reset to the same place
+    envs = [FlatlandsEnv(seed=0, flat_observations=True) for _ in range(2)]
+    for env in envs:
+        env.reset()
+
+    for accel, wheel_angle in [(0.1, 0.0), (0.05, 0.2), (-0.02, -0.1)]:
+        array = envs[0].step(np.array([accel, wheel_angle], dtype=np.float32)).copy()
+        mapping = envs[1].step({"accel": np.float32(accel), "wheel_angle": np.float32(wheel_angle)})
+        np.testing.assert_array_equal(array, mapping)
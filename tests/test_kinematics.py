@@ -0,0 +1,93 @@
+"""
+Checks the analytic linearization of the bicycle model against finite differences of bicycle_step
+"""
+
+import numpy as np
+import pytest
+
+from flatlands.envs.flatlands_sim.kinematics import bicycle_step, bicycle_jacobians, linearize, rollout, THETA
+
+# Central differences of bicycle_step are accurate to ~1e-9 at this step, the analytic Jacobians should agree
+STEP = 1e-6
+TOLERANCE = 1e-8
+
+
+def _step_difference(after, before):
+    """
+    Difference of two next states, with the heading difference unwrapped
+    """
+
+    difference = after - before
+    difference[..., THETA] = (difference[..., THETA] + np.pi) % (2 * np.pi) - np.pi
+    return difference
+
+
+def _finite_differences(states, actions):
+    """
+    Central differences of bicycle_step with respect to every state and action value
+    """
+
+    state_jacobians = np.empty(states.shape + (states.shape[-1], ))
+    for column in range(states.shape[-1]):
+        offset = np.zeros(states.shape)
+        offset[..., column] = STEP
+        difference = _step_difference(bicycle_step(states + offset, actions), bicycle_step(states - offset, actions))
+        state_jacobians[..., column] = difference / (2 * STEP)
+
+    action_jacobians = np.empty(states.shape + (actions.shape[-1], ))
+    for column in range(actions.shape[-1]):
+        offset = np.zeros(actions.shape)
+        offset[..., column] = STEP
+        difference = _step_difference(bicycle_step(states, actions + offset), bicycle_step(states, actions - offset))
+        action_jacobians[..., column] = difference / (2 * STEP)
+
+    return state_jacobians, action_jacobians
+
+
+@pytest.mark.parametrize("wheel_angles", [
+    np.linspace(-0.9, 0.9, 7),
+    np.array([0.0, 1e-9, -1e-6, 1e-4, -2e-3, 5e-3]),
+])
+def test_jacobians_match_finite_differences(wheel_angles):
+    rng = np.random.default_rng(0)
+    num_states = len(wheel_angles)
+    # Velocities and accelerations stay within their limits, where the clipping has no kink
+    states = np.column_stack([
+        rng.uniform(-50, 50, num_states),
+        rng.uniform(-50, 50, num_states),
+        rng.uniform(0, 2 * np.pi, num_states),
+        rng.uniform(0.1, 0.4, num_states),
+    ])
+    actions = np.column_stack([rng.uniform(-0.05, 0.05, num_states), wheel_angles])
+
+    state_jacobians, action_jacobians = bicycle_jacobians(states, actions)
+    expected_state, expected_action = _finite_differences(states, actions)
+
+    np.testing.assert_allclose(state_jacobians, expected_state, rtol=0, atol=TOLERANCE)
+    np.testing.assert_allclose(action_jacobians, expected_action, rtol=0, atol=TOLERANCE)
+
+
+def test_clipped_values_have_zero_derivative():
+    states = np.array([[0.0, 0.0, 0.0, 0.5], [0.0, 0.0, 0.0, 0.2]])
+    actions = np.array([[0.05, 0.1], [0.5, 2.0]])
+
+    state_jacobians, action_jacobians = bicycle_jacobians(states, actions)
+
+    # At max velocity, then with the acceleration and wheel angle past their limits
+    np.testing.assert_array_equal(state_jacobians[0, :, 3], 0)
+    np.testing.assert_array_equal(action_jacobians[:, :, 0], 0)
+    np.testing.assert_array_equal(action_jacobians[1, :, 1], 0)
+
+
+def test_linearize_follows_rollout():
+    rng = np.random.default_rng(1)
+    actions = np.column_stack([rng.uniform(-0.05, 0.05, 20), rng.uniform(-0.5, 0.5, 20)])[None]
+    pose, velocity = np.array([3.0, -2.0, 1.0]), 0.3
+
+    trajectories, state_jacobians, action_jacobians = linearize(pose, velocity, actions)
+
+    np.testing.assert_array_equal(trajectories, rollout(pose, velocity, actions))
+    before = np.concatenate([[[*pose, velocity]], trajectories[0, :-1]])
+    expected_state, expected_action = bicycle_jacobians(before, actions[0])
+    np.testing.assert_array_equal(state_jacobians[0], expected_state)
+    np.testing.assert_array_equal(action_jacobians[0], expected_action)
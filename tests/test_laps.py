@@ -0,0 +1,46 @@
+"""
+Checks the lap and sector times of FlatlandsEnv against a drive along a straight segment of the track
+"""
+
+import numpy as np
+
+from flatlands.envs import FlatlandsEnv
+
+ACCEL = 0.1
+
+
+def _crossing_time(distance):
+    """
+    Steps until a car accelerating by ACCEL per step from rest has covered a distance. The velocity is updated first
+    at every step, so during step k the car drives (k + 1) * ACCEL meters at a constant speed.
+    """
+
+    step, covered = 0, 0.0
+    while covered + (step + 1) * ACCEL < distance:
+        step += 1
+        covered += step * ACCEL
+    return step + (distance - covered) / ((step + 1) * ACCEL)
+
+
+def test_sector_crossings_match_straight_drive():
+    env = FlatlandsEnv(seed=0)
+    centerline = env.world.centerline
+    # The longest segment, driven along from its start
+    segment = int(np.argmax(centerline.segment_lengths))
+    start = centerline.points[segment]
+    s0 = centerline.cumulative_length[segment]
+
+    distances = (1.23, 4.56)
+    env = FlatlandsEnv(seed=0, sectors=[s0 + distance for distance in distances])
+    start_index = int(np.argmin(np.hypot(*(env.world.path_array - start).T)))
+    env.reset(start_index=start_index)
+    env.vehicle_model.set(start[0], start[1], float(centerline.headings[segment]))
+
+    for _ in range(int(np.ceil(_crossing_time(distances[-1])))):
+        env.step([ACCEL, 0.0])
+
+    first, second = (_crossing_time(distance) for distance in distances)
+    timer = env.lap_timer
+    assert timer.sector == 2
+    np.testing.assert_allclose(timer.sector_start, second, rtol=0, atol=1e-9)
+    np.testing.assert_allclose(timer.sector_times[1], second - first, rtol=0, atol=1e-9)
@@ -0,0 +1,48 @@
+"""
+Checks the distribution of NoiseBuffer integers and that restoring a packed state replays the same stream
+"""
+
+import numpy as np
+import pytest
+
+from flatlands.envs.flatlands_sim.noise import NoiseBuffer, STATE_WORDS
+
+DRAWS = 20000
+
+
+@pytest.mark.parametrize("low, high", [(0, 5), (-3, 2), (-7, -4), (10, 11)])
+def test_randint_is_uniform_over_range(low, high):
+    noise = NoiseBuffer(seed=0, block_size=1000)
+    values = np.array([noise.randint(low, high) for _ in range(DRAWS)])
+
+    assert values.min() == low and values.max() == high - 1
+    counts = np.bincount(values - low, minlength=high - low)
+    # Binomial counts stay within 5 standard deviations of their mean
+    expected = DRAWS / (high - low)
+    assert np.all(np.abs(counts - expected) <= 5 * np.sqrt(expected) + 1e-9)
+
+
+def _draws(noise):
+    """
+    Scalars and batches from the same stream, through a few block refills
+    """
+
+    scalars = [noise.uniform(-1, 1) for _ in range(150)] + [noise.randint(-5, 5) for _ in range(150)]
+    batches = [noise.uniform_batch(0, 2, (7, 3)) for _ in range(20)]
+    return np.concatenate([scalars] + [batch.ravel() for batch in batches])
+
+
+@pytest.mark.parametrize("drawn", [0, 1, 99, 100, 250])
+def test_restored_state_replays_stream(drawn):
+    noise = NoiseBuffer(seed=1, block_size=100)
+    noise.uniform_batch(0, 1, drawn)
+    state = noise.get_state()
+    assert state.shape == (STATE_WORDS, ) and state.dtype == np.uint64
+    expected = _draws(noise)
+
+    # The same buffer rewound, and another one seeded differently
+    noise.set_state(state)
+    np.testing.assert_array_equal(_draws(noise), expected)
+    other = NoiseBuffer(seed=2, block_size=100)
+    other.set_state(state.copy())
+    np.testing.assert_array_equal(_draws(other), expected)
@@ -0,0 +1,98 @@
+"""
+Checks the lookups of the track raster against the exact track bounds and nearest track points
+"""
+
+import os
+
+import numpy as np
+import pytest
+from scipy.spatial import cKDTree
+
+from flatlands.envs.flatlands_sim.world import load_world
+
+TRACK_FILE = os.path.join(os.path.dirname(__file__), os.pardir, "map_files", "original_circuit_green.csv")
+
+# Spacing of the edge samples the exact distances on the track are measured to, and the error it adds
+REFERENCE_SPACING = 0.005
+
+
+@pytest.fixture(scope="module")
+def world():
+    return load_world(TRACK_FILE, cache_dir=False)
+
+
+def _queries(world, raster, num_queries=5000, seed=0):
+    """
+    Queries all over the grid, just off the track edge and beyond the grid
+    """
+
+    rng = np.random.default_rng(seed)
+    upper = raster.origin + np.array(raster.shape) * raster.resolution
+    anywhere = rng.uniform(raster.origin, upper, (num_queries, 2))
+    edge = world.track_bounds.edge_points(1.0)
+    near_edge = edge[rng.integers(len(edge), size=num_queries)] + rng.normal(0, raster.resolution, (num_queries, 2))
+    beyond = rng.uniform(raster.origin - 20, upper + 20, (num_queries, 2))
+    return np.concatenate([anywhere, near_edge, beyond])
+
+
+def _segment_distances(points, starts, ends):
+    """
+    Distance of every point to the nearest of the segments, by brute force
+    """
+
+    sides = ends - starts
+    relative = points[:, None, :] - starts[None, :, :]
+    along = np.clip(np.sum(relative * sides, axis=-1) / np.sum(sides * sides, axis=-1), 0, 1)
+    offsets = relative - along[..., None] * sides
+    return np.hypot(offsets[..., 0], offsets[..., 1]).min(axis=1)
+
+
+def _exact_signed_distances(world, points):
+    """
+    Off the track, the distance to the nearest quad side. On it, the distance to the dense samples of the edge.
+    """
+
+    bounds = world.track_bounds
+    inside = bounds.contains(points)
+    distances = np.empty(len(points))
+
+    starts = bounds.quads.reshape(-1, 2)
+    ends = np.roll(bounds.quads, -1, axis=1).reshape(-1, 2)
+    sides = np.any(starts != ends, axis=1)
+    starts, ends = starts[sides], ends[sides]
+    for start in range(0, len(points), 500):
+        batch = slice(start, start + 500)
+        distances[batch] = _segment_distances(points[batch], starts, ends)
+
+    edge = cKDTree(bounds.edge_points(REFERENCE_SPACING))
+    distances[inside] = edge.query(points[inside])[0]
+    return np.where(inside, distances, -distances)
+
+
+@pytest.mark.parametrize("resolution", [1.0, 0.7])
+def test_raster_matches_exact_bounds(world, resolution):
+    raster = world.get_raster(resolution)
+    queries = _queries(world, raster)
+    exact = _exact_signed_distances(world, queries)
+    half_diagonal = resolution / np.sqrt(2)
+
+    in_grid = raster.cell_indices(queries)[2]
+    signed_distances = raster.signed_distance(queries)
+    tolerance = half_diagonal + resolution / 32 + REFERENCE_SPACING
+
+    # Off by the cell center, which is at most half a cell diagonal away, and the sampling of the edge
+    assert np.abs(signed_distances - exact)[in_grid].max() <= tolerance
+    # Beyond the grid, off the track and at least as far from it as the border cell and the grid
+    assert not np.any(raster.on_track(queries[~in_grid]))
+    assert np.all(signed_distances[~in_grid] <= exact[~in_grid] + tolerance)
+
+    # The cell center is on the other side of the edge only for the points that close to it
+    disagree = raster.on_track(queries) != world.track_bounds.contains(queries)
+    assert 0 < np.count_nonzero(disagree) < len(queries) // 10
+    assert np.all(np.abs(exact[disagree]) <= half_diagonal + REFERENCE_SPACING)
+
+    # The nearest track point of the cell center is at most as far again as the center
+    nearest = raster.nearest_index(queries[in_grid])
+    found = np.hypot(*(world.path_array[nearest] - queries[in_grid]).T)
+    expected = world.spatial_index.query(queries[in_grid])[0]
+    assert np.all(found <= expected + 2 * half_diagonal + 1e-9)
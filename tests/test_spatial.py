@@ -0,0 +1,82 @@
+"""
+Checks that every spatial backend returns the exact nearest point, as the brute force backend measures it
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+from flatlands.envs.flatlands_sim.spatial import BruteForceIndex, GridIndex, KDTreeIndex
+from flatlands.envs.flatlands_sim.world import load_world
+
+TRACK_FILE = os.path.join(os.path.dirname(__file__), os.pardir, "map_files", "original_circuit_green.csv")
+
+
+def _circle(num_points=500, radius=80.0):
+    angles = np.linspace(0, 2 * np.pi, num_points, endpoint=False)
+    points = np.column_stack([radius * np.sin(angles), radius * np.cos(angles)])
+    # Closed like a track, the last point duplicates the first
+    return np.concatenate([points, points[:1]])
+
+
+def _random_walk(num_points=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    headings = np.cumsum(rng.normal(0, 0.1, num_points))
+    return np.cumsum(np.column_stack([np.sin(headings), np.cos(headings)]), axis=0)
+
+
+def _track():
+    return load_world(TRACK_FILE, cache_dir=False).path_array
+
+
+def _queries(points, num_queries=20000, seed=1):
+    """
+    Queries along the points, on a lattice over them and far away from them
+    """
+
+    rng = np.random.default_rng(seed)
+    near = points[rng.integers(len(points), size=num_queries)] + rng.normal(0, 3, (num_queries, 2))
+    lower, upper = points.min(axis=0), points.max(axis=0)
+    far = rng.uniform(lower - 100, upper + 100, (num_queries, 2))
+    # Queries on a half meter lattice fall on the cell borders of round cell sizes
+    lattice = np.round(rng.uniform(lower, upper, (num_queries, 2)) * 2) / 2
+    return np.concatenate([near, far, lattice, points])
+
+
+@pytest.mark.parametrize("make_points", [_circle, _random_walk, _track])
+@pytest.mark.parametrize("make_index", [
+    KDTreeIndex,
+    GridIndex,
+    lambda points: GridIndex(points, cell_size=0.3, margin=2.0, max_candidates=4),
+])
+def test_backends_match_brute_force(make_points, make_index):
+    points = make_points()
+    queries = _queries(points)
+
+    expected_distances, expected_indexes = BruteForceIndex(points).query(queries)
+    distances, indexes = make_index(points).query(queries)
+
+    np.testing.assert_allclose(distances, expected_distances, rtol=1e-12, atol=0)
+    # Another index is only fine where its point is exactly as near, such as the duplicated start of a closed track
+    differing = indexes != expected_indexes
+    np.testing.assert_allclose(np.hypot(*(points[indexes[differing]] - queries[differing]).T),
+                               expected_distances[differing], rtol=1e-12, atol=0)
+
+
+def test_grid_returns_lowest_index_among_ties():
+    points = _circle()
+    distances, indexes = GridIndex(points).query(points[[0, -1]])
+
+    np.testing.assert_array_equal(distances, 0)
+    np.testing.assert_array_equal(indexes, 0)
+
+
+def test_query_shapes():
+    points = _circle()
+    index = GridIndex(points)
+
+    distance, nearest = index.query(points[3])
+    assert np.ndim(distance) == 0 and nearest == 3
+    distances, indexes = index.query(np.zeros((4, 5, 2)))
+    assert distances.shape == indexes.shape == (4, 5)
@@ -0,0 +1,36 @@
+"""
+Checks the car states envs publish to a viewer
+"""
+
+import pickle
+import socket
+
+import pytest
+
+from flatlands.envs import FlatlandsEnv
+from flatlands.viewer import PACKET_SIZE, unpack_state
+
+
+@pytest.fixture
+def receiver():
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(("127.0.0.1", 0))
+    receiver.settimeout(5)
+    yield receiver
+    receiver.close()
+
+
+def test_envs_publish_under_their_env_id(receiver):
+    address = receiver.getsockname()
+    envs = [FlatlandsEnv(seed=env_id, viewer_address=address, viewer_env_id=env_id) for env_id in (0, 3)]
+    # Pickled envs, e.g. sent to the workers of a pool, keep their env id
+    envs.append(pickle.loads(pickle.dumps(FlatlandsEnv(seed=5, viewer_address=address, viewer_env_id=5))))
+
+    for env in envs:
+        env.reset()
+        env.step([0.1, 0.0])
+
+    received = [unpack_state(receiver.recv(PACKET_SIZE)) for _ in envs]
+    assert [env_id for env_id, _, _ in received] == [0, 3, 5]
+    assert all(sequence == 1 for _, sequence, _ in received)
+    assert received[1][2]["car_position_x"] == pytest.approx(envs[1].vehicle_model.position[0], rel=1e-6)
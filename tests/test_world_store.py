@@ -0,0 +1,73 @@
+"""
+Checks that pickled envs and worlds, and the arrays shared through the track store, give identical results
+"""
+
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytest
+
+from flatlands.envs import FlatlandsEnv
+from flatlands.envs.flatlands_sim.world import WorldMap, load_world
+
+TRACK_FILE = os.path.join(os.path.dirname(__file__), os.pardir, "map_files", "original_circuit_green.csv")
+
+
+def _drive(env, num_steps=50, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.array([env.step(rng.uniform(-1, 1, 2) * env.action_space.high).copy() for _ in range(num_steps)])
+
+
+def _world_arrays(world):
+    """
+    Everything the world derives from its track and stores
+    """
+
+    raster = world.get_raster(1.0)
+    arrays = {"path": world.path_array, "arc_length": world.path_arc_length, "track_data": world.track_data,
+              "occupancy": raster.occupancy, "signed_distance": raster.signed_distance_grid,
+              "nearest_index": raster.nearest_index_grid}
+    for level in range(world.num_lods):
+        arrays["lod_{}".format(level)] = world.get_lod(level).points
+    return arrays
+
+
+@pytest.fixture
+def env(tmp_path):
+    world = load_world(TRACK_FILE, cache_dir=str(tmp_path))
+    env = FlatlandsEnv(seed=5, noise=5, flat_observations=True, off_track="any", off_track_resolution=1.0,
+                       world=world)
+    env.reset()
+    _drive(env, 20, seed=1)
+    return env
+
+
+def test_pickled_env_continues_identically(env):
+    copy = pickle.loads(pickle.dumps(env))
+
+    # Within a process the pickled world maps back to the loaded one
+    assert copy.world is env.world
+    np.testing.assert_array_equal(_drive(copy), _drive(env))
+
+
+def test_pickled_env_continues_identically_in_another_process(env):
+    payload = pickle.dumps(env)
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        remote = executor.submit(_drive, env).result()
+
+    assert len(payload) < 4096
+    np.testing.assert_array_equal(remote, _drive(env))
+
+
+def test_stored_arrays_match_built_ones(tmp_path):
+    built = _world_arrays(load_world(TRACK_FILE, cache_dir=False))
+    # The first world builds and saves its arrays, the second maps them
+    saved = _world_arrays(WorldMap(TRACK_FILE, cache_dir=str(tmp_path)))
+    mapped = _world_arrays(WorldMap(TRACK_FILE, cache_dir=str(tmp_path)))
+
+    assert isinstance(mapped["nearest_index"], np.memmap)
+    for name, array in built.items():
+        np.testing.assert_array_equal(saved[name], array, err_msg=name)
+        np.testing.assert_array_equal(mapped[name], array, err_msg=name)